@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import queue
+import signal
+import asyncio
+import threading
+import concurrent.futures
+
+import polling
+import scheduler
+
+
+class asyncpolling:
+	"""
+	polling tickers of multiple products concurrently in one process.
+
+	one polling object is created for each product, so that every product
+	has its own tick store (CSV/binary) and indicators. tickers are fetched
+	by asyncio tasks, one for each product, and the blocking exchange API is
+	called in a thread pool so that slow response of a product does not
+	delay the others.
+
+	requests to polling module may name the product by "product" key,
+	the first product is selected if not specified.
+	"""
+
+	def __init__(self, exch, products, outdir="", loglv="INFO", reqq=None, rspq=None, stop_flag=None, q_get_tov=None, windows=None, flush_rows=60, flush_interval=5.0, output=None, snapshot=None, subscriptions=None, hedge=0):
+		""" constructor
+		 - products : list of product codes, the first one is the primary
+		              product whose ticker is published to shared memory
+		              snapshot and subscriptions
+
+		see polling.polling for the other parameters.
+		"""
+		if len(products) == 0:
+			raise ValueError("no product is specified")
+
+		self.products = [prod.upper() for prod in products]
+		self.reqq = reqq
+		self.stop_flag = stop_flag
+
+		# polling object for each product
+		# requests are dispatched by this object, so reqq is not passed
+		# the primary product keeps the file name of single product polling
+		# (ticker_<exchange>.csv), the others have product code in the name
+		self.polls = {}
+		for prod in self.products:
+			primary = (prod == self.products[0])
+			self.polls[prod] = polling.polling(exch, outdir, loglv,
+			                                   None, rspq, stop_flag, q_get_tov,
+			                                   windows, flush_rows, flush_interval, output,
+			                                   snapshot if primary else None,
+			                                   subscriptions if primary else None,
+			                                   None if primary else prod,
+			                                   hedge)
+			self.polls[prod].product = prod
+			self.polls[prod].latency.name = "polling(%s,%s)" % (exch, prod)
+		self.logger = self.polls[self.products[0]].logger
+
+		# request server thread
+		self.REQ_POLL_TOV = 0.5
+		self.reqthread = None
+		self.reqstop = threading.Event()
+
+
+	def getpolling(self, product=None):
+		""" get polling object of the product
+		 - product : product code, None indicates the primary product
+		"""
+		if product is None:
+			return self.polls[self.products[0]]
+		return self.polls.get(product.upper())
+
+
+	def runRequestServer(self):
+		""" serve requests and dispatch them by product """
+		while not self.stop_flag.is_set() and not self.reqstop.is_set():
+			try:
+				d = self.reqq.get(timeout=self.REQ_POLL_TOV)
+			except queue.Empty:
+				continue
+
+			try:
+				self.serveRequest(d)
+			except Exception as e:
+				self.logger.error("could not serve request %s: %s" % (str(d), str(e)))
+
+
+	def serveRequest(self, d):
+		""" dispatch request to polling object of the requested product
+		 - d : request object
+		"""
+		# unknown product is replied by the primary polling object
+		poll = self.getpolling(d.get("product"))
+		if poll is None:
+			poll = self.getpolling()
+		poll.serveRequest(d)
+
+
+	async def pollproduct(self, poll, executor, interval, count):
+		""" polling ticker of a product (asyncio task)
+		 - poll     : polling object of the product
+		 - executor : thread pool to call exchange API
+		 - interval : polling interval [sec], fraction is allowed
+		 - count    : polling count (negative value indicates infinite loop)
+		"""
+		loop = asyncio.get_running_loop()
+		sched = scheduler.scheduler(interval, logger=self.logger)
+		lpcnt = count
+		while not self.stop_flag.is_set():
+			if count >= 0:
+				if lpcnt <= 0:
+					break
+				lpcnt -= 1
+
+			try:
+				ticker = await loop.run_in_executor(executor, poll.ticker, poll.product)
+			except Exception as e:
+				self.logger.warning("could not get ticker of %s: %s" % (poll.product, str(e)))
+				ticker = None
+
+			if ticker is not None:
+				poll.processticker(ticker)
+			else:
+				self.logger.debug("could not get ticker of %s" % poll.product)
+
+			await sched.asyncwait()
+
+
+	async def pollall(self, interval, count):
+		""" polling tickers of all products concurrently """
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.products),
+		                                                 thread_name_prefix="fetch")
+		try:
+			tasks = [self.pollproduct(self.polls[prod], executor, interval, count)
+			         for prod in self.products]
+			await asyncio.gather(*tasks)
+		finally:
+			executor.shutdown(wait=True)
+
+
+	def pollticker(self, interval=1, count=-1):
+		""" polling tickers of all products
+		 - interval : polling interval [sec], fraction is allowed
+		 - count    : polling count (negative value indicates infinite loop)
+		"""
+
+		# product code check
+		for poll in self.polls.values():
+			if not poll.checkProduct(poll.product):
+				return
+
+		# fetch interval
+		if interval <= 0:
+			self.logger.critical("ERROR: interval is NOT positive number")
+			return
+
+		# ignore interrupt
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+		for poll in self.polls.values():
+			poll.openCSVticker()
+			poll.openBINticker()
+		if self.reqq is not None:
+			self.reqstop.clear()
+			self.reqthread = threading.Thread(target=self.runRequestServer, name="reqserver", daemon=True)
+			self.reqthread.start()
+
+		self.logger.info("polling %s concurrently" % ",".join(self.polls.keys()))
+		try:
+			asyncio.run(self.pollall(interval, count))
+		except KeyboardInterrupt:
+			pass
+		finally:
+			if self.reqthread is not None:
+				self.reqstop.set()
+				self.reqthread.join(self.REQ_POLL_TOV * 2)
+				self.reqthread = None
+			for poll in self.polls.values():
+				poll.closeCSVticker()
+				poll.closeBINticker()
+				poll.latency.log()
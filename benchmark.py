@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from multiprocessing import Queue
+
+import numpy as np
+
+import polling
+
+
+def percentiles(samples):
+	""" summarize latencies of calls
+	 - samples : list of latencies [ns]
+
+	return {"calls", "ops", "mean_us", "p50_us", "p90_us", "p99_us", "max_us"}.
+	"""
+	lat = np.array(samples, dtype=np.float64) / 1000.0
+	total = lat.sum()
+	return {"calls"   : len(lat),
+	        "ops"     : len(lat) / (total / 1e6) if total > 0 else 0.0,
+	        "mean_us" : float(lat.mean()),
+	        "p50_us"  : float(np.percentile(lat, 50)),
+	        "p90_us"  : float(np.percentile(lat, 90)),
+	        "p99_us"  : float(np.percentile(lat, 99)),
+	        "max_us"  : float(lat.max())}
+
+
+def measure(func, calls, *args):
+	""" call function repeatedly and measure latency of each call
+	 - func  : function to be measured
+	 - calls : number of calls
+	 - args  : arguments of function
+	"""
+	samples = [0] * calls
+	clock = time.perf_counter_ns
+	for idx in range(calls):
+		st = clock()
+		func(*args)
+		samples[idx] = clock() - st
+	return percentiles(samples)
+
+
+class benchmark:
+	"""
+	microbenchmarks of the polling hot path.
+
+	every benchmark runs offline against synthetic tickers (random walk of
+	BTC_JPY) on a polling object whose ring buffer is filled to MAXTICKER,
+	and reports throughput (ops/sec) and latency percentiles of each call.
+	results are saved as JSON to be compared between commits (see compare()).
+	"""
+
+	WINDOWS = [30, 60, 300, 600, 1800, 3600]
+
+	def __init__(self, calls=10000, rows=1000000, workdir=None, seed=0):
+		""" constructor
+		 - calls   : number of calls of each benchmark
+		 - rows    : number of rows of CSV file read by readCSVticker
+		 - workdir : directory for log and CSV files (temporary if None)
+		 - seed    : random seed of synthetic tickers
+		"""
+		self.calls = calls
+		self.rows = rows
+		self.seed = seed
+		self.tmpdir = None
+		if workdir is None:
+			workdir = self.tmpdir = tempfile.mkdtemp(prefix="vctsbench")
+		self.workdir = workdir
+
+		self.ticks = self.synthticks(max(calls, 1000))
+		self.results = {}
+
+		# benchmarks in the order of execution
+		self.BENCHES = {"append"           : self.benchappend,
+		                "sma"              : self.benchsma,
+		                "wma"              : self.benchwma,
+		                "xma.update"       : self.benchxmaupdate,
+		                "ticker2str"       : self.benchticker2str,
+		                "writeCSVticker"   : self.benchwritecsv,
+		                "readCSVticker"    : self.benchreadcsv,
+		                "checkRequestQueue": self.benchrequest}
+
+
+	def close(self):
+		""" remove temporary directory """
+		if self.tmpdir is not None:
+			shutil.rmtree(self.tmpdir, ignore_errors=True)
+			self.tmpdir = None
+
+
+	def synthticks(self, count, product="BTC_JPY", price=5000000.0):
+		""" make synthetic tickers in the format of polling.ticker()
+		 - count   : number of tickers
+		 - product : product code
+		 - price   : initial price
+		"""
+		rng = random.Random(self.seed)
+		base = datetime.datetime(2026, 1, 1)
+		ticks = []
+		for idx in range(count):
+			price = max(price + rng.gauss(0.0, 500.0), 1.0)
+			spread = price * 0.0001
+			dt = base + datetime.timedelta(seconds=idx)
+			ticks.append({"product"   : product,
+			              "timestamp" : dt.strftime("%Y-%m-%dT%H:%M:%S.") + "%03d" % rng.randint(0, 999),
+			              "best_bid"  : price - spread,
+			              "best_ask"  : price + spread,
+			              "last"      : price,
+			              "datetime"  : dt.strftime("%Y-%m-%d %H:%M:%S")})
+		return ticks
+
+
+	def newpolling(self, name, output=None, reqq=None, rspq=None):
+		""" create polling object with its own output directory
+		 - name   : name of benchmark (subdirectory)
+		 - output : ticker output formats, None indicates no output file
+		            (binary tick store is not opened until pollticker)
+		 - reqq   : request queue
+		 - rspq   : reply queue
+		"""
+		outdir = os.path.join(self.workdir, name)
+		os.makedirs(outdir, exist_ok=True)
+		return polling.polling("bitflyer", outdir, "WARNING", reqq, rspq,
+		                       windows=self.WINDOWS, output=output or ["binary"])
+
+
+	def fill(self, poll):
+		""" fill ring buffer of polling object to MAXTICKER """
+		count = poll.MAXTICKER - len(poll.tickers)
+		lasts = 5000000.0 + np.cumsum(np.random.default_rng(self.seed).normal(0.0, 500.0, count))
+		stamps = 1767225600.0 + np.arange(count, dtype=np.float64)
+		poll.tickers.extend({"last"      : lasts,
+		                     "best_bid"  : lasts - 500.0,
+		                     "best_ask"  : lasts + 500.0,
+		                     "timestamp" : stamps,
+		                     "datetime"  : stamps})
+		poll.xma.rebuild(poll.tickers.column("last"))
+
+
+	def cycle(self):
+		""" iterator returning synthetic tickers endlessly """
+		while True:
+			for tick in self.ticks:
+				yield tick
+
+
+	############################################################################
+	# benchmarks
+
+	def benchappend(self):
+		""" polling.appendticker on the full ring buffer (wrap-around) """
+		poll = self.newpolling("append")
+		self.fill(poll)
+		ticks = self.cycle()
+		return {"append" : measure(lambda: poll.appendticker(next(ticks)), self.calls)}
+
+
+	def benchsma(self):
+		""" polling.sma recomputed from the ring buffer for each window """
+		poll = self.newpolling("sma")
+		self.fill(poll)
+		return {"sma%d" % n : measure(poll.sma, self.calls, n) for n in self.WINDOWS}
+
+
+	def benchwma(self):
+		""" polling.wma recomputed from the ring buffer for each window """
+		poll = self.newpolling("wma")
+		self.fill(poll)
+		return {"wma%d" % n : measure(poll.wma, self.calls, n) for n in self.WINDOWS}
+
+
+	def benchxmaupdate(self):
+		""" incremental update of all SMA/WMA windows by one ticker """
+		poll = self.newpolling("xma")
+		self.fill(poll)
+		ticks = self.cycle()
+		return {"xma.update" : measure(lambda: poll.updatexma(next(ticks)), self.calls)}
+
+
+	def benchticker2str(self):
+		""" polling.ticker2str """
+		poll = self.newpolling("ticker2str")
+		ticks = self.cycle()
+		return {"ticker2str" : measure(lambda: poll.ticker2str(next(ticks)), self.calls)}
+
+
+	def benchwritecsv(self):
+		""" polling.writeCSVticker, synchronous write and background writer """
+		results = {}
+		poll = self.newpolling("writecsv", ["csv"])
+		ticks = self.cycle()
+		results["writeCSVticker.sync"] = measure(lambda: poll.writeCSVticker(next(ticks)), self.calls)
+
+		poll.openCSVticker()
+		results["writeCSVticker.async"] = measure(lambda: poll.writeCSVticker(next(ticks)), self.calls)
+		st = time.perf_counter()
+		poll.closeCSVticker()
+		results["writeCSVticker.async"]["drain_sec"] = time.perf_counter() - st
+		return results
+
+
+	def benchreadcsv(self, repeat=3):
+		""" polling.readCSVticker (warm start) from CSV file of 'rows' rows
+		 - repeat : number of reads
+		"""
+		poll = self.newpolling("readcsv", ["csv"])
+		ticks = self.cycle()
+		with open(poll.tickercsv, "w") as fp:
+			fp.write(poll.CSVHEADER + "\n")
+			fp.writelines([poll.ticker2str(next(ticks)) + "\n" for idx in range(self.rows)])
+
+		samples = []
+		for idx in range(repeat):
+			poll.tickers.clear()
+			st = time.perf_counter_ns()
+			poll.readCSVticker()
+			samples.append(time.perf_counter_ns() - st)
+		result = percentiles(samples)
+		result["rows"] = self.rows
+		result["loaded"] = len(poll.tickers)
+		return {"readCSVticker" : result}
+
+
+	def benchrequest(self):
+		""" one "get ticker" round trip through checkRequestQueue
+		    (put request, serve it, get reply)
+		"""
+		reqq = Queue()
+		rspq = Queue()
+		poll = self.newpolling("request", None, reqq, rspq)
+		self.fill(poll)
+		req = {"cmd" : "get ticker", "id" : 0}
+
+		def roundtrip():
+			reqq.put(req)
+			while True:
+				poll.checkRequestQueue()
+				try:
+					return rspq.get_nowait()
+				except queue.Empty:
+					pass
+
+		result = measure(roundtrip, min(self.calls, 2000))
+		reqq.close()
+		rspq.close()
+		return {"checkRequestQueue" : result}
+
+
+	############################################################################
+
+	def run(self, names=None):
+		""" run benchmarks
+		 - names : list of benchmark names, None indicates all
+		"""
+		for name, bench in self.BENCHES.items():
+			if names is not None and name not in names:
+				continue
+			results = bench()
+			self.results.update(results)
+			for key, res in results.items():
+				print("%-24s %12.0f ops/s  p50=%9.2fus  p90=%9.2fus  p99=%9.2fus  max=%9.2fus" %
+				      (key, res["ops"], res["p50_us"], res["p90_us"], res["p99_us"], res["max_us"]))
+		return self.results
+
+
+	def report(self):
+		""" get results with the environment """
+		try:
+			commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+			                        cwd=os.path.dirname(os.path.abspath(__file__)),
+			                        capture_output=True, text=True, timeout=10).stdout.strip()
+		except (OSError, subprocess.SubprocessError):
+			commit = ""
+		return {"date"    : datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+		        "commit"  : commit,
+		        "python"  : platform.python_version(),
+		        "numpy"   : np.__version__,
+		        "machine" : platform.machine(),
+		        "calls"   : self.calls,
+		        "rows"    : self.rows,
+		        "results" : self.results}
+
+
+def compare(base, curr, threshold=0.2):
+	""" compare results of two runs by p50 latency
+	 - base      : report of baseline run
+	 - curr      : report of current run
+	 - threshold : ratio of slowdown regarded as regression
+
+	return list of (name, base p50, current p50, ratio, regressed).
+	"""
+	rows = []
+	for name, res in curr["results"].items():
+		if name not in base["results"]:
+			continue
+		bp50 = base["results"][name]["p50_us"]
+		cp50 = res["p50_us"]
+		ratio = cp50 / bp50 if bp50 > 0 else 1.0
+		rows.append((name, bp50, cp50, ratio, ratio > 1.0 + threshold))
+	return rows
+
+
+################################################################################
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='microbenchmarks of the polling hot path')
+	parser.add_argument('--output', metavar='file', dest='output',
+	                    type=str, required=False, default='',
+	                    help='JSON file to save results')
+	parser.add_argument('--calls', metavar='n', dest='calls',
+	                    type=int, required=False, default=10000,
+	                    help='number of calls of each benchmark')
+	parser.add_argument('--rows', metavar='n', dest='rows',
+	                    type=int, required=False, default=1000000,
+	                    help='number of rows of CSV file read by readCSVticker')
+	parser.add_argument('--bench', metavar='names', dest='bench',
+	                    type=str, required=False, default='',
+	                    help='comma separated benchmark names (default: all)')
+	parser.add_argument('--compare', metavar='file', dest='compare',
+	                    type=str, required=False, default='',
+	                    help='JSON file of baseline results to compare with')
+	parser.add_argument('--threshold', metavar='ratio', dest='threshold',
+	                    type=float, required=False, default=0.2,
+	                    help='slowdown of p50 latency regarded as regression')
+	args = parser.parse_args()
+
+	names = None
+	if len(args.bench) > 0:
+		names = [name.strip() for name in args.bench.split(",") if len(name.strip()) > 0]
+
+	bench = benchmark(args.calls, args.rows)
+	try:
+		unknown = [name for name in (names or []) if name not in bench.BENCHES]
+		if len(unknown) > 0:
+			print("ERROR: unknown benchmark %s, choose from %s" % (str(unknown), str(list(bench.BENCHES))))
+			sys.exit(1)
+		bench.run(names)
+	finally:
+		bench.close()
+	rep = bench.report()
+
+	if len(args.output) > 0:
+		with open(args.output, "w") as fp:
+			json.dump(rep, fp, indent=2)
+		print("INFO: results are saved to %s" % args.output)
+
+	# exit status 2 indicates regression for automatic comparison
+	if len(args.compare) > 0:
+		with open(args.compare) as fp:
+			base = json.load(fp)
+		nreg = 0
+		print("comparison with %s (commit %s)" % (args.compare, base.get("commit", "")))
+		for name, bp50, cp50, ratio, regressed in compare(base, rep, args.threshold):
+			print("%-24s p50 %9.2fus -> %9.2fus  x%.2f%s" % (name, bp50, cp50, ratio, "  REGRESSION" if regressed else ""))
+			nreg += regressed
+		if nreg > 0:
+			sys.exit(2)
+
+	sys.exit(0)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+import polling
+import asyncpoll
+import ringbuffer
+import scheduler
+
+
+class crosspolling(asyncpoll.asyncpolling):
+	"""
+	polling the same product on two exchanges concurrently and maintaining
+	cross-exchange spread.
+
+	both tickers are fetched in parallel at the beginning of every cycle,
+	so that the two quotes are taken on a common clock with minimal skew.
+	the spread series is stored in the columns below:
+	 - time       : beginning of the cycle (epoch)
+	 - skew       : difference of the middle times of the two fetches [sec]
+	 - spread_bid : best_bid of primary - best_ask of secondary
+	                (positive: sell on primary and buy on secondary)
+	 - spread_ask : best_bid of secondary - best_ask of primary
+	                (positive: sell on secondary and buy on primary)
+	 - spread_mid : mid price of primary - mid price of secondary
+
+	requests may select the exchange by "exchange" key, and the latest
+	spread is served by {"cmd": "get spread"}.
+	"""
+
+	SPREAD_COLUMNS = ["time", "skew", "spread_bid", "spread_ask", "spread_mid"]
+
+	def __init__(self, exchanges, product, outdir="", loglv="INFO", reqq=None, rspq=None, stop_flag=None, q_get_tov=None, windows=None, flush_rows=60, flush_interval=5.0, output=None, snapshot=None, subscriptions=None, hedge=0):
+		""" constructor
+		 - exchanges : list of two exchange names, the first one is the
+		               primary exchange whose ticker is published to shared
+		               memory snapshot and subscriptions
+		 - product   : product code polled on both exchanges
+
+		see polling.polling for the other parameters.
+		"""
+		if len(exchanges) != 2 or exchanges[0].lower() == exchanges[1].lower():
+			raise ValueError("two different exchanges must be specified")
+
+		self.exchanges = [exch.lower() for exch in exchanges]
+		self.products = [product.upper()]
+		self.reqq = reqq
+		self.stop_flag = stop_flag
+
+		# polling object for each exchange (ticker_<exchange>.csv)
+		self.polls = {}
+		for exch in self.exchanges:
+			primary = (exch == self.exchanges[0])
+			self.polls[exch] = polling.polling(exch, outdir, loglv,
+			                                   None, rspq, stop_flag, q_get_tov,
+			                                   windows, flush_rows, flush_interval, output,
+			                                   snapshot if primary else None,
+			                                   subscriptions if primary else None,
+			                                   None, hedge)
+			self.polls[exch].product = self.products[0]
+			self.polls[exch].latency.name = "polling(%s,%s)" % (exch, self.products[0])
+		self.logger = self.polls[self.exchanges[0]].logger
+
+		# spread series
+		self.spreads = ringbuffer.ringbuffer(self.polls[self.exchanges[0]].MAXTICKER, self.SPREAD_COLUMNS)
+		self.lock = threading.Lock()
+
+		# request server thread
+		self.REQ_POLL_TOV = 0.5
+		self.reqthread = None
+		self.reqstop = threading.Event()
+
+
+	def getpolling(self, exch=None):
+		""" get polling object of the exchange
+		 - exch : exchange name, None indicates the primary exchange
+		"""
+		if exch is None:
+			return self.polls[self.exchanges[0]]
+		return self.polls.get(exch.lower())
+
+
+	def serveRequest(self, d):
+		""" serve "get spread" or dispatch request to polling object of the
+		    requested exchange
+		 - d : request object
+		"""
+		if d["cmd"] != "get spread":
+			# unknown exchange is replied by the primary polling object
+			poll = self.getpolling(d.get("exchange"))
+			if poll is None:
+				poll = self.getpolling()
+			poll.serveRequest(d)
+			return
+
+		with self.lock:
+			if len(self.spreads) > 0:
+				rsp = self.spreads[-1]
+				rsp["product"] = self.products[0]
+				rsp["exchanges"] = list(self.exchanges)
+			else:
+				rsp = {"error" : "no spread"}
+		if "id" in d:
+			rsp["id"] = d["id"]
+
+		# reply queue is selected in the same way as polling object
+		rspq = self.getpolling().rspq
+		client = d.get("client")
+		if client is not None:
+			rspq = self.getpolling().rspqs.get(client)
+		if rspq is not None:
+			rspq.put(rsp)
+
+
+	def getspread(self, idx=-1):
+		""" get spread
+		 - idx : index of spread history, -1 indicates the latest entry
+		"""
+		with self.lock:
+			return self.spreads[idx]
+
+
+	def appendspread(self, cycletime, fetched):
+		""" calculate spread of the cycle and append it to the series
+		 - cycletime : beginning of the cycle (epoch)
+		 - fetched   : list of (ticker, middle time of fetch) for exchanges
+		"""
+		(tka, mida), (tkb, midb) = fetched
+		ent = {"time"       : cycletime,
+		       "skew"       : abs(mida - midb),
+		       "spread_bid" : float(tka["best_bid"]) - float(tkb["best_ask"]),
+		       "spread_ask" : float(tkb["best_bid"]) - float(tka["best_ask"]),
+		       "spread_mid" : (float(tka["best_bid"]) + float(tka["best_ask"])) / 2.0 -
+		                      (float(tkb["best_bid"]) + float(tkb["best_ask"])) / 2.0}
+		with self.lock:
+			self.spreads.append(ent)
+		self.logger.debug("spread: bid=%.1f, ask=%.1f, mid=%.1f, skew=%.3f" %
+		                  (ent["spread_bid"], ent["spread_ask"], ent["spread_mid"], ent["skew"]))
+
+
+	async def fetch(self, poll, executor):
+		""" fetch ticker and measure the middle time of the fetch
+		 - poll     : polling object
+		 - executor : thread pool to call exchange API
+		"""
+		loop = asyncio.get_running_loop()
+		sttime = time.monotonic()
+		try:
+			ticker = await loop.run_in_executor(executor, poll.ticker, poll.product)
+		except Exception as e:
+			self.logger.warning("could not get ticker from %s: %s" % (poll.exch, str(e)))
+			ticker = None
+		return (ticker, (sttime + time.monotonic()) / 2.0)
+
+
+	async def pollall(self, interval, count):
+		""" polling tickers of both exchanges concurrently every cycle """
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.exchanges),
+		                                                 thread_name_prefix="fetch")
+		sched = scheduler.scheduler(interval, logger=self.logger)
+		try:
+			lpcnt = count
+			while not self.stop_flag.is_set():
+				if count >= 0:
+					if lpcnt <= 0:
+						break
+					lpcnt -= 1
+
+				cycletime = time.time()
+				polls = [self.polls[exch] for exch in self.exchanges]
+				fetched = await asyncio.gather(*[self.fetch(poll, executor) for poll in polls])
+
+				valid = True
+				for poll, (ticker, midtime) in zip(polls, fetched):
+					if ticker is not None:
+						poll.processticker(ticker)
+					else:
+						self.logger.debug("could not get ticker from %s" % poll.exch)
+						valid = False
+				if valid:
+					self.appendspread(cycletime, fetched)
+
+				await sched.asyncwait()
+		finally:
+			executor.shutdown(wait=True)
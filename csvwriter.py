@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import threading
+import logging
+
+
+class csvwriter:
+	"""
+	background CSV writer.
+
+	lines are passed through an in-process queue to a writer thread, which
+	keeps one file handle open and writes lines in batches. the batch is
+	flushed when 'flush_rows' lines are pending or 'flush_interval' seconds
+	have passed since the last flush, whichever comes first.
+	close() drains the queue, so no line is lost on shutdown.
+	"""
+
+	def __init__(self, path, header="", flush_rows=60, flush_interval=5.0, logger=None):
+		""" constructor
+		 - path           : path to CSV file
+		 - header         : header line written when the file is created
+		 - flush_rows     : number of pending lines to flush
+		 - flush_interval : maximum interval between flushes [sec]
+		 - logger         : logger object
+		"""
+		self.path = path
+		self.header = header
+		self.flush_rows = max(1, flush_rows)
+		self.flush_interval = flush_interval
+		if logger is None:
+			logger = logging.getLogger("csvwriter")
+		self.logger = logger
+
+		self.q = queue.Queue()
+		self.thread = None
+
+		# statistics
+		self.nrows = 0
+		self.nflush = 0
+
+
+	def start(self):
+		""" open the file and start writer thread
+
+		OSError is raised to the caller if the file could not be opened,
+		and no line is queued in that case.
+		"""
+		if self.thread is not None:
+			return
+		fp = open(self.path, "a")
+		self.thread = threading.Thread(target=self.run, args=(fp,), name="csvwriter", daemon=True)
+		self.thread.start()
+
+
+	def put(self, line):
+		""" queue line to be written
+		 - line : line without line feed
+		"""
+		if self.thread is None:
+			raise RuntimeError("csvwriter of %s is not started" % self.path)
+		self.q.put(line)
+
+
+	def close(self):
+		""" write all queued lines, then stop writer thread """
+		if self.thread is None:
+			return
+		self.q.put(None)
+		self.thread.join()
+		self.thread = None
+
+
+	def run(self, fp):
+		""" writer thread
+		 - fp : file object opened by start()
+		"""
+		with fp:
+			if fp.tell() == 0 and len(self.header) > 0:
+				fp.write(self.header + "\n")
+
+			pending = []
+			deadline = time.monotonic() + self.flush_interval
+			while True:
+				tov = deadline - time.monotonic()
+				try:
+					line = self.q.get(timeout=max(tov, 0))
+				except queue.Empty:
+					line = ""
+
+				if line is None:	# close() is called
+					break
+				if len(line) > 0:
+					pending.append(line + "\n")
+
+				if len(pending) >= self.flush_rows or time.monotonic() >= deadline:
+					self.flush(fp, pending)
+					pending = []
+					deadline = time.monotonic() + self.flush_interval
+
+			# drain queue
+			while True:
+				try:
+					line = self.q.get_nowait()
+				except queue.Empty:
+					break
+				if line is not None and len(line) > 0:
+					pending.append(line + "\n")
+			self.flush(fp, pending)
+
+		self.logger.debug("csvwriter: %d rows written by %d flushes" % (self.nrows, self.nflush))
+
+
+	def flush(self, fp, lines):
+		""" write lines to file
+		 - fp    : file object
+		 - lines : list of lines
+		"""
+		if len(lines) == 0:
+			return
+		try:
+			fp.writelines(lines)
+			fp.flush()
+			self.nrows += len(lines)
+			self.nflush += 1
+		except OSError as e:
+			self.logger.error("could not write %s: %s" % (self.path, str(e)))
@@ -0,0 +1,944 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import json
+import hmac
+import random
+import hashlib
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import requests
+
+
+################################################################################
+# pooled HTTP session
+
+# keep-alive connection pool is created for each process (it must not be
+# shared with forked processes) and shared by all adapters in the process
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 8
+
+session = None
+sessionpid = None
+sessionlock = threading.Lock()
+
+
+def getsession():
+	""" get keep-alive HTTP session of this process """
+	global session, sessionpid
+
+	pid = os.getpid()
+	if session is None or sessionpid != pid:
+		with sessionlock:
+			if session is None or sessionpid != pid:
+				sess = requests.Session()
+				adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+				                                        pool_maxsize=POOL_MAXSIZE)
+				sess.mount("https://", adapter)
+				sess.mount("http://", adapter)
+				session = sess
+				sessionpid = pid
+	return session
+
+
+################################################################################
+# endpoint override
+
+# base URL of API used instead of ENDPOINT of adapter (e.g. mock exchange
+# server for load testing), "*" applies to all exchanges
+endpoints = {}
+
+
+def setendpoint(url, exch="*"):
+	""" override base URL of API in this process (and forked processes)
+	 - url  : base URL (e.g. "http://127.0.0.1:8080"), empty string resets
+	          to the real endpoint
+	 - exch : exchange name, "*" indicates all exchanges
+	"""
+	if url:
+		endpoints[exch.lower()] = url.rstrip("/")
+	else:
+		endpoints.pop(exch.lower(), None)
+
+
+################################################################################
+# timeout, retry and circuit breaker
+
+# timeout of HTTP request (connect, read) [sec] if not specified by adapter
+DEFAULT_TIMEOUT = (3.05, 10.0)
+
+# retry of idempotent (GET) request on transient error
+RETRIES = 1
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 2.0
+
+# circuit breaker opens after 'BREAKER_THRESHOLD' consecutive failures, and
+# probes for recovery after cooldown which grows exponentially up to
+# 'BREAKER_MAXCOOLDOWN' while the exchange is down
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 1.0
+BREAKER_MAXCOOLDOWN = 60.0
+
+
+def backoff(attempt, base, cap):
+	""" get exponential backoff delay with jitter [sec]
+	 - attempt : number of attempts so far (0 for the first retry)
+	 - base    : delay of the first retry [sec]
+	 - cap     : maximum delay [sec]
+	"""
+	delay = min(cap, base * (2 ** attempt))
+	return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+class circuitbreaker:
+	"""
+	circuit breaker of an exchange.
+
+	 - closed    : calls are issued, consecutive failures are counted
+	 - open      : calls are refused without touching network until cooldown
+	               has passed
+	 - half-open : one probe call is issued, success closes the breaker and
+	               failure opens it again with longer cooldown
+	"""
+
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half-open"
+
+	def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, maxcooldown=BREAKER_MAXCOOLDOWN):
+		""" constructor
+		 - name        : exchange name
+		 - threshold   : number of consecutive failures to open the breaker
+		 - cooldown    : cooldown before the first probe [sec]
+		 - maxcooldown : maximum cooldown [sec]
+		"""
+		self.name = name
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.maxcooldown = maxcooldown
+		self.lock = threading.Lock()
+
+		self.state = self.CLOSED
+		self.nfail = 0
+		self.ntrip = 0
+		self.retrytime = 0.0
+
+		# statistics
+		self.nrefused = 0
+
+
+	def allow(self):
+		""" check whether a call may be issued """
+		with self.lock:
+			if self.state == self.CLOSED:
+				return True
+			if self.state == self.OPEN and time.monotonic() >= self.retrytime:
+				# only one probe call is issued at a time
+				self.state = self.HALF_OPEN
+				return True
+			self.nrefused += 1
+			return False
+
+
+	def isopen(self):
+		""" check whether the breaker has been tripped """
+		return self.state != self.CLOSED
+
+
+	def success(self):
+		""" record successful call """
+		with self.lock:
+			self.state = self.CLOSED
+			self.nfail = 0
+			self.ntrip = 0
+
+
+	def release(self):
+		""" give back the probe slot of half-open breaker when the call
+		    is not issued (e.g. refused by rate limiter), so that the next
+		    call probes instead
+		"""
+		with self.lock:
+			if self.state == self.HALF_OPEN:
+				self.state = self.OPEN
+
+
+	def failure(self):
+		""" record failed call """
+		with self.lock:
+			self.nfail += 1
+			if self.state == self.HALF_OPEN or self.nfail >= self.threshold:
+				self.state = self.OPEN
+				self.retrytime = time.monotonic() + backoff(self.ntrip, self.cooldown, self.maxcooldown)
+				self.ntrip += 1
+
+
+# circuit breaker of each exchange (shared by adapters in the process)
+breakers = {}
+breakerslock = threading.Lock()
+
+
+def getbreaker(exch):
+	""" get circuit breaker of the exchange
+	 - exch : exchange name
+	"""
+	with breakerslock:
+		if exch not in breakers:
+			breakers[exch] = circuitbreaker(exch)
+		return breakers[exch]
+
+
+################################################################################
+# rate limit shared by processes
+
+class ratelimiter:
+	"""
+	token-bucket rate limiter shared by processes.
+
+	each exchange has a public and a private budget (bucket of 'burst'
+	tokens refilled at 'rate' tokens per second), and every API call takes
+	a token of its budget before it is issued. the buckets are kept in
+	shared memory, so that polling, scalping, sell and the other processes
+	forked after the limiter is created draw on the same budgets.
+
+	calls are classified into priority lanes (LANES, the highest first):
+	 - order  : order placement
+	 - ticker : market data polling
+	 - info   : health, executions, positions and the other calls
+	a lane may take a token only while the bucket holds more than its
+	reserve (RESERVES * burst) and no call of a higher lane is waiting, so
+	that order traffic always beats informational polling. a call waits
+	for a token up to 'maxwait' seconds, and is refused after that.
+
+	counters of each budget and lane:
+	 - calls     : number of calls which took a token
+	 - throttled : number of calls which waited for a token
+	 - refused   : number of calls refused after 'maxwait'
+	 - wait      : total waiting time [sec]
+	"""
+
+	LANES = ["order", "ticker", "info"]
+	RESERVES = [0.0, 0.2, 0.4]
+	BUDGETS = ["public", "private"]
+
+	# fields of a bucket and counters of a lane in shared memory
+	TOKENS, REFILLED = range(2)
+	CALLS, THROTTLED, REFUSED, WAIT, WAITING = range(5)
+
+	# polling interval while waiting for a token [sec]
+	POLL = 0.01
+
+	def __init__(self, exchs, public=(0, 0), private=(0, 0), maxwait=2.0):
+		""" constructor (called before the processes are forked)
+		 - exchs   : list of exchange names
+		 - public  : (rate [calls/sec], burst) of public budget,
+		             rate 0 disables the budget
+		 - private : (rate [calls/sec], burst) of private budget
+		 - maxwait : maximum time to wait for a token [sec]
+		"""
+		self.budgets = []
+		for exch in exchs:
+			for budget, (rate, burst) in zip(self.BUDGETS, (public, private)):
+				if rate < 0 or (rate > 0 and burst < 1):
+					raise ValueError("invalid rate limit of %s %s budget" % (exch, budget))
+				self.budgets.append((exch.lower(), budget, float(rate), float(burst)))
+		self.index = {(exch, budget) : idx for idx, (exch, budget, rate, burst) in enumerate(self.budgets)}
+		self.maxwait = maxwait
+
+		nbudget = len(self.budgets)
+		nlane = len(self.LANES)
+		self.lock = multiprocessing.Lock()
+		self.buckets = RawArray("d", nbudget * 2)
+		self.counters = RawArray("d", nbudget * nlane * 5)
+		now = time.monotonic()
+		for idx, (exch, budget, rate, burst) in enumerate(self.budgets):
+			self.buckets[idx * 2 + self.TOKENS] = burst
+			self.buckets[idx * 2 + self.REFILLED] = now
+
+
+	def counter(self, idx, lane, field):
+		""" get index of a counter in shared memory """
+		return (idx * len(self.LANES) + lane) * 5 + field
+
+
+	def refill(self, idx, now):
+		""" refill bucket of the budget (called with lock) """
+		exch, budget, rate, burst = self.budgets[idx]
+		tokens = self.buckets[idx * 2 + self.TOKENS]
+		elapsed = max(0.0, now - self.buckets[idx * 2 + self.REFILLED])
+		self.buckets[idx * 2 + self.TOKENS] = min(burst, tokens + elapsed * rate)
+		self.buckets[idx * 2 + self.REFILLED] = now
+		return self.buckets[idx * 2 + self.TOKENS]
+
+
+	def acquire(self, exch, private, lane="info", maxwait=None):
+		""" take a token of the budget
+		 - exch    : exchange name
+		 - private : True for private API
+		 - lane    : priority lane (LANES)
+		 - maxwait : maximum time to wait [sec], None indicates 'maxwait'
+
+		return waiting time [sec], or None if the call is refused.
+		"""
+		idx = self.index.get((exch.lower(), self.BUDGETS[int(bool(private))]))
+		if idx is None or self.budgets[idx][2] <= 0:
+			return 0.0
+		exch, budget, rate, burst = self.budgets[idx]
+		lane = self.LANES.index(lane) if lane in self.LANES else len(self.LANES) - 1
+		floor = min(burst * self.RESERVES[lane], burst - 1.0)
+		if maxwait is None:
+			maxwait = self.maxwait
+
+		sttime = time.monotonic()
+		waiting = False
+		try:
+			while True:
+				with self.lock:
+					now = time.monotonic()
+					tokens = self.refill(idx, now)
+					higher = any([self.counters[self.counter(idx, ln, self.WAITING)] > 0 for ln in range(lane)])
+					if not higher and tokens >= floor + 1.0:
+						self.buckets[idx * 2 + self.TOKENS] = tokens - 1.0
+						self.counters[self.counter(idx, lane, self.CALLS)] += 1
+						if waiting:
+							self.counters[self.counter(idx, lane, self.THROTTLED)] += 1
+							self.counters[self.counter(idx, lane, self.WAIT)] += now - sttime
+						return now - sttime
+
+					# time to refill a token above the reserve
+					delay = max(self.POLL, (floor + 1.0 - tokens) / rate)
+					if now + delay - sttime > maxwait:
+						self.counters[self.counter(idx, lane, self.REFUSED)] += 1
+						if waiting:
+							self.counters[self.counter(idx, lane, self.WAIT)] += now - sttime
+						return None
+					if not waiting:
+						waiting = True
+						self.counters[self.counter(idx, lane, self.WAITING)] += 1
+
+				# higher lane may take the refilled token first
+				time.sleep(min(delay, self.POLL) if higher else delay)
+		finally:
+			if waiting:
+				with self.lock:
+					self.counters[self.counter(idx, lane, self.WAITING)] -= 1
+
+
+	def penalize(self, exch, private):
+		""" empty the bucket when the exchange reports rate limit (HTTP 429)
+		 - exch    : exchange name
+		 - private : True for private API
+		"""
+		idx = self.index.get((exch.lower(), self.BUDGETS[int(bool(private))]))
+		if idx is None:
+			return
+		with self.lock:
+			self.refill(idx, time.monotonic())
+			self.buckets[idx * 2 + self.TOKENS] = 0.0
+
+
+	def stats(self):
+		""" get tokens and counters of the budgets
+
+		return {"<exchange> <budget>": {"rate", "burst", "tokens",
+		"lanes": {lane: {"calls", "throttled", "refused", "wait"}}}}.
+		"""
+		stats = {}
+		with self.lock:
+			for idx, (exch, budget, rate, burst) in enumerate(self.budgets):
+				if rate <= 0:
+					continue
+				lanes = {}
+				for lane, name in enumerate(self.LANES):
+					lanes[name] = {"calls"     : int(self.counters[self.counter(idx, lane, self.CALLS)]),
+					               "throttled" : int(self.counters[self.counter(idx, lane, self.THROTTLED)]),
+					               "refused"   : int(self.counters[self.counter(idx, lane, self.REFUSED)]),
+					               "wait"      : self.counters[self.counter(idx, lane, self.WAIT)]}
+				stats["%s %s" % (exch, budget)] = {"rate"   : rate,
+				                                   "burst"  : burst,
+				                                   "tokens" : self.refill(idx, time.monotonic()),
+				                                   "lanes"  : lanes}
+		return stats
+
+
+# rate limiter of this process (and forked processes), None disables
+limiter = None
+
+
+def setratelimiter(rl):
+	""" set rate limiter shared by processes forked after this call
+	 - rl : ratelimiter object, None disables rate limit
+	"""
+	global limiter
+	limiter = rl
+
+
+################################################################################
+# hedged request
+
+# set in the thread of a hedge request, which shares the token of its
+# primary request instead of taking another one
+hedging = threading.local()
+
+
+class hedger:
+	"""
+	hedged request to cut tail latency.
+
+	the call is issued once, and if no response has arrived within the
+	given percentile of recent latencies, the same call is issued again and
+	the first successful response is taken. the other response is
+	discarded when it arrives. hedging is applied to public idempotent
+	calls only (ticker), never to private or order calls. the first
+	attempt of the hedge request does not take a token of the rate limit
+	budget, so that a hedged call costs one token as a plain call does.
+
+	counters:
+	 - ncall  : number of calls
+	 - nhedge : number of calls for which a hedge request was issued
+	 - nwin   : number of calls answered by the hedge request first
+	"""
+
+	MAXSAMPLES = 1000	# number of latency samples kept
+	MINSAMPLES = 20		# no hedge until this number of samples is collected
+	MAXWORKERS = 4
+
+	def __init__(self, percentile=95.0):
+		""" constructor
+		 - percentile : percentile of latency to issue hedge request
+		"""
+		if percentile <= 0 or percentile >= 100:
+			raise ValueError("percentile must be in (0, 100)")
+
+		self.percentile = percentile
+		self.latencies = collections.deque(maxlen=self.MAXSAMPLES)
+		self.lock = threading.Lock()
+
+		# thread pool is created on the first call (after fork)
+		self.executor = None
+
+		# counters
+		self.ncall = 0
+		self.nhedge = 0
+		self.nwin = 0
+
+
+	def delay(self):
+		""" get delay to issue hedge request [sec], None until enough
+		    latency samples are collected
+		"""
+		with self.lock:
+			if len(self.latencies) < self.MINSAMPLES:
+				return None
+			samples = np.array(self.latencies)
+		return float(np.percentile(samples, self.percentile))
+
+
+	def submit(self, fn, args, hedge=False):
+		""" issue a call in thread pool and record its latency on success
+		 - fn    : function to invoke
+		 - args  : arguments of the function
+		 - hedge : True if the call is a hedge request
+		"""
+		sttime = time.monotonic()
+		future = self.executor.submit(self.invoke, fn, args, hedge)
+		future.add_done_callback(lambda fut: self.record(fut, sttime))
+		return future
+
+
+	def invoke(self, fn, args, hedge):
+		""" invoke function in thread pool """
+		hedging.active = hedge
+		try:
+			return fn(*args)
+		finally:
+			hedging.active = False
+
+
+	def record(self, future, sttime):
+		""" record latency of a successful call """
+		if not future.cancelled() and future.exception() is None:
+			with self.lock:
+				self.latencies.append(time.monotonic() - sttime)
+
+
+	def call(self, fn, *args):
+		""" invoke function with hedging
+		 - fn   : function to invoke
+		 - args : arguments of the function
+
+		return the first successful result, or raise the exception of the
+		first request if both requests failed.
+		"""
+		if self.executor is None:
+			self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.MAXWORKERS,
+			                                                      thread_name_prefix="hedge")
+		with self.lock:
+			self.ncall += 1
+
+		delay = self.delay()
+		primary = self.submit(fn, args)
+		if delay is None:
+			return primary.result()
+		done, pending = concurrent.futures.wait([primary], timeout=delay)
+		if len(done) > 0:
+			return primary.result()
+
+		# no response within the delay, issue hedge request
+		hedge = self.submit(fn, args, True)
+		with self.lock:
+			self.nhedge += 1
+
+		pending = {primary, hedge}
+		while len(pending) > 0:
+			done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in (primary, hedge):
+				if future in done and future.exception() is None:
+					if future is hedge:
+						with self.lock:
+							self.nwin += 1
+					return future.result()
+		return primary.result()
+
+
+	def stats(self):
+		""" get counters of hedged requests """
+		delay = self.delay()
+		with self.lock:
+			ncall, nhedge, nwin = self.ncall, self.nhedge, self.nwin
+		return {"calls"      : ncall,
+		        "hedged"     : nhedge,
+		        "won"        : nwin,
+		        "hedge_rate" : nhedge / ncall if ncall > 0 else 0.0,
+		        "win_rate"   : nwin / nhedge if nhedge > 0 else 0.0,
+		        "delay"      : delay}
+
+
+################################################################################
+# exceptions
+
+class exchangeerror(Exception):
+	""" error occurred in invoking exchange API """
+
+	def __init__(self, message, status=None):
+		""" constructor
+		 - message : error message
+		 - status  : HTTP status code (None if not responded)
+		"""
+		super().__init__(message)
+		self.status = status
+
+
+class autherror(exchangeerror):
+	""" API key and secret are required for private API """
+	pass
+
+
+class circuitopen(exchangeerror):
+	""" call is refused since circuit breaker of the exchange is open """
+	pass
+
+
+class ratelimited(exchangeerror):
+	""" call is refused since rate limit budget is exhausted """
+	pass
+
+
+################################################################################
+# exchange adapters
+
+class exchange:
+	"""
+	base class of exchange adapter.
+
+	adapter hides the differences of exchange APIs from polling, scalping
+	and sell modules. all methods return values in the common format below,
+	and raise exchangeerror if the API could not be invoked.
+	 - ticker     : {"product", "timestamp", "best_bid", "best_ask", "last"}
+	 - health     : "NORMAL", "BUSY", "VERY BUSY", "SUPER BUSY", "NO ORDER",
+	                "STOP"
+	 - executions : list of {"id", "side", "price", "size", "exec_date", ...}
+	 - positions  : list of {"product_code", "side", "price", "size", ...}
+
+	methods which are not supported by the exchange return None.
+	to support a new exchange, derive this class and register it to
+	EXCHANGES below.
+
+	every call has a timeout of its endpoint (TIMEOUTS), idempotent calls
+	are retried with backoff on transient errors, and calls are refused
+	with circuitopen while circuit breaker of the exchange is open.
+	every call (and retry) takes a token of the shared rate limiter in
+	the priority lane of its endpoint (PRIORITIES), and is refused with
+	ratelimited if no token is available in time.
+	"""
+
+	NAME = ""
+	ENDPOINT = ""
+	PRODUCTS = []
+
+	# timeout of each endpoint (connect, read) [sec]
+	TIMEOUTS = {}
+
+	# priority lane of rate limiter of each endpoint ("info" if not listed)
+	PRIORITIES = {}
+
+	def __init__(self, apikey=None, apisecret=None, timeout=None, hedge=0):
+		""" constructor
+		 - apikey    : API key (required for private API)
+		 - apisecret : API secret (required for private API)
+		 - timeout   : timeout of HTTP request [sec] for all endpoints,
+		               None indicates timeout of each endpoint
+		 - hedge     : percentile of ticker latency to issue hedge request,
+		               0 disables hedging
+		"""
+		self.apikey = apikey
+		self.apisecret = apisecret
+		self.timeout = timeout
+		self.endpoint = endpoints.get(self.NAME, endpoints.get("*", self.ENDPOINT))
+		self.breaker = getbreaker(self.NAME)
+		self.hedger = None
+		if hedge > 0:
+			self.hedger = hedger(hedge)
+
+
+	def timeoutof(self, path):
+		""" get timeout of the endpoint
+		 - path : path of API without query string
+		"""
+		if self.timeout is not None:
+			return self.timeout
+		return self.TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+
+
+	def priorityof(self, path):
+		""" get priority lane of the endpoint
+		 - path : path of API without query string
+		"""
+		return self.PRIORITIES.get(path, "info")
+
+
+	def isproduct(self, product):
+		""" check whether the product is supported by the exchange
+		 - product : product code
+		"""
+		return product.upper() in self.PRODUCTS
+
+
+	def authheader(self, method, url, path, body):
+		""" make authentication header of private API (implemented by adapter)
+		 - method : HTTP method
+		 - url    : URL with query string
+		 - path   : path with query string
+		 - body   : request body
+		"""
+		raise NotImplementedError()
+
+
+	def request(self, method, path, params=None, private=False, form=False):
+		""" invoke API
+		 - method  : "GET", "POST" or "DELETE"
+		 - path    : path of API (e.g. "/v1/ticker")
+		 - params  : query parameters (GET/DELETE) or body (POST)
+		 - private : True if authentication is required
+		 - form    : True to send POST body as form instead of JSON
+
+		return decoded JSON response.
+		"""
+		timeout = self.timeoutof(path)
+		lane = self.priorityof(path)
+		body = ""
+		if params:
+			params = {k: v for k, v in params.items() if v is not None}
+		if method == "POST":
+			if form:
+				body = urllib.parse.urlencode(params or {})
+			else:
+				body = json.dumps(params or {})
+		elif params:
+			path = path + "?" + urllib.parse.urlencode(params)
+		url = self.endpoint + path
+
+		if private and (not self.apikey or not self.apisecret):
+			raise autherror("API key and secret are required for %s" % path)
+		if not self.breaker.allow():
+			raise circuitopen("circuit breaker of %s is open" % self.NAME)
+
+		attempt = 0
+		while True:
+			# every attempt takes a token of the budget shared by processes
+			# (except the first attempt of hedge request, see hedger)
+			charged = (attempt > 0 or not getattr(hedging, "active", False))
+			if limiter is not None and charged and limiter.acquire(self.NAME, private, lane) is None:
+				self.breaker.release()
+				raise ratelimited("%s %s: rate limit of %s is exceeded" % (method, path, self.NAME))
+
+			# authentication header is signed again on every attempt
+			headers = {}
+			if private:
+				headers = self.authheader(method, url, path, body)
+			if method == "POST":
+				if form:
+					headers["Content-Type"] = "application/x-www-form-urlencoded"
+				else:
+					headers["Content-Type"] = "application/json"
+
+			try:
+				rsp = getsession().request(method, url, data=body if method == "POST" else None,
+				                           headers=headers, timeout=timeout)
+				if rsp.status_code == 200:
+					item = None
+					if len(rsp.content) > 0:
+						item = rsp.json()
+					self.breaker.success()
+					return item
+				err = exchangeerror("%s %s: HTTP %d %s" % (method, path, rsp.status_code, rsp.text[:200]),
+				                    rsp.status_code)
+				# client error indicates that the exchange is responding
+				transient = (rsp.status_code >= 500 or rsp.status_code in (408, 429))
+				if rsp.status_code == 429 and limiter is not None:
+					# the other processes back off as well
+					limiter.penalize(self.NAME, private)
+			except requests.RequestException as e:
+				err = exchangeerror("%s %s: %s" % (method, path, str(e)))
+				transient = True
+			except ValueError as e:
+				err = exchangeerror("%s %s: invalid response: %s" % (method, path, str(e)), rsp.status_code)
+				transient = True
+
+			if not transient:
+				self.breaker.success()
+				raise err
+
+			# orders are never retried to avoid duplicated orders,
+			# and probe of half-open breaker is not retried
+			if method != "GET" or attempt >= RETRIES or self.breaker.isopen():
+				self.breaker.failure()
+				raise err
+			time.sleep(backoff(attempt, BACKOFF_BASE, BACKOFF_CAP))
+			attempt += 1
+
+
+	def ticker(self, product):
+		""" get ticker (hedged if enabled)
+		 - product : product code
+		"""
+		# probe of half-open breaker is not hedged
+		if self.hedger is None or self.breaker.isopen():
+			return self.fetchticker(product)
+		return self.hedger.call(self.fetchticker, product)
+
+
+	def fetchticker(self, product):
+		""" get ticker (implemented by adapter)
+		 - product : product code
+		"""
+		raise NotImplementedError()
+
+
+	def health(self, product=None):
+		""" get exchange status
+		 - product : product code
+		"""
+		return "NORMAL"
+
+
+	def executions(self, product, count=None, before=None, after=None):
+		""" get my executions
+		 - product : product code
+		 - count   : maximum number of executions
+		 - before  : get executions whose id is less than this value
+		 - after   : get executions whose id is greater than this value
+		"""
+		return None
+
+
+	def positions(self, product):
+		""" get my open positions (margin trading)
+		 - product : product code
+		"""
+		return None
+
+
+	def sendorder(self, product, ordtype, side, size, price=None, expire=None):
+		""" place order
+		 - product : product code
+		 - ordtype : "LIMIT" or "MARKET"
+		 - side    : "BUY" or "SELL"
+		 - size    : amount of order
+		 - price   : price of limit order
+		 - expire  : expiration of order [minute]
+
+		return order acceptance ID.
+		"""
+		return None
+
+
+class bitflyer(exchange):
+	"""
+	bitFlyer Lightning API
+	see the following for details:
+	 - https://lightning.bitflyer.com/docs?lang=en
+	"""
+
+	NAME = "bitflyer"
+	ENDPOINT = "https://api.bitflyer.jp"
+	PRODUCTS = ["BTC_JPY", "ETH_BTC", "FX_BTC_JPY"]
+
+	TIMEOUTS = {"/v1/ticker"            : (1.0, 2.0),
+	            "/v1/gethealth"         : (1.0, 2.0),
+	            "/v1/me/getexecutions"  : (3.05, 5.0),
+	            "/v1/me/getpositions"   : (3.05, 5.0),
+	            "/v1/me/sendchildorder" : (3.05, 10.0)}
+
+	PRIORITIES = {"/v1/ticker"            : "ticker",
+	              "/v1/me/sendchildorder" : "order"}
+
+	def authheader(self, method, url, path, body):
+		timestamp = str(time.time())
+		text = timestamp + method + path + body
+		sign = hmac.new(self.apisecret.encode(), text.encode(), hashlib.sha256).hexdigest()
+		return {"ACCESS-KEY"       : self.apikey,
+		        "ACCESS-TIMESTAMP" : timestamp,
+		        "ACCESS-SIGN"      : sign}
+
+
+	def fetchticker(self, product):
+		item = self.request("GET", "/v1/ticker", {"product_code" : product.upper()})
+		if item is None:
+			return None
+		try:
+			return {"product"   : product,
+			        "timestamp" : item["timestamp"],
+			        "best_bid"  : float(item["best_bid"]),
+			        "best_ask"  : float(item["best_ask"]),
+			        "last"      : float(item["ltp"])}
+		except (KeyError, TypeError, ValueError) as e:
+			raise exchangeerror("GET /v1/ticker: invalid ticker: %s" % repr(e), 200)
+
+
+	def health(self, product=None):
+		params = None
+		if product:
+			params = {"product_code" : product.upper()}
+		item = self.request("GET", "/v1/gethealth", params)
+		try:
+			return item["status"]
+		except (KeyError, TypeError) as e:
+			raise exchangeerror("GET /v1/gethealth: invalid health: %s" % repr(e), 200)
+
+
+	def executions(self, product, count=None, before=None, after=None):
+		return self.request("GET", "/v1/me/getexecutions",
+		                    {"product_code" : product.upper(),
+		                     "count"        : count,
+		                     "before"       : before,
+		                     "after"        : after},
+		                    private=True)
+
+
+	def positions(self, product):
+		return self.request("GET", "/v1/me/getpositions",
+		                    {"product_code" : product.upper()},
+		                    private=True)
+
+
+	def sendorder(self, product, ordtype, side, size, price=None, expire=None):
+		params = {"product_code"     : product.upper(),
+		          "child_order_type" : ordtype.upper(),
+		          "side"             : side.upper(),
+		          "size"             : size,
+		          "minute_to_expire" : expire,
+		          "time_in_force"    : "GTC"}
+		if ordtype.upper() == "LIMIT":
+			params["price"] = price
+		item = self.request("POST", "/v1/me/sendchildorder", params, private=True)
+		return item["child_order_acceptance_id"]
+
+
+class coincheck(exchange):
+	"""
+	coincheck API
+	see the following for details:
+	 - https://coincheck.com/documents/exchange/api
+	"""
+
+	NAME = "coincheck"
+	ENDPOINT = "https://coincheck.com"
+	PRODUCTS = ["BTC_JPY"]
+
+	TIMEOUTS = {"/api/ticker"          : (1.0, 2.0),
+	            "/api/exchange/orders" : (3.05, 10.0)}
+
+	PRIORITIES = {"/api/ticker"          : "ticker",
+	              "/api/exchange/orders" : "order"}
+
+	def authheader(self, method, url, path, body):
+		nonce = str(int(time.time() * 1000000))
+		text = nonce + url + body
+		sign = hmac.new(self.apisecret.encode(), text.encode(), hashlib.sha256).hexdigest()
+		return {"ACCESS-KEY"       : self.apikey,
+		        "ACCESS-NONCE"     : nonce,
+		        "ACCESS-SIGNATURE" : sign}
+
+
+	def fetchticker(self, product):
+		item = self.request("GET", "/api/ticker", {"pair" : product.lower()})
+		if item is None:
+			return None
+		try:
+			return {"product"   : product,
+			        "timestamp" : item["timestamp"],
+			        "best_bid"  : float(item["bid"]),
+			        "best_ask"  : float(item["ask"]),
+			        "last"      : float(item["last"])}
+		except (KeyError, TypeError, ValueError) as e:
+			raise exchangeerror("GET /api/ticker: invalid ticker: %s" % repr(e), 200)
+
+
+	def sendorder(self, product, ordtype, side, size, price=None, expire=None):
+		params = {"pair" : product.lower()}
+		if ordtype.upper() == "LIMIT":
+			params["order_type"] = side.lower()
+			params["rate"] = price
+			params["amount"] = size
+		elif side.upper() == "SELL":
+			params["order_type"] = "market_sell"
+			params["amount"] = size
+		else:
+			# market buy order is specified by amount of JPY
+			params["order_type"] = "market_buy"
+			params["market_buy_amount"] = size
+		item = self.request("POST", "/api/exchange/orders", params, private=True, form=True)
+		if not item.get("success", False):
+			raise exchangeerror("could not place order: %s" % item.get("error", ""))
+		return item["id"]
+
+
+# supported exchanges
+EXCHANGES = {bitflyer.NAME  : bitflyer,
+             coincheck.NAME : coincheck}
+
+
+def create(exch, apikey=None, apisecret=None, timeout=None, hedge=0):
+	""" create exchange adapter
+	 - exch      : exchange name, "bitflyer" or "coincheck"
+	 - apikey    : API key (required for private API)
+	 - apisecret : API secret (required for private API)
+	 - timeout   : timeout of HTTP request [sec]
+	 - hedge     : percentile of ticker latency to issue hedge request,
+	               0 disables hedging
+
+	return None if the exchange is not supported.
+	"""
+	cls = EXCHANGES.get(exch.lower())
+	if cls is None:
+		return None
+	return cls(apikey, apisecret, timeout, hedge)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import signal
+import logging
+from multiprocessing import Queue
+
+import exchange
+import latency
+
+
+class orderclient:
+	"""
+	client side of order gateway held by a strategy.
+
+	it has the same sendorder() as exchange adapter, so that a strategy
+	places orders through the gateway or directly by the adapter without
+	knowing which one it holds.
+	"""
+
+	def __init__(self, name, reqq, rspq, tov=10.0):
+		""" constructor (created by ordergateway.client())
+		 - name : client name (e.g. "sell")
+		 - reqq : order queue to gateway (shared by clients)
+		 - rspq : acknowledgement queue from gateway (dedicated to this client)
+		 - tov  : timeout of acknowledgement [sec]
+		"""
+		self.name = name
+		self.reqq = reqq
+		self.rspq = rspq
+		self.tov = tov
+		self.seq = 0
+		self.latency = None
+
+
+	def sendorder(self, product, ordtype, side, size, price=None, expire=None):
+		""" place order through order gateway
+		 - product : product code
+		 - ordtype : "LIMIT" or "MARKET"
+		 - side    : "BUY" or "SELL"
+		 - size    : amount of order
+		 - price   : price of limit order
+		 - expire  : expiration of order [minute]
+
+		return order acceptance ID. exchangeerror (autherror) is raised if
+		the order is rejected or not acknowledged within timeout.
+		"""
+		if self.latency is None:
+			self.latency = latency.ordertracker(self.name + " order", logging.getLogger(self.name))
+
+		self.seq += 1
+		intent = {"cmd"     : "send order",
+		          "client"  : self.name,
+		          "id"      : self.seq,
+		          "product" : product,
+		          "ordtype" : ordtype,
+		          "side"    : side,
+		          "size"    : size,
+		          "price"   : price,
+		          "expire"  : expire,
+		          "stamps"  : {"submit" : time.monotonic()}}
+		self.reqq.put(intent)
+
+		# acknowledgements of the orders timed out before are discarded
+		deadline = time.monotonic() + self.tov
+		while True:
+			remain = deadline - time.monotonic()
+			try:
+				if remain <= 0:
+					raise queue.Empty()
+				ack = self.rspq.get(timeout=remain)
+			except queue.Empty:
+				raise exchange.exchangeerror("order %d is not acknowledged by gateway in %g sec" % (self.seq, self.tov))
+			if ack.get("id") == self.seq:
+				break
+
+		stamps = ack.get("stamps", {})
+		stamps["ack"] = time.monotonic()
+		self.latency.record(stamps)
+
+		if ack.get("error") is not None:
+			if ack.get("auth", False):
+				raise exchange.autherror(ack["error"])
+			raise exchange.exchangeerror(ack["error"], ack.get("status"))
+		return ack["acceptance_id"]
+
+
+class ordergateway:
+	"""
+	order gateway process which owns the private API client.
+
+	strategies submit order intents through orderclient, and the gateway
+	places them on one keep-alive connection pool and one signing path.
+	intents which arrive within 'window' seconds of each other are taken
+	as a batch, and compatible intents in the batch (same product, order
+	type, side, price and expiration) are coalesced into one order of the
+	total size, so that a burst of orders (e.g. several lots crossing the
+	stop-loss by one ticker) costs one round trip. every intent of a
+	coalesced order is acknowledged with the same acceptance ID:
+	 - {"id", "client", "acceptance_id", "size", "batch", "error", "auth",
+	    "status", "stamps"}
+
+	per-order latency from submission to acknowledgement is measured by
+	stage (latency.ordertracker) on both sides.
+	"""
+
+	WINDOW = 0.005		# time to wait for following intents [sec]
+	MAXBATCH = 50		# maximum number of intents in a batch
+
+	def __init__(self, exch, apikey, apisecret, stop_flag=None, loglv="INFO", outdir="",
+	             window=WINDOW, maxbatch=MAXBATCH):
+		""" constructor (called before the processes are forked)
+		 - exch      : exchange name
+		 - apikey    : API key
+		 - apisecret : API secret
+		 - stop_flag : stop flag
+		 - loglv     : log level
+		 - outdir    : log directory
+		 - window    : time to wait for following intents [sec],
+		               0 takes only the intents already queued
+		 - maxbatch  : maximum number of intents in a batch
+		"""
+		if window < 0:
+			raise ValueError("batch window must not be negative")
+		if maxbatch <= 0:
+			raise ValueError("batch size must be natural number")
+
+		self.exch = exch.lower()
+		self.apikey = apikey
+		self.apisecret = apisecret
+		self.stop_flag = stop_flag
+		self.loglv = loglv
+		self.outdir = outdir
+		self.window = window
+		self.maxbatch = maxbatch
+		self.logger = logging.getLogger("gateway")
+
+		# order queue is shared, acknowledgement queue is dedicated to each client
+		self.reqq = Queue()
+		self.rspq = {}
+
+		# counters
+		self.nintent = 0
+		self.norder = 0
+		self.nerror = 0
+
+		self.latency = latency.ordertracker("gateway", self.logger)
+
+
+	def client(self, name, tov=10.0):
+		""" create client of a strategy (called before the processes are forked)
+		 - name : client name
+		 - tov  : timeout of acknowledgement [sec]
+		"""
+		if name not in self.rspq:
+			self.rspq[name] = Queue()
+		return orderclient(name, self.reqq, self.rspq[name], tov)
+
+
+	def collect(self, tov=0.5):
+		""" take a batch of intents from the queue
+		 - tov : time to wait for the first intent [sec]
+
+		return list of intents (empty if no intent arrived).
+		"""
+		try:
+			intents = [self.reqq.get(timeout=tov)]
+		except queue.Empty:
+			return []
+		intents[0]["stamps"]["dequeue"] = time.monotonic()
+
+		deadline = time.monotonic() + self.window
+		while len(intents) < self.maxbatch:
+			remain = deadline - time.monotonic()
+			try:
+				if remain > 0:
+					intent = self.reqq.get(timeout=remain)
+				else:
+					intent = self.reqq.get_nowait()
+			except queue.Empty:
+				break
+			intent["stamps"]["dequeue"] = time.monotonic()
+			intents.append(intent)
+		return intents
+
+
+	def coalesce(self, intents):
+		""" group compatible intents
+		 - intents : list of intents
+
+		return list of intent groups (in arrival order of the first intent).
+		"""
+		groups = {}
+		for intent in intents:
+			key = (intent["product"].upper(), intent["ordtype"].upper(), intent["side"].upper(),
+			       intent["price"], intent["expire"])
+			groups.setdefault(key, []).append(intent)
+		return list(groups.values())
+
+
+	def process(self, api, intents):
+		""" place a batch of intents and acknowledge them
+		 - api     : exchange adapter
+		 - intents : list of intents
+		"""
+		for group in self.coalesce(intents):
+			first = group[0]
+			size = round(sum([float(intent["size"]) for intent in group]), 8)
+
+			sttime = time.monotonic()
+			accid = None
+			error = None
+			auth = False
+			status = None
+			try:
+				accid = api.sendorder(first["product"], first["ordtype"], first["side"], size,
+				                      first["price"], first["expire"])
+			except exchange.exchangeerror as e:
+				error = str(e)
+				auth = isinstance(e, exchange.autherror)
+				status = e.status
+			endtime = time.monotonic()
+
+			self.nintent += len(group)
+			self.norder += 1
+			if error is None:
+				self.logger.info("%s %s %s size=%g price=%s is accepted: %s (%d intents)" %
+				                 (first["product"], first["ordtype"], first["side"], size,
+				                  str(first["price"]), str(accid), len(group)))
+			else:
+				self.nerror += 1
+				self.logger.error("%s %s %s size=%g price=%s is rejected: %s (%d intents)" %
+				                  (first["product"], first["ordtype"], first["side"], size,
+				                   str(first["price"]), error, len(group)))
+
+			for intent in group:
+				stamps = intent["stamps"]
+				stamps["send"] = sttime
+				stamps["sent"] = endtime
+				self.latency.record(stamps)
+
+				rspq = self.rspq.get(intent["client"])
+				if rspq is None:
+					self.logger.warning("unknown client '%s'" % intent["client"])
+					continue
+				rspq.put({"id"            : intent["id"],
+				          "client"        : intent["client"],
+				          "acceptance_id" : accid,
+				          "size"          : intent["size"],
+				          "batch"         : len(group),
+				          "error"         : error,
+				          "auth"          : auth,
+				          "status"        : status,
+				          "stamps"        : stamps})
+
+
+	def run(self):
+		""" place orders submitted by strategies (background process) """
+
+		# ignore interrupt
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+		self.logger.setLevel(self.loglv)
+		if len(self.logger.handlers) == 0:
+			if len(self.outdir) > 0:
+				outfile = self.outdir + "/gateway.log"
+			else:
+				outfile = "gateway.log"
+			fh = logging.FileHandler(outfile)
+			fh.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s'))
+			self.logger.addHandler(fh)
+
+		api = exchange.create(self.exch, self.apikey, self.apisecret)
+		if api is None:
+			self.logger.error("invalid exchange name")
+			return
+
+		try:
+			while self.stop_flag is None or not self.stop_flag.is_set():
+				intents = self.collect()
+				if len(intents) > 0:
+					self.process(api, intents)
+		finally:
+			self.latency.log()
+			self.logger.info("gateway intents=%d, orders=%d, errors=%d" % (self.nintent, self.norder, self.nerror))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import signal
+import logging
+from multiprocessing.sharedctypes import RawValue
+
+import exchange
+import pubsub
+import scheduler
+
+
+class healthmonitor:
+	"""
+	cached exchange health shared among processes.
+
+	the health is refreshed by a background process (run()) every 'ttl'
+	seconds and kept in shared memory, so that strategies read it in their
+	decision path without any HTTP request or IPC round trip. a change of
+	the health is pushed to subscribers as an event:
+	 - {"event": "health", "health": <status>, "previous": <status>,
+	    "product": <product code>}
+
+	the health reads "UNKNOWN" until the first refresh, and when it has not
+	been refreshed for MAXAGE times of 'ttl' (exchange is not reachable or
+	the refresher is dead).
+	"""
+
+	STATUSES = ["UNKNOWN", "NORMAL", "BUSY", "VERY BUSY", "SUPER BUSY", "NO ORDER", "STOP"]
+	MAXAGE = 3
+
+	def __init__(self, exch, product, ttl=5.0, stop_flag=None, loglv="INFO", outdir=""):
+		""" constructor (called before the processes are forked)
+		 - exch      : exchange name
+		 - product   : product code
+		 - ttl       : interval to refresh health [sec]
+		 - stop_flag : stop flag
+		 - loglv     : log level
+		 - outdir    : log directory
+		"""
+		if ttl <= 0:
+			raise ValueError("ttl must be positive")
+
+		self.exch = exch.lower()
+		self.product = product.upper()
+		self.ttl = float(ttl)
+		self.stop_flag = stop_flag
+		self.loglv = loglv
+		self.outdir = outdir
+		self.logger = logging.getLogger("health")
+
+		# shared status (index of STATUSES) and monotonic time of refresh
+		self.code = RawValue("i", 0)
+		self.refreshed = RawValue("d", 0.0)
+
+		# counters of the refresher
+		self.nrefresh = 0
+		self.nerror = 0
+
+
+	def status(self):
+		""" get cached health status """
+		if time.monotonic() - self.refreshed.value > self.ttl * self.MAXAGE:
+			return "UNKNOWN"
+		return self.STATUSES[self.code.value]
+
+
+	def isnormal(self):
+		""" True if the exchange is healthy enough to enter a new position """
+		return self.status() == "NORMAL"
+
+
+	def canorder(self):
+		""" True if the exchange accepts orders (even though it is busy) """
+		return self.status() not in ("UNKNOWN", "NO ORDER", "STOP")
+
+
+	def update(self, status, publisher=None):
+		""" store health status and push event if it changed
+		 - status    : health status
+		 - publisher : publisher to push event
+		"""
+		prev = self.STATUSES[self.code.value]
+		if status not in self.STATUSES:
+			self.logger.warning("unknown health status '%s'" % status)
+			status = "UNKNOWN"
+		self.code.value = self.STATUSES.index(status)
+		if status != "UNKNOWN":
+			self.refreshed.value = time.monotonic()
+
+		if status != prev:
+			self.logger.info("health of %s changed: %s -> %s" % (self.exch, prev, status))
+			if publisher is not None and len(publisher) > 0:
+				publisher.publish({"event"    : "health",
+				                   "health"   : status,
+				                   "previous" : prev,
+				                   "product"  : self.product})
+
+
+	def refresh(self, api, publisher=None):
+		""" get health from exchange and store it
+		 - api       : exchange adapter
+		 - publisher : publisher to push event
+		"""
+		try:
+			status = api.health(self.product)
+		except exchange.exchangeerror as e:
+			self.nerror += 1
+			self.logger.warning("could not get health: %s" % str(e))
+			# the cached status expires unless it is refreshed
+			if time.monotonic() - self.refreshed.value > self.ttl * self.MAXAGE:
+				self.update("UNKNOWN", publisher)
+			return
+		self.nrefresh += 1
+		self.update(status, publisher)
+
+
+	def run(self, subscriptions=None):
+		""" refresh health periodically (background process)
+		 - subscriptions : list of subscriptions to push health events
+		"""
+
+		# ignore interrupt
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+		self.logger.setLevel(self.loglv)
+		if len(self.logger.handlers) == 0:
+			if len(self.outdir) > 0:
+				outfile = self.outdir + "/health.log"
+			else:
+				outfile = "health.log"
+			fh = logging.FileHandler(outfile)
+			fh.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s'))
+			self.logger.addHandler(fh)
+
+		api = exchange.create(self.exch)
+		if api is None:
+			self.logger.error("invalid exchange name")
+			return
+		publisher = pubsub.publisher(subscriptions)
+
+		sched = scheduler.scheduler(self.ttl, self.stop_flag, self.logger)
+		while self.stop_flag is None or not self.stop_flag.is_set():
+			self.refresh(api, publisher)
+			sched.wait()
+		self.logger.info("health refreshed=%d, errors=%d" % (self.nrefresh, self.nerror))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import numpy as np
+
+import ringbuffer
+
+
+class movingaverage:
+	"""
+	incremental SMA/WMA engine.
+
+	running sum and running weighted sum are kept for each window, so every
+	update costs O(1) per window regardless of the window length.
+	for a window of n entries, the latest entry has weight n and the oldest
+	one has weight 1:
+	 - SMA = S / n                  (S = x[1] + ... + x[n])
+	 - WMA = W / (n * (n + 1) / 2)  (W = 1 * x[1] + ... + n * x[n])
+	when a new entry x arrives to a full window, every weight decreases by 1
+	and the oldest entry leaves, therefore W' = W - S + n * x and
+	S' = S - x[1] + x.
+	"""
+
+	# recalculate running sums from scratch periodically to cancel
+	# accumulated rounding error
+	RESYNC = 60 * 60
+
+	def __init__(self, windows, maxsma, maxwma):
+		""" constructor
+		 - windows : list of window lengths (number of entries)
+		 - maxsma  : maximum number of SMA history entries
+		 - maxwma  : maximum number of WMA history entries
+		"""
+		self.windows = sorted(set([int(n) for n in windows]))
+		if len(self.windows) == 0 or self.windows[0] <= 0:
+			raise ValueError("window length must be natural number")
+
+		# price history (the oldest entry of the largest window is needed)
+		self.prices = ringbuffer.ringbuffer(self.windows[-1] + 1)
+
+		# running sums
+		self.sums = {}
+		self.wsums = {}
+		self.sumweights = {}
+
+		# SMA/WMA history
+		self.smas = {}
+		self.wmas = {}
+		for n in self.windows:
+			self.sums[n] = 0.0
+			self.wsums[n] = 0.0
+			self.sumweights[n] = n * (n + 1) / 2.0
+			self.smas[n] = ringbuffer.ringbuffer(maxsma)
+			self.wmas[n] = ringbuffer.ringbuffer(maxwma)
+
+		self.updcount = 0
+
+
+	def update(self, price):
+		""" update all indicators with new price
+		 - price : last price
+		"""
+		prices = self.prices
+		prices.append(price)
+		count = len(prices)
+		self.updcount += 1
+
+		for n in self.windows:
+			if count > n:	# window is full, the oldest entry leaves
+				oldest = prices[-1 - n]
+				self.wsums[n] += n * price - self.sums[n]
+				self.sums[n] += price - oldest
+			else:			# window is being filled
+				self.wsums[n] += count * price
+				self.sums[n] += price
+
+			if self.updcount % self.RESYNC == 0:
+				self.resync(n)
+
+			# SMA/WMA is 0 until the window is filled
+			if count >= n:
+				self.smas[n].append(self.sums[n] / n)
+				self.wmas[n].append(self.wsums[n] / self.sumweights[n])
+			else:
+				self.smas[n].append(0.0)
+				self.wmas[n].append(0.0)
+
+
+	def rebuild(self, prices):
+		""" rebuild all indicators and their history from price history
+		 - prices : array of last prices in chronological order
+
+		the whole history is calculated in one vectorized pass using
+		cumulative sums instead of calling update() for each price.
+		"""
+		prices = np.asarray(prices, dtype=np.float64)
+		num = len(prices)
+
+		self.prices.clear()
+		self.prices.extend(prices)
+		self.updcount = num
+		if num == 0:
+			for n in self.windows:
+				self.sums[n] = 0.0
+				self.wsums[n] = 0.0
+				self.smas[n].clear()
+				self.wmas[n].clear()
+			return
+
+		# subtract base price to keep cumulative sums small
+		base = prices[-1]
+		devs = prices - base
+		csum = np.concatenate(([0.0], np.cumsum(devs)))
+		cwsum = np.concatenate(([0.0], np.cumsum(devs * np.arange(1, num + 1))))
+
+		for n in self.windows:
+			smas = np.zeros(num)
+			wmas = np.zeros(num)
+			if num >= n:
+				# window ending at t covers prices[t-n+1 .. t]
+				ed = np.arange(n, num + 1)
+				st = ed - n
+				s = csum[ed] - csum[st]
+				# weight of prices[i] in the window is i - st (1..n)
+				w = (cwsum[ed] - cwsum[st]) - st * s
+				smas[n - 1:] = s / n + base
+				wmas[n - 1:] = w / self.sumweights[n] + base
+			self.smas[n].clear()
+			self.smas[n].extend(smas)
+			self.wmas[n].clear()
+			self.wmas[n].extend(wmas)
+
+			# running sums of the latest window
+			self.resync(n)
+
+
+	def resync(self, n):
+		""" recalculate running sums of the window from price history
+		 - n : window length
+		"""
+		lasts = self.prices.column(None, n)
+		self.sums[n] = float(lasts.sum())
+		self.wsums[n] = 0.0
+		for w, price in enumerate(lasts, 1):
+			self.wsums[n] += w * float(price)
+
+
+	def sma(self, n, idx=-1):
+		""" get SMA
+		 - n   : window length
+		 - idx : index of SMA history, -1 indicates the latest entry
+		"""
+		return self.smas[n][idx]
+
+
+	def wma(self, n, idx=-1):
+		""" get WMA
+		 - n   : window length
+		 - idx : index of WMA history, -1 indicates the latest entry
+		"""
+		return self.wmas[n][idx]
+
+
+	def get(self, kind, idx=-1):
+		""" get xMA by name
+		 - kind : xMA kind, "SMA<n>" or "WMA<n>" (e.g. "SMA30", "WMA300")
+		 - idx  : index of xMA history, -1 indicates the latest entry
+
+		return 0 if kind is unknown.
+		"""
+		m = re.match(r"^([SW])MA(\d+)$", kind.upper())
+		if m is None:
+			return 0
+		n = int(m.group(2))
+		if n not in self.windows:
+			return 0
+
+		if m.group(1) == "S":
+			return self.sma(n, idx)
+		else:
+			return self.wma(n, idx)
+
+
+	def latest(self):
+		""" get the latest value of all indicators as dict
+		    keys are "sma<n>" and "wma<n>" (e.g. "sma30", "wma60")
+		"""
+		xmas = {}
+		for n in self.windows:
+			xmas["sma%d" % n] = self.smas[n][-1]
+			xmas["wma%d" % n] = self.wmas[n][-1]
+		return xmas
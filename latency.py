@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import logging
+
+import numpy as np
+
+import ringbuffer
+
+
+# interval of periodic latency log line [sec], 0 disables the log line
+# (set by vcts before the modules are created)
+LOG_INTERVAL = 60.0
+
+
+def stamp(ticker, name):
+	""" put monotonic timestamp of the stage to the ticker
+	 - ticker : ticker object (stamps are kept in "stamps" dict)
+	 - name   : stamp name (see tracker.STAMPS)
+	"""
+	stamps = ticker.get("stamps")
+	if stamps is None:
+		stamps = ticker["stamps"] = {}
+	stamps[name] = time.monotonic()
+	return stamps
+
+
+class tracker:
+	"""
+	per-stage tick-to-decision latency of this process.
+
+	every ticker carries monotonic timestamps ("stamps" dict) below.
+	monotonic clock is shared by the processes on the host, so stamps
+	taken by polling are compared with stamps taken by strategies.
+	 - exchange  : exchange timestamp (converted to monotonic clock)
+	 - fetch_st  : start of ticker fetch
+	 - fetch_end : end of ticker fetch
+	 - append    : ticker is appended to ring buffer
+	 - xma       : SMA/WMA are updated
+	 - write     : ticker is written to CSV/binary
+	 - publish   : ticker is published to strategies
+	 - receipt   : strategy received the ticker
+	 - decision  : strategy made a decision by the ticker
+
+	latency of each stage is the time between two stamps (STAGES), and
+	"total" is the time from START to the latest stamp. the latest
+	MAXSAMPLES latencies of each stage are kept to calculate percentiles.
+	"""
+
+	# stage : (stamp of start, stamp of end)
+	STAGES = {"age"      : ("exchange", "fetch_end"),
+	          "fetch"    : ("fetch_st", "fetch_end"),
+	          "append"   : ("fetch_end", "append"),
+	          "xma"      : ("append", "xma"),
+	          "write"    : ("xma", "write"),
+	          "publish"  : ("write", "publish"),
+	          "receipt"  : ("publish", "receipt"),
+	          "decision" : ("receipt", "decision")}
+	STAMPS = ["exchange", "fetch_st", "fetch_end", "append", "xma", "write", "publish", "receipt", "decision"]
+	START = "fetch_st"
+	MAXSAMPLES = 1000
+
+	def __init__(self, name, logger=None, interval=None):
+		""" constructor
+		 - name     : name of this process shown in log line
+		 - logger   : logger object
+		 - interval : interval of periodic log line [sec], None indicates
+		              LOG_INTERVAL, 0 disables the log line
+		"""
+		self.name = name
+		if logger is None:
+			logger = logging.getLogger("latency")
+		self.logger = logger
+		if interval is None:
+			interval = LOG_INTERVAL
+		self.interval = interval
+
+		self.stages = list(self.STAGES) + ["total"]
+		self.samples = {stage : ringbuffer.ringbuffer(self.MAXSAMPLES) for stage in self.stages}
+		self.lock = threading.Lock()
+		self.nrecord = 0
+		self.lastlog = time.monotonic()
+
+
+	def record(self, stamps):
+		""" record latencies of the stages of a ticker
+		 - stamps : "stamps" dict of the ticker
+
+		stages whose stamps are missing (e.g. ticker read from shared memory
+		snapshot has receipt and decision only) are skipped.
+		"""
+		if not stamps:
+			return
+		with self.lock:
+			for stage, (st, end) in self.STAGES.items():
+				if st in stamps and end in stamps:
+					self.samples[stage].append(max(0.0, stamps[end] - stamps[st]))
+			if self.START in stamps:
+				latest = max([stamps[name] for name in self.STAMPS[self.STAMPS.index(self.START):] if name in stamps])
+				self.samples["total"].append(latest - stamps[self.START])
+			self.nrecord += 1
+
+		if self.interval > 0 and time.monotonic() - self.lastlog >= self.interval:
+			self.log()
+
+
+	def stats(self):
+		""" get latency percentiles of the stages [msec]
+
+		return {stage: {"count", "p50", "p90", "p99", "max"}}, stages
+		without sample are omitted.
+		"""
+		stats = {}
+		with self.lock:
+			for stage in self.stages:
+				if len(self.samples[stage]) == 0:
+					continue
+				lat = self.samples[stage].column() * 1000.0
+				p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+				stats[stage] = {"count" : len(lat),
+				                "p50"   : float(p50),
+				                "p90"   : float(p90),
+				                "p99"   : float(p99),
+				                "max"   : float(lat.max())}
+		return stats
+
+
+	def log(self):
+		""" write latency percentiles of all stages in a log line """
+		self.lastlog = time.monotonic()
+		stats = self.stats()
+		if len(stats) == 0:
+			return
+		line = ", ".join(["%s=%.2f/%.2f/%.2f/%.2f" % (stage, ent["p50"], ent["p90"], ent["p99"], ent["max"])
+		                  for stage, ent in stats.items()])
+		self.logger.info("%s latency p50/p90/p99/max [ms]: %s" % (self.name, line))
+
+
+class ordertracker(tracker):
+	"""
+	per-stage latency from order submission to acknowledgement.
+
+	every order intent carries monotonic timestamps ("stamps" dict) below.
+	 - submit  : strategy submitted the order to order gateway
+	 - dequeue : order gateway took the order from the queue
+	 - send    : order gateway sent the (batched) order to exchange
+	 - sent    : exchange responded to the order
+	 - ack     : strategy received the acknowledgement
+	"""
+
+	STAGES = {"queue" : ("submit", "dequeue"),
+	          "batch" : ("dequeue", "send"),
+	          "send"  : ("send", "sent"),
+	          "ack"   : ("sent", "ack")}
+	STAMPS = ["submit", "dequeue", "send", "sent", "ack"]
+	START = "submit"
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+
+import numpy as np
+
+
+class ledger:
+	"""
+	local ledger of my executions (fills) and open lots.
+
+	executions are synchronized incrementally by the ID cursor: after the
+	initial backfill, only executions newer than the last seen ID are
+	fetched with "after" parameter, so that the same fills are not
+	downloaded again and fills older than one page are not lost.
+
+	bought fills are kept as open lots, and sold fills close the lots in
+	FIFO order. entry prices of the open lots are kept in an array in the
+	same order (appended at the tail, consumed from the head), and served
+	without copy for vectorized evaluation.
+
+	if 'journal' is enabled, opened and closed lots are recorded until
+	they are taken by takechanges(), so that the consumer (e.g. trigger
+	index of sell) follows the lots incrementally.
+	"""
+
+	PAGESIZE = 500		# number of executions per request
+	MAXPAGES = 20		# maximum number of pages in one synchronization
+
+	def __init__(self, product, logger=None, pagesize=PAGESIZE, maxpages=MAXPAGES, journal=False):
+		""" constructor
+		 - product  : product code
+		 - logger   : logger object
+		 - pagesize : number of executions per request
+		 - maxpages : maximum number of pages in one synchronization
+		              (backfill is limited to pagesize * maxpages fills)
+		 - journal  : True to record opened and closed lots
+		"""
+		self.product = product.upper()
+		if logger is None:
+			logger = logging.getLogger("ledger")
+		self.logger = logger
+		self.pagesize = pagesize
+		self.maxpages = maxpages
+
+		# ID cursor (0 until the first execution is seen) and whether the
+		# initial backfill has been done (the account may have no execution)
+		self.lastid = 0
+		self.backfilled = False
+		self.lots = collections.deque()
+
+		# entry prices of open lots (pricebuf[head:tail]), and list of open
+		# lots cached until lots are changed
+		self.version = 0
+		self.pricebuf = np.zeros(64, dtype=np.float64)
+		self.head = 0
+		self.tail = 0
+		self.posver = -1
+		self.poslist = []
+
+		# opened and closed lots: list of ("open" or "close", lot)
+		self.journal = [] if journal else None
+
+		# counters
+		self.nfill = 0
+		self.nrequest = 0
+		self.nunmatched = 0
+
+
+	def __len__(self):
+		return len(self.lots)
+
+
+	def fetch(self, api, after):
+		""" fetch executions newer than the cursor, paging backward by
+		    "before" while pages are full
+		 - api   : exchange adapter
+		 - after : ID cursor, 0 indicates backfill from the latest
+
+		return list of executions (the latest first).
+		"""
+		execs = []
+		before = None
+		for page in range(self.maxpages):
+			self.nrequest += 1
+			ret = api.executions(self.product, count=self.pagesize, before=before,
+			                     after=after if after > 0 else None)
+			if ret is None or len(ret) == 0:
+				break
+			execs.extend(ret)
+			if len(ret) < self.pagesize:
+				break
+			before = min([int(ent["id"]) for ent in ret])
+		else:
+			self.logger.warning("executions are truncated at %d pages" % self.maxpages)
+		return execs
+
+
+	def sync(self, api):
+		""" synchronize executions with exchange
+		 - api : exchange adapter
+
+		return number of new fills. exchangeerror is raised if executions
+		could not be fetched, and the ledger is not changed in that case.
+		"""
+		backfill = not self.backfilled
+		execs = self.fetch(api, self.lastid)
+		napply = self.apply(execs)
+		self.backfilled = True
+		if backfill and napply > 0:
+			self.logger.info("%d executions are backfilled, %d open lots" % (napply, len(self.lots)))
+		elif backfill:
+			self.logger.debug("no execution is backfilled")
+		elif napply > 0:
+			self.logger.debug("%d new executions, %d open lots" % (napply, len(self.lots)))
+		return napply
+
+
+	def apply(self, execs):
+		""" apply executions to open lots in ID order
+		 - execs : list of executions
+
+		return number of applied fills.
+		"""
+		napply = 0
+		for ent in sorted(execs, key=lambda ent: int(ent["id"])):
+			eid = int(ent["id"])
+			if eid <= self.lastid:
+				continue
+			self.lastid = eid
+			napply += 1
+
+			size = float(ent["size"])
+			if ent["side"] == "BUY":
+				lot = dict(ent)
+				lot["size"] = size
+				self.lots.append(lot)
+				self.pushprice(float(lot["price"]))
+				if self.journal is not None:
+					self.journal.append(("open", lot))
+				continue
+
+			# sold fill closes the oldest lots
+			while size > 1e-12 and len(self.lots) > 0:
+				lot = self.lots[0]
+				closed = min(size, lot["size"])
+				lot["size"] -= closed
+				size -= closed
+				if lot["size"] <= 1e-12:
+					self.lots.popleft()
+					self.head += 1
+					if self.journal is not None:
+						self.journal.append(("close", lot))
+			if size > 1e-12:
+				# sold more than the known lots (bought before the backfill)
+				self.nunmatched += 1
+
+		if napply > 0:
+			self.nfill += napply
+			self.version += 1
+		return napply
+
+
+	def pushprice(self, price):
+		""" append entry price of an opened lot """
+		if self.tail == len(self.pricebuf):
+			# move live prices to the head, and grow when more than half is used
+			live = self.pricebuf[self.head:self.tail]
+			if len(live) * 2 > len(self.pricebuf):
+				self.pricebuf = np.zeros(len(self.pricebuf) * 2, dtype=np.float64)
+			self.pricebuf[:len(live)] = live
+			self.head, self.tail = 0, len(live)
+		self.pricebuf[self.tail] = price
+		self.tail += 1
+
+
+	def positions(self):
+		""" get open lots (the oldest first), the list is shared until lots
+		    are changed
+		"""
+		if self.posver != self.version:
+			self.poslist = list(self.lots)
+			self.posver = self.version
+		return self.poslist
+
+
+	def prices(self):
+		""" get entry prices of open lots as array (read-only view, valid
+		    until lots are changed)
+		"""
+		return self.pricebuf[self.head:self.tail]
+
+
+	def takechanges(self):
+		""" take opened and closed lots recorded since the previous call
+
+		return list of ("open" or "close", lot) in the order of changes.
+		"""
+		if self.journal is None:
+			return []
+		changes = self.journal
+		self.journal = []
+		return changes
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import math
+import time
+import random
+import datetime
+import argparse
+import threading
+import urllib.parse
+import http.server
+
+
+class distribution:
+	"""
+	random distribution given by string "<kind>:<param>,<param>,..."
+	 - const:<value>
+	 - uniform:<min>,<max>
+	 - exp:<mean>
+	 - normal:<mean>,<stddev>           (negative value is clipped to 0)
+	 - lognormal:<median>,<sigma>
+	"""
+
+	def __init__(self, spec, rng):
+		""" constructor
+		 - spec : distribution string
+		 - rng  : random.Random object
+		"""
+		self.spec = spec
+		self.rng = rng
+		kind, sep, params = spec.partition(":")
+		self.kind = kind.strip().lower()
+		self.params = [float(val) for val in params.split(",") if len(val.strip()) > 0]
+
+		nparams = {"const" : 1, "uniform" : 2, "exp" : 1, "normal" : 2, "lognormal" : 2}
+		if self.kind not in nparams:
+			raise ValueError("unknown distribution '%s'" % spec)
+		if len(self.params) != nparams[self.kind]:
+			raise ValueError("%s requires %d parameter(s)" % (self.kind, nparams[self.kind]))
+
+
+	def sample(self):
+		""" get a random value """
+		if self.kind == "const":
+			return self.params[0]
+		elif self.kind == "uniform":
+			return self.rng.uniform(self.params[0], self.params[1])
+		elif self.kind == "exp":
+			return self.rng.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+		elif self.kind == "normal":
+			return max(0.0, self.rng.gauss(self.params[0], self.params[1]))
+		else:
+			return self.params[0] * math.exp(self.rng.gauss(0.0, self.params[1]))
+
+
+class priceprocess:
+	"""
+	simulated market of a product.
+
+	price is advanced every 'tick' seconds of wall clock by the process
+	given by string "<kind>:<param>,...":
+	 - const               : constant price
+	 - randomwalk:<sigma>  : add normal noise of <sigma> [ratio of initial
+	                         price], so that every product moves alike
+	 - gbm:<mu>,<sigma>    : geometric brownian motion, <mu> and <sigma> are
+	                         drift and volatility per day
+	 - sine:<amp>,<period> : sine wave of <amp> [ratio] and <period> [sec]
+
+	the bid/ask spread is <spread> ratio of the price (with jitter).
+	"""
+
+	SECPERDAY = 86400.0
+
+	def __init__(self, spec, price, spread, rng, tick=1.0):
+		""" constructor
+		 - spec   : price process string
+		 - price  : initial price
+		 - spread : bid/ask spread (ratio of price)
+		 - rng    : random.Random object
+		 - tick   : interval to advance price [sec]
+		"""
+		kind, sep, params = spec.partition(":")
+		self.kind = kind.strip().lower()
+		self.params = [float(val) for val in params.split(",") if len(val.strip()) > 0]
+		nparams = {"const" : 0, "randomwalk" : 1, "gbm" : 2, "sine" : 2}
+		if self.kind not in nparams:
+			raise ValueError("unknown price process '%s'" % spec)
+		if len(self.params) != nparams[self.kind]:
+			raise ValueError("%s requires %d parameter(s)" % (self.kind, nparams[self.kind]))
+
+		self.base = price
+		self.price = price
+		self.spread = spread
+		self.rng = rng
+		self.tick = tick
+		self.sttime = time.time()
+		self.lasttime = self.sttime
+		self.tickid = 0
+		self.volume = 0.0
+		self.high = price
+		self.low = price
+		self.bid = price
+		self.ask = price
+		self.quote()
+
+
+	def step(self):
+		""" advance price by one tick """
+		if self.kind == "randomwalk":
+			self.price = max(self.price + self.rng.gauss(0.0, self.base * self.params[0]), self.base * 0.01)
+		elif self.kind == "gbm":
+			dt = self.tick / self.SECPERDAY
+			mu, sigma = self.params
+			self.price *= math.exp((mu - sigma * sigma / 2.0) * dt + sigma * math.sqrt(dt) * self.rng.gauss(0.0, 1.0))
+		elif self.kind == "sine":
+			amp, period = self.params
+			self.price = self.base * (1.0 + amp * math.sin(2.0 * math.pi * (self.lasttime - self.sttime) / period))
+		self.tickid += 1
+		self.volume += abs(self.rng.gauss(0.0, 0.1))
+		self.high = max(self.high, self.price)
+		self.low = min(self.low, self.price)
+		self.quote()
+
+
+	def quote(self):
+		""" set best bid/ask around the price """
+		half = self.price * self.spread * (0.5 + self.rng.random()) / 2.0
+		self.bid = round(self.price - half, 8)
+		self.ask = round(self.price + half, 8)
+
+
+	def advance(self, now):
+		""" advance price to the current time
+		 - now : current time (epoch)
+		"""
+		nstep = int((now - self.lasttime) / self.tick)
+		for count in range(min(nstep, 3600)):
+			self.lasttime += self.tick
+			self.step()
+		if nstep > 3600:
+			self.lasttime = now
+
+
+class mockmarket:
+	"""
+	state of mock exchange: markets, my orders, executions and positions.
+	all methods are called with lock held.
+	"""
+
+	# initial price of each product
+	PRICES = {"BTC_JPY" : 5000000.0, "FX_BTC_JPY" : 5000000.0, "ETH_BTC" : 0.05, "BCH_BTC" : 0.1}
+
+	def __init__(self, args):
+		""" constructor
+		 - args : parsed command line arguments
+		"""
+		self.args = args
+		self.rng = random.Random(args.seed)
+		self.latency = distribution(args.latency, self.rng)
+		self.lock = threading.Lock()
+
+		self.markets = {}
+		self.executions = []
+		self.positions = {}
+		self.orders = []
+		self.nextid = 1
+
+		# statistics
+		self.nrequest = {}
+		self.nerror = 0
+
+
+	def market(self, exch, product):
+		""" get market of the product (created on the first access)
+		 - exch    : exchange name
+		 - product : product code
+		"""
+		key = (exch, product.upper())
+		if key not in self.markets:
+			price = self.PRICES.get(product.upper(), 1000.0)
+			rng = random.Random("%s:%s:%s" % (self.args.seed, exch, product.upper()))
+			self.markets[key] = priceprocess(self.args.price, price, self.args.spread, rng, self.args.tick)
+		mkt = self.markets[key]
+		mkt.advance(time.time())
+		return mkt
+
+
+	def execute(self, product, side, price, size, acceptid):
+		""" record my execution
+		 - product  : product code
+		 - side     : "BUY" or "SELL"
+		 - price    : execution price
+		 - size     : execution size
+		 - acceptid : child order acceptance ID
+		"""
+		execid = self.nextid
+		self.nextid += 1
+		execdate = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+		self.executions.append({"id"                        : execid,
+		                        "product_code"              : product,
+		                        "child_order_id"            : "JOR%d" % execid,
+		                        "side"                      : side,
+		                        "price"                     : price,
+		                        "size"                      : size,
+		                        "commission"                : 0,
+		                        "exec_date"                 : execdate,
+		                        "child_order_acceptance_id" : acceptid})
+
+		# positions of margin trading are closed in FIFO order
+		if product.startswith("FX_"):
+			poss = self.positions.setdefault(product, [])
+			remain = size
+			while remain > 1e-12 and len(poss) > 0 and poss[0]["side"] != side:
+				closed = min(remain, poss[0]["size"])
+				poss[0]["size"] -= closed
+				remain -= closed
+				if poss[0]["size"] <= 1e-12:
+					poss.pop(0)
+			if remain > 1e-12:
+				poss.append({"product_code"          : product,
+				             "side"                  : side,
+				             "price"                 : price,
+				             "size"                  : remain,
+				             "commission"            : 0,
+				             "swap_point_accumulate" : 0,
+				             "require_collateral"    : price * remain / 4.0,
+				             "open_date"             : execdate,
+				             "leverage"              : 4,
+				             "pnl"                   : 0})
+
+
+	def order(self, exch, product, ordtype, side, size, price):
+		""" accept my order, market order is executed immediately and limit
+		    order is executed when the price crosses
+		 - exch    : exchange name
+		 - product : product code
+		 - ordtype : "MARKET" or "LIMIT"
+		 - side    : "BUY" or "SELL"
+		 - size    : order size
+		 - price   : limit price
+		"""
+		acceptid = "JRF%08d" % self.nextid
+		self.nextid += 1
+		self.orders.append({"acceptid" : acceptid, "exch" : exch, "product" : product, "type" : ordtype,
+		                    "side" : side, "size" : size, "price" : price})
+		self.match(exch, product)
+		return acceptid
+
+
+	def match(self, exch, product):
+		""" execute orders which can be matched at the current price
+		 - exch    : exchange name
+		 - product : product code
+		"""
+		mkt = self.market(exch, product)
+		remains = []
+		for odr in self.orders:
+			if odr["exch"] != exch or odr["product"] != product:
+				remains.append(odr)
+				continue
+			# crossed order is executed at the best price of the market
+			if odr["side"] == "BUY" and (odr["type"] == "MARKET" or odr["price"] >= mkt.ask):
+				self.execute(product, "BUY", mkt.ask, odr["size"], odr["acceptid"])
+			elif odr["side"] == "SELL" and (odr["type"] == "MARKET" or odr["price"] <= mkt.bid):
+				self.execute(product, "SELL", mkt.bid, odr["size"], odr["acceptid"])
+			else:
+				remains.append(odr)
+		self.orders = remains
+
+
+class mockhandler(http.server.BaseHTTPRequestHandler):
+	""" request handler of mock exchange """
+
+	protocol_version = "HTTP/1.1"
+
+	# header and body are sent in separate segments, which are delayed by
+	# Nagle's algorithm and delayed ACK of keep-alive connection
+	disable_nagle_algorithm = True
+
+	def log_message(self, fmt, *args):
+		if self.server.verbose:
+			sys.stderr.write("%s - %s\n" % (self.address_string(), fmt % args))
+
+
+	def reply(self, status, obj):
+		""" send JSON response
+		 - status : HTTP status code
+		 - obj    : response object
+		"""
+		body = json.dumps(obj).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+	def do_GET(self):
+		self.dispatch("GET")
+
+
+	def do_POST(self):
+		self.dispatch("POST")
+
+
+	def dispatch(self, method):
+		""" simulate latency and error, and call API handler
+		 - method : HTTP method
+		"""
+		url = urllib.parse.urlsplit(self.path)
+		query = dict(urllib.parse.parse_qsl(url.query))
+		body = b""
+		if "Content-Length" in self.headers:
+			body = self.rfile.read(int(self.headers["Content-Length"]))
+
+		mkt = self.server.market
+		with mkt.lock:
+			mkt.nrequest[url.path] = mkt.nrequest.get(url.path, 0) + 1
+			delay = mkt.latency.sample()
+			error = (mkt.rng.random() < self.server.error_rate)
+			if error:
+				mkt.nerror += 1
+
+		if delay > 0:
+			time.sleep(delay)
+		if url.path == "/mock/stats":
+			with mkt.lock:
+				self.reply(200, {"requests" : dict(mkt.nrequest), "errors" : mkt.nerror})
+			return
+		if error:
+			self.reply(503, {"status" : -500, "error_message" : "mock error", "data" : None})
+			return
+
+		handler = self.server.routes.get((method, url.path))
+		if handler is None:
+			self.reply(404, {"status" : -404, "error_message" : "not found", "data" : None})
+			return
+		if url.path.startswith("/v1/me/") or url.path.startswith("/api/exchange/"):
+			if "ACCESS-KEY" not in self.headers:
+				self.reply(401, {"status" : -500, "error_message" : "Invalid API key", "data" : None})
+				return
+
+		with mkt.lock:
+			status, obj = handler(self, query, body)
+		self.reply(status, obj)
+
+
+	############################################################################
+	# bitflyer
+
+	def bfticker(self, query, body):
+		product = query.get("product_code", "BTC_JPY").upper()
+		mkt = self.server.market.market("bitflyer", product)
+		return 200, {"product_code"      : product,
+		             "state"             : "RUNNING",
+		             "timestamp"         : datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3],
+		             "tick_id"           : mkt.tickid,
+		             "best_bid"          : mkt.bid,
+		             "best_ask"          : mkt.ask,
+		             "best_bid_size"     : 0.1,
+		             "best_ask_size"     : 0.1,
+		             "total_bid_depth"   : 1000.0,
+		             "total_ask_depth"   : 1000.0,
+		             "market_bid_size"   : 0.0,
+		             "market_ask_size"   : 0.0,
+		             "ltp"               : round(mkt.price, 8),
+		             "volume"            : mkt.volume,
+		             "volume_by_product" : mkt.volume}
+
+
+	def bfhealth(self, query, body):
+		return 200, {"status" : self.server.health}
+
+
+	def bfexecutions(self, query, body):
+		product = query.get("product_code", "BTC_JPY").upper()
+		self.server.market.match("bitflyer", product)
+		count = int(query.get("count", 100))
+		before = int(query.get("before", 0))
+		after = int(query.get("after", 0))
+		execs = [ent for ent in self.server.market.executions
+		         if ent["product_code"] == product and
+		            (before <= 0 or ent["id"] < before) and ent["id"] > after]
+		# the latest execution first
+		return 200, list(reversed(execs))[:count]
+
+
+	def bfpositions(self, query, body):
+		product = query.get("product_code", "FX_BTC_JPY").upper()
+		if not product.startswith("FX_"):
+			return 400, {"status" : -158, "error_message" : "Invalid product", "data" : None}
+		self.server.market.match("bitflyer", product)
+		return 200, [dict(pos) for pos in self.server.market.positions.get(product, [])]
+
+
+	def bfsendorder(self, query, body):
+		try:
+			req = json.loads(body.decode())
+			acceptid = self.server.market.order("bitflyer", req["product_code"].upper(),
+			                                    req["child_order_type"].upper(), req["side"].upper(),
+			                                    float(req["size"]), float(req.get("price", 0) or 0))
+		except (ValueError, KeyError) as e:
+			return 400, {"status" : -110, "error_message" : "invalid order: %s" % str(e), "data" : None}
+		return 200, {"child_order_acceptance_id" : acceptid}
+
+
+	############################################################################
+	# coincheck
+
+	def ccticker(self, query, body):
+		mkt = self.server.market.market("coincheck", query.get("pair", "btc_jpy"))
+		return 200, {"last"      : round(mkt.price),
+		             "bid"       : round(mkt.bid),
+		             "ask"       : round(mkt.ask),
+		             "high"      : round(mkt.high),
+		             "low"       : round(mkt.low),
+		             "volume"    : mkt.volume,
+		             "timestamp" : int(time.time())}
+
+
+	def ccorderbooks(self, query, body):
+		mkt = self.server.market.market("coincheck", query.get("pair", "btc_jpy"))
+		step = max(1.0, round(mkt.price * 0.0001))
+		asks = [["%.1f" % (round(mkt.ask) + step * idx), "%.8f" % (0.01 * (idx + 1))] for idx in range(20)]
+		bids = [["%.1f" % (round(mkt.bid) - step * idx), "%.8f" % (0.01 * (idx + 1))] for idx in range(20)]
+		return 200, {"asks" : asks, "bids" : bids}
+
+
+	def cctrades(self, query, body):
+		pair = query.get("pair", "btc_jpy")
+		mkt = self.server.market.market("coincheck", pair)
+		now = datetime.datetime.utcnow()
+		data = []
+		for idx in range(20):
+			data.append({"id"         : mkt.tickid * 20 - idx,
+			             "amount"     : "0.01",
+			             "rate"       : "%.1f" % round(mkt.price),
+			             "pair"       : pair,
+			             "order_type" : "buy" if idx % 2 == 0 else "sell",
+			             "created_at" : (now - datetime.timedelta(seconds=idx)).strftime("%Y-%m-%dT%H:%M:%S.000Z")})
+		return 200, {"success"    : True,
+		             "pagination" : {"limit" : 20, "order" : "desc", "starting_after" : None, "ending_before" : None},
+		             "data"       : data}
+
+
+	def ccorders(self, query, body):
+		form = dict(urllib.parse.parse_qsl(body.decode()))
+		pair = form.get("pair", "btc_jpy")
+		ordtype = form.get("order_type", "")
+		try:
+			if ordtype in ("buy", "sell"):
+				acceptid = self.server.market.order("coincheck", pair.upper(), "LIMIT", ordtype.upper(),
+				                                    float(form["amount"]), float(form["rate"]))
+			elif ordtype == "market_sell":
+				acceptid = self.server.market.order("coincheck", pair.upper(), "MARKET", "SELL", float(form["amount"]), 0)
+			elif ordtype == "market_buy":
+				mkt = self.server.market.market("coincheck", pair)
+				acceptid = self.server.market.order("coincheck", pair.upper(), "MARKET", "BUY",
+				                                    float(form["market_buy_amount"]) / mkt.ask, 0)
+			else:
+				return 400, {"success" : False, "error" : "invalid order_type"}
+		except (ValueError, KeyError) as e:
+			return 400, {"success" : False, "error" : str(e)}
+		return 200, {"success" : True, "id" : acceptid, "pair" : pair, "order_type" : ordtype}
+
+
+class mockserver(http.server.ThreadingHTTPServer):
+	""" mock exchange HTTP server serving bitflyer and coincheck APIs """
+
+	daemon_threads = True
+
+	def __init__(self, args):
+		""" constructor
+		 - args : parsed command line arguments
+		"""
+		super().__init__((args.host, args.port), mockhandler)
+		self.market = mockmarket(args)
+		self.error_rate = args.error_rate
+		self.health = args.health
+		self.verbose = args.verbose
+		self.routes = {("GET", "/v1/ticker")            : mockhandler.bfticker,
+		               ("GET", "/v1/getticker")         : mockhandler.bfticker,
+		               ("GET", "/v1/gethealth")         : mockhandler.bfhealth,
+		               ("GET", "/v1/me/getexecutions")  : mockhandler.bfexecutions,
+		               ("GET", "/v1/me/getpositions")   : mockhandler.bfpositions,
+		               ("POST", "/v1/me/sendchildorder") : mockhandler.bfsendorder,
+		               ("GET", "/api/ticker")           : mockhandler.ccticker,
+		               ("GET", "/api/order_books")      : mockhandler.ccorderbooks,
+		               ("GET", "/api/trades")           : mockhandler.cctrades,
+		               ("POST", "/api/exchange/orders") : mockhandler.ccorders}
+
+
+def parseargs(argv=None):
+	""" parse command line arguments """
+	parser = argparse.ArgumentParser(description='mock bitflyer/coincheck exchange server')
+	parser.add_argument('--host', metavar='addr', dest='host',
+	                    type=str, required=False, default='127.0.0.1',
+	                    help='listen address')
+	parser.add_argument('--port', metavar='port', dest='port',
+	                    type=int, required=False, default=8080,
+	                    help='listen port')
+	parser.add_argument('--latency', metavar='dist', dest='latency',
+	                    type=str, required=False, default='const:0',
+	                    help='latency distribution [sec], e.g. "lognormal:0.05,0.5", "uniform:0.01,0.1", "exp:0.05"')
+	parser.add_argument('--error-rate', metavar='rate', dest='error_rate',
+	                    type=float, required=False, default=0.0,
+	                    help='rate of HTTP 503 responses (0.0 - 1.0)')
+	parser.add_argument('--price', metavar='process', dest='price',
+	                    type=str, required=False, default='randomwalk:0.0001',
+	                    help='price process, e.g. "const", "randomwalk:0.0001", "gbm:0,0.5", "sine:0.01,600"')
+	parser.add_argument('--spread', metavar='ratio', dest='spread',
+	                    type=float, required=False, default=0.0002,
+	                    help='bid/ask spread (ratio of price)')
+	parser.add_argument('--tick', metavar='sec', dest='tick',
+	                    type=float, required=False, default=1.0,
+	                    help='interval to advance price [sec]')
+	parser.add_argument('--health', metavar='status', dest='health',
+	                    type=str, required=False, default='NORMAL',
+	                    help='status returned by gethealth')
+	parser.add_argument('--seed', metavar='seed', dest='seed',
+	                    type=int, required=False, default=0,
+	                    help='random seed')
+	parser.add_argument('-v', '--verbose', dest='verbose',
+	                    required=False, action="store_true", default=False,
+	                    help='log every request')
+	return parser.parse_args(argv)
+
+
+################################################################################
+
+if __name__ == "__main__":
+	args = parseargs()
+	try:
+		server = mockserver(args)
+	except ValueError as e:
+		print("ERROR: %s" % str(e))
+		sys.exit(1)
+
+	print("INFO: mock exchange listening on http://%s:%d" % (args.host, server.server_port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print("INFO: requests=%s, errors=%d" % (str(server.market.nrequest), server.market.nerror))
+
+	sys.exit(0)
@@ -4,36 +4,59 @@
 import os
 import sys
 import time
-import pandas as pd
+import numpy as np
 import datetime
 import argparse
-from coincheck import market
-import pybitflyer
 from multiprocessing import Queue
 import logging
 import signal
+import queue
+import threading
+
+import csvwriter
+import exchange
+import indicator
+import latency
+import pubsub
+import ringbuffer
+import scheduler
+import tickstore
+import trigger
 
 class polling:
 	"""
 	polling ticker from coincheck or bitflyer.
 
-	this module uses 'coincheck' and 'pybitflyer' module to fetch ticker.
-	for more information, see the followings:
-	 - https://github.com/kmn/coincheck
-	 - https://github.com/yagays/pybitflyer
+	ticker is fetched through exchange adapter (see exchange.py).
 	"""
 
-	def __init__(self, exch, outdir="", loglv="INFO", reqq=None, rspq=None, stop_flag=None, q_get_tov=None):
+	# decimals of prices in ticker CSV by quote currency of the product
+	PRICE_DECIMALS = {"JPY" : 1}
+	DEFAULT_DECIMALS = 8
+
+	def __init__(self, exch, outdir="", loglv="INFO", reqq=None, rspq=None, stop_flag=None, q_get_tov=None, windows=None, flush_rows=60, flush_interval=5.0, output=None, snapshot=None, subscriptions=None, product=None, hedge=0):
 		""" constructor
-		 - exch      : coin exchange name
-		               "coincheck"
-		               "bitflyer"
-		 - outdir    : CSV output directory
-		 - loglv     : log level
-		 - reqq      : request-to-polling queue
-		 - rspq      : response-from-polling queue
-		 - stop_flag : stop flag
-		 - q_get_tov : TOV getting from queue
+		 - exch           : coin exchange name
+		                    "coincheck"
+		                    "bitflyer"
+		 - outdir         : CSV output directory
+		 - loglv          : log level
+		 - reqq           : request-to-polling queue
+		 - rspq           : response-from-polling queue, or dict of queues
+		                    keyed by client ID
+		 - stop_flag      : stop flag
+		 - q_get_tov      : TOV getting from queue
+		 - windows        : list of SMA/WMA window lengths (default: [30, 60])
+		 - flush_rows     : number of pending CSV rows to flush
+		 - flush_interval : maximum interval between CSV flushes [sec]
+		 - output         : list of ticker output formats, "csv" and/or
+		                    "binary" (default: ["csv"])
+		 - snapshot       : shared memory snapshot to publish the latest ticker
+		 - subscriptions  : list of subscriptions to push every ticker
+		 - product        : product code polled by this object, which is
+		                    added to CSV/binary file name if specified
+		 - hedge          : percentile of ticker latency to issue hedge
+		                    request, 0 disables hedging
 		"""
 
 		# control parameters
@@ -41,6 +64,7 @@ class polling:
 		# self.MAXTICKER = 2	# 60sec * 60min * 24hr = 1day
 		self.MAXSMA = 60 * 60 * 24
 		self.MAXWMA = 60 * 60 * 24
+		self.CSVHEADER = "datetime,product,last,best_bid,best_ask,timestamp"
 
 		# set logger
 		try:
@@ -51,51 +75,103 @@ class polling:
 				outfile = outdir + "/polling.log"
 			else:
 				outfile = "polling.log"
-			fh = logging.FileHandler(outfile)
-
-			self.logger.addHandler(fh)
-			sh = logging.StreamHandler()
-			# self.logger.addHandler(sh)
-			formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
-			fh.setFormatter(formatter)
-			sh.setFormatter(formatter)
+			# polling objects of multiple products share one log file
+			if len(self.logger.handlers) == 0:
+				fh = logging.FileHandler(outfile)
+
+				self.logger.addHandler(fh)
+				sh = logging.StreamHandler()
+				# self.logger.addHandler(sh)
+				formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+				fh.setFormatter(formatter)
+				sh.setFormatter(formatter)
 		except:
 			raise
 
 		# set exchange
 		self.exch = exch.lower()
-		self.cc = None
-		self.bf = None
-		if self.exch == "coincheck":
-			self.cc = market.Market()
-		elif self.exch == "bitflyer":
-			self.bf = pybitflyer.API()
-		else:
+		self.api = exchange.create(self.exch, hedge=hedge)
+		if self.api is None:
 			self.logger.error("invalid exchange name")
 			return
 
-		# set CSV file name
+		# set CSV/binary file name
+		if output is None or len(output) == 0:
+			output = ["csv"]
+		output = [fmt.lower() for fmt in output]
+		self.product = product
+		self.tickercsv = ""
+		self.tickerbin = ""
 		if len(outdir) > 0:
-			self.tickercsv = outdir + "/ticker_" + self.exch + ".csv"
-		else:
-			self.tickercsv = ""
+			basename = outdir + "/ticker_" + self.exch
+			if product is not None:
+				basename = basename + "_" + product.lower()
+			if "csv" in output:
+				self.tickercsv = basename + ".csv"
+			if "binary" in output:
+				self.tickerbin = basename + ".bin"
 		self.logger.info("CSV file=%s" % self.tickercsv)
+		self.logger.info("binary file=%s" % self.tickerbin)
+
+		# binary tick store (opened in pollticker)
+		self.tickstore = None
 
-		# initiailze ticker
-		self.tickers = []
-		self.readCSVticker()
+		# background CSV writer (started in pollticker)
+		self.csvwriter = None
+		self.flush_rows = flush_rows
+		self.flush_interval = flush_interval
 
 		# initialize technical parameters
-		self.sma30s = []
-		self.sma60s = []
-		self.wma30s = []
-		self.wma60s = []
+		if windows is None or len(windows) == 0:
+			windows = [30, 60]
+		self.xma = indicator.movingaverage(windows, self.MAXSMA, self.MAXWMA)
+		self.logger.info("SMA/WMA windows=%s" % str(self.xma.windows))
+
+		# initiailze ticker (SMA/WMA are rebuilt from CSV or binary, too)
+		self.tickers = ringbuffer.tickerbuffer(self.MAXTICKER)
+		if len(self.tickercsv) > 0:
+			self.readCSVticker()
+		else:
+			self.readBINticker()
 
 		# request/response queue for multiprocessing
 		self.reqq = reqq
-		self.rspq = rspq
+		if isinstance(rspq, dict):	# reply queue per client
+			self.rspq = None
+			self.rspqs = rspq
+		else:
+			self.rspq = rspq
+			self.rspqs = {}
 		self.q_get_tov = q_get_tov
 
+		# request server thread (started in pollticker)
+		# lock protects tickers and SMA/WMA from being read while updated
+		self.REQ_POLL_TOV = 0.5
+		self.reqthread = None
+		self.reqstop = threading.Event()
+		self.lock = threading.Lock()
+
+		# shared memory snapshot of the latest ticker
+		self.snapshot = snapshot
+
+		# subscribers to which every ticker is pushed
+		self.publisher = pubsub.publisher(subscriptions)
+
+		# ticker feed is stale while circuit breaker of the exchange is open
+		self.stale = False
+
+		# per-stage latency of tickers (stamps of the latest ticker are
+		# attached to "get ticker" response)
+		self.latency = latency.tracker("polling(%s)" % self.exch, self.logger)
+		self.laststamps = None
+
+		# price triggers registered by clients, evaluated on every ticker
+		# client ID : {"product", "index" (trigger.triggerindex), "items"}
+		self.triggers = {}
+
+		# format of ticker CSV line of each product (see ticker2str())
+		self.tickerfmt = {}
+
 		# set stop flag
 		self.stop_flag = stop_flag
 
@@ -110,52 +186,68 @@ class polling:
 		 - best_bid  : the highest bid price at the current time
 		 - best_ask  : the lowst ask price at the current time
 		 - last      : last price
+
+		return None if ticker could not be fetched.
 		"""
 
 		currdate = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-		ticker = {}
-		if self.cc is not None:	# coincheck
-			tickercc = self.cc.ticker()
-			if tickercc is not None:
-				ticker["product"] = product
-				ticker["datetime"] = currdate
-				ticker["timestamp"] = tickercc["timestamp"]
-				ticker["best_bid"] = tickercc["bid"]
-				ticker["best_ask"] = tickercc["ask"]
-				ticker["last"] = tickercc["last"]
-		elif self.bf is not None:	# bitflyer
+		sttime = time.monotonic()
+		try:
+			ticker = self.api.ticker(product)
+		except exchange.circuitopen:
+			# no call is issued until the breaker probes for recovery
+			return None
+		except exchange.exchangeerror as e:
+			self.logger.warning("could not get ticker: %s" % str(e))
+			if self.api.breaker.isopen():
+				self.setstale(True, str(e))
+			return None
+
+		if ticker is not None:
+			ticker["datetime"] = currdate
+			stamps = latency.stamp(ticker, "fetch_end")
+			stamps["fetch_st"] = sttime
+			# exchange timestamp on monotonic clock
 			try:
-				tickerbf = self.bf.ticker(product_code=product.upper())
-				if tickerbf is not None:
-					ticker["product"] = product
-					ticker["datetime"] = currdate
-					ticker["timestamp"] = tickerbf["timestamp"]
-					ticker["best_bid"] = float(tickerbf["best_bid"])
-					ticker["best_ask"] = float(tickerbf["best_ask"])
-					ticker["last"] = float(tickerbf["ltp"])
-			except:
+				stamps["exchange"] = stamps["fetch_end"] - (time.time() - ringbuffer.str2epoch(ticker["timestamp"]))
+			except (ValueError, TypeError, KeyError):
 				pass
+		return ticker
+
+
+	def setstale(self, stale, reason=""):
+		""" notify strategies that the ticker feed became stale or recovered
+		 - stale  : True if the ticker feed is stale
+		 - reason : reason of the stale feed
+		"""
+		if stale == self.stale:
+			return
+		self.stale = stale
+		if stale:
+			self.logger.warning("ticker feed of %s is stale: %s" % (self.exch, reason))
 		else:
-			pass
+			self.logger.info("ticker feed of %s recovered" % self.exch)
 
-		return ticker
+		if self.snapshot is not None:
+			self.snapshot.setstale(stale)
+		if len(self.publisher) > 0:
+			self.publisher.publish({"event"   : "stale",
+			                        "stale"   : stale,
+			                        "product" : self.product,
+			                        "reason"  : reason})
 
 
-	def append(self, listp, val, maxelm=0):
-		""" append value to the list and purge LRU entry """
+	def append(self, listp, val):
+		""" append value to the ring buffer and purge LRU entry
+		 - listp : ring buffer (capacity limits the number of entries)
+		 - val   : value to be appended
+		"""
 		listp.append(val)
-		
-		# purge old entries
-		if maxelm > 0:
-			entnum = len(listp) - maxelm
-			if entnum > 0:	# element count exceeds limit
-				for count in range(entnum):
-					del listp[0]
 
 
 	def appendticker(self, ticker):
-		""" append ticker to the list """
-		self.append(self.tickers, ticker, self.MAXTICKER)
+		""" append ticker to the ring buffer """
+		self.append(self.tickers, ticker)
 
 
 	def getticker(self, idx=-1):
@@ -166,47 +258,189 @@ class polling:
 
 
 	def readCSVticker(self):
-		""" read ticker data from CSV """
+		""" read the latest tickers from CSV (warm start)
+
+		only the last MAXTICKER rows are parsed by reading the CSV file
+		backward from the end, so that the start-up time does not depend on
+		the file size. SMA/WMA are rebuilt from the loaded tickers.
+		"""
 		if len(self.tickercsv) <= 0:
 			return
 
 		if not os.path.exists(self.tickercsv):
 			return
 
-		df = pd.read_csv(self.tickercsv)
-		if df is None:
-			self.logger.error("could not read CSV file")
+		try:
+			lines = self.tailCSV(self.tickercsv, self.MAXTICKER)
+		except OSError as e:
+			self.logger.error("could not read CSV file: %s" % str(e))
 			return
 
-		nrow = len(df)
-		if nrow >= self.MAXTICKER:
-			strow = nrow - self.MAXTICKER
-			edrow = nrow - 1
-		else:
-			strow = 0
-			edrow = nrow - 1
+		# format: datetime,product,last,best_bid,best_ask,timestamp
+		cols = [[], [], [], [], [], []]
+		nskip = 0
+		for line in lines:
+			ent = line.split(",")
+			if len(ent) != 6 or ent[0] == "datetime":
+				nskip += 1
+				continue
+			for idx in range(6):
+				cols[idx].append(ent[idx])
+		if nskip > 0:
+			self.logger.warning("%d invalid rows are skipped in CSV file" % nskip)
+		if len(cols[0]) == 0:
+			return
+
+		try:
+			tickers = {"datetime"  : ringbuffer.strs2epoch(cols[0], localtime=True),
+			           "last"      : np.array(cols[2], dtype=np.float64),
+			           "best_bid"  : np.array(cols[3], dtype=np.float64),
+			           "best_ask"  : np.array(cols[4], dtype=np.float64),
+			           "timestamp" : ringbuffer.strs2epoch(cols[5])}
+		except ValueError as e:
+			self.logger.error("could not parse CSV file: %s" % str(e))
+			return
 
-		for idx in range(strow, edrow):
-			rdent = df.iloc[idx]
-			self.tickers.append(rdent)
+		self.tickers.product = cols[1][-1]
+		self.tickers.extend(tickers)
+		self.xma.rebuild(self.tickers.column("last"))
+		self.logger.info("%d tickers are loaded from CSV file" % len(self.tickers))
 
-		del df
+
+	def readBINticker(self):
+		""" read the latest tickers from binary tick store (warm start)
+
+		since the tick store does not have local fetch time, the exchange
+		timestamp is used as "datetime" of the loaded tickers.
+		"""
+		if len(self.tickerbin) <= 0:
+			return
+
+		if not os.path.exists(self.tickerbin):
+			return
+
+		try:
+			store = tickstore.tickstore(self.tickerbin)
+		except (OSError, ValueError) as e:
+			self.logger.error("could not read binary file: %s" % str(e))
+			return
+
+		recs = store.records(self.MAXTICKER)
+		if len(recs) > 0:
+			self.tickers.extend({"last"      : recs["last"],
+			                     "best_bid"  : recs["best_bid"],
+			                     "best_ask"  : recs["best_ask"],
+			                     "timestamp" : recs["timestamp"],
+			                     "datetime"  : recs["timestamp"]})
+			self.xma.rebuild(self.tickers.column("last"))
+		del recs
+		store.close()
+		self.logger.info("%d tickers are loaded from binary file" % len(self.tickers))
+
+
+	def tailCSV(self, path, nrow, blksize=1024 * 1024):
+		""" read the last lines of the file
+		 - path    : path to file
+		 - nrow    : number of lines
+		 - blksize : size of a block read at once [byte]
+
+		return list of lines (without line feed) in file order.
+		"""
+		with open(path, "rb") as fp:
+			fp.seek(0, os.SEEK_END)
+			pos = fp.tell()
+			data = b""
+			# one extra line is needed because the first line may be partial
+			while pos > 0 and data.count(b"\n") <= nrow:
+				rdsize = min(blksize, pos)
+				pos -= rdsize
+				fp.seek(pos)
+				data = fp.read(rdsize) + data
+
+		lines = data.decode("utf-8", errors="replace").splitlines()
+		if pos > 0:
+			lines = lines[1:]	# drop partial line
+		return lines[-nrow:]
+
+
+	def openCSVticker(self):
+		""" start background CSV writer (CSV output is disabled if the file
+		    could not be opened)
+		"""
+		if len(self.tickercsv) > 0 and self.csvwriter is None:
+			writer = csvwriter.csvwriter(self.tickercsv, self.CSVHEADER,
+			                             self.flush_rows, self.flush_interval,
+			                             self.logger)
+			try:
+				writer.start()
+			except OSError as e:
+				self.logger.error("could not open CSV file, CSV output is disabled: %s" % str(e))
+				self.tickercsv = ""
+				return
+			self.csvwriter = writer
+
+
+	def closeCSVticker(self):
+		""" write all pending tickers and stop background CSV writer """
+		if self.csvwriter is not None:
+			self.csvwriter.close()
+			self.csvwriter = None
 
 
 	def writeCSVticker(self, ticker):
-		""" write ticker data to CSV """
+		""" write ticker data to CSV
+
+		the ticker is queued to the background writer if it is running,
+		otherwise written synchronously.
+		"""
 		if len(self.tickercsv) > 0:
-			if not os.path.exists(self.tickercsv):
-				fp = open(self.tickercsv, "w")
-				fp.write("datetime,product,last,best_bid,best_ask,timestamp\n")
-    
+			if self.csvwriter is not None:
+				self.csvwriter.put(self.ticker2str(ticker))
+				return
+
 			with open(self.tickercsv, "a") as fp:
+				if fp.tell() == 0:
+					fp.write(self.CSVHEADER + '\n')
 				fp.write(self.ticker2str(ticker) + '\n')
 
 
+	def openBINticker(self):
+		""" open binary tick store to write """
+		if len(self.tickerbin) > 0 and self.tickstore is None:
+			try:
+				self.tickstore = tickstore.tickstore(self.tickerbin, readonly=False)
+			except (OSError, ValueError) as e:
+				self.logger.error("could not open binary file: %s" % str(e))
+
+
+	def closeBINticker(self):
+		""" close binary tick store """
+		if self.tickstore is not None:
+			self.tickstore.close()
+			self.tickstore = None
+
+
+	def writeBINticker(self, ticker):
+		""" write ticker data to binary tick store """
+		if self.tickstore is not None:
+			self.tickstore.append(ticker)
+
+
 	def ticker2str(self, ticker):
-		""" convert ticker object to string """
-		line = "%(datetime)s,%(product)s,%(last).1f,%(best_bid).1f,%(best_ask).1f,%(timestamp)s" % ticker
+		""" convert ticker object to string
+
+		prices are written with decimals of the quote currency of the
+		product (PRICE_DECIMALS), so that prices quoted in crypto currency
+		(e.g. ETH_BTC around 0.05) are not rounded off.
+		"""
+		fmt = self.tickerfmt.get(ticker["product"])
+		if fmt is None:
+			quote = ticker["product"].upper().rsplit("_", 1)[-1]
+			decimals = self.PRICE_DECIMALS.get(quote, self.DEFAULT_DECIMALS)
+			fmt = "%%(datetime)s,%%(product)s,%%(last).%df,%%(best_bid).%df,%%(best_ask).%df,%%(timestamp)s" % \
+			      (decimals, decimals, decimals)
+			self.tickerfmt[ticker["product"]] = fmt
+		line = fmt % ticker
 		return line
 
 
@@ -218,27 +452,11 @@ class polling:
 		if len(self.tickers) < count:
 			return 0
 
-		sma = 0
-		for idx in range(-1, -1 - count, -1):
-			ticker = self.tickers[idx]
-			sma = sma + ticker["last"]
-		sma = sma / count
+		sma = float(self.tickers.column("last", count).sum()) / count
 
 		return sma
 
 
-	def sma30(self):
-		""" calculate SMA with 30 entries """
-		sma = self.sma(30)
-		self.append(self.sma30s, sma, self.MAXSMA)
-
-
-	def sma60(self):
-		""" calculate SMA with 60 entries """
-		sma = self.sma(60)
-		self.append(self.sma60s, sma, self.MAXSMA)
-
-
 	def wma(self, count):
 		""" calculate weighted Moving Average
 		 - count  : number of elements for calcucation
@@ -247,95 +465,317 @@ class polling:
 		if len(self.tickers) < count:
 			return 0
 
-		wma = 0
-		w = count
-		sumweight = 0
-		for idx in range(-1, -1 - count, -1):
-			ticker = self.tickers[idx]
-			wma = wma + ticker["last"] * w
-			sumweight = sumweight + w
-			w = w - 1
-		wma = wma / sumweight
+		# the latest entry has the heaviest weight (= count)
+		lasts = self.tickers.column("last", count)
+		weights = np.arange(1, count + 1, dtype=np.float64)
+		wma = float(np.dot(lasts, weights)) / weights.sum()
 
 		return wma
 
 
-	def wma30(self):
-		""" calculate WMA using 30 elements """
-		wma = self.wma(30)
-		self.append(self.wma30s, wma, self.MAXWMA)
-
-
-	def wma60(self):
-		""" calculate WMA using 60 elements """
-		wma = self.wma(60)
-		self.append(self.wma60s, wma, self.MAXWMA)
+	def updatexma(self, ticker):
+		""" update all SMA/WMA with the latest ticker """
+		self.xma.update(ticker["last"])
 
 
 	def getxma(self, kind="sma30", idx=-1):
 		""" get xMA (SMA or WMA)
-		 - kind : xMA kind ("SMA30", "SMA60", "WMA30" or "WMA60")
+		 - kind : xMA kind ("SMA<n>" or "WMA<n>", e.g. "SMA30", "WMA300")
+		          n must be one of the configured windows
 		 - idx : index of ticker history, -1 indicates last entry
 		"""
-		kind = kind.upper()
-		if kind == "SMA30":
-			return self.sma30s[idx]
-		elif kind == "SMA60":
-			return self.sma60s[idx]
-		elif kind == "WMA30":
-			return self.wma30s[idx]
-		elif kind == "WMA60":
-			return self.wma60s[idx]
+		return self.xma.get(kind, idx)
+
+
+	def publishticker(self, ticker):
+		""" publish the latest ticker and SMA/WMA to shared memory and
+		    push them to all subscribers
+		"""
+		xmas = self.xma.latest()
+		stamps = latency.stamp(ticker, "publish")
+		if self.snapshot is not None:
+			self.snapshot.publishticker(ticker, xmas)
+
+		if len(self.publisher) > 0:
+			# same format as "get ticker" response
+			msg = dict(ticker)
+			msg.update(xmas)
+			msg["stamps"] = dict(stamps)
+			if self.publisher.publish(msg) > 0:
+				self.logger.debug("ticker is dropped by slow subscriber")
+
+
+	def serveRequest(self, d):
+		""" process a request and reply to the client
+		 - d : request object
+		       - cmd    : command ("get ticker", "get stats", "set triggers",
+		                  "add triggers", "remove triggers" or
+		                  "clear triggers")
+		       - id     : request ID, copied to the response
+		       - client : client ID to select reply queue, the default
+		                  queue is used if not specified
+		       - product: product code (optional), must be the same as
+		                  the product polled by this object
+		"""
+		rsp = None
+		if "product" in d and self.product is not None and d["product"].upper() != self.product.upper():
+			rsp = {"error" : "unknown product"}
+		elif d["cmd"] in ("set triggers", "clear triggers"):
+			# triggers are registered without reply
+			self.settriggers(d.get("client"), d.get("product", self.product),
+			                 d.get("triggers", []) if d["cmd"] == "set triggers" else [])
+			return
+		elif d["cmd"] in ("add triggers", "remove triggers"):
+			self.updatetriggers(d.get("client"), d.get("product", self.product),
+			                    d.get("triggers", []), d["cmd"] == "add triggers")
+			return
+		elif d["cmd"] == "get stats":
+			# process "get stats" command
+			rsp = self.getstats()
+		elif d["cmd"] == "get ticker":
+			# process "get ticker" command
+			# SMA/WMA are set as "sma<n>" and "wma<n>" (e.g. "sma30")
+			with self.lock:
+				if len(self.tickers) > 0:
+					rsp = self.getticker()
+					rsp.update(self.xma.latest())
+					rsp["stale"] = self.stale
+					if self.laststamps is not None:
+						rsp["stamps"] = dict(self.laststamps)
+			if rsp is None:
+				rsp = {"error" : "no ticker"}
 		else:
-			return 0
+			self.logger.warning("unknown command '%s'" % d["cmd"])
+			rsp = {"error" : "unknown command"}
+
+		if "id" in d:
+			rsp["id"] = d["id"]
+
+		# select reply queue
+		client = d.get("client")
+		if client is None:
+			rspq = self.rspq
+		elif client in self.rspqs:
+			rspq = self.rspqs[client]
+		else:
+			self.logger.warning("unknown client '%s'" % client)
+			return
+		if rspq is not None:
+			rspq.put(rsp)
+
+
+	def settriggers(self, client, product, items):
+		""" register price triggers of the client (replacing the previous ones)
+		 - client  : client ID, trigger events are pushed to the
+		             subscription of the same name
+		 - product : product code
+		 - items   : list of triggers
+		             - id        : ID of trigger (e.g. lot ID)
+		             - direction : "up" (fires when price rises above the
+		                           level) or "down" (falls below the level)
+		             - level     : trigger price
+		"""
+		if client is None:
+			self.logger.warning("triggers without client ID are ignored")
+			return
+		if len(items) == 0:
+			with self.lock:
+				self.triggers.pop(client, None)
+			self.logger.debug("triggers of %s are cleared" % client)
+			return
+
+		ups = [idx for idx, item in enumerate(items) if item["direction"] == "up"]
+		downs = [idx for idx, item in enumerate(items) if item["direction"] == "down"]
+		index = trigger.triggerindex()
+		index.build([float(items[idx]["level"]) for idx in ups],
+		            [float(items[idx]["level"]) for idx in downs],
+		            ups, downs)
+		with self.lock:
+			# triggers already crossed by the latest price fire on the next ticker
+			# (items and keys are looked up by index key and by (ID, direction))
+			self.triggers[client] = {"product" : product,
+			                         "index"   : index,
+			                         "items"   : dict(enumerate(items)),
+			                         "keys"    : {(item["id"], item["direction"]) : idx
+			                                      for idx, item in enumerate(items)},
+			                         "next"    : len(items)}
+		self.logger.debug("%d triggers of %s are registered" % (len(items), client))
+
+
+	def updatetriggers(self, client, product, items, add):
+		""" add or remove price triggers of the client without rebuilding
+		    the index
+		 - client  : client ID
+		 - product : product code
+		 - items   : list of triggers (see settriggers())
+		 - add     : True to add triggers, False to remove triggers
+		"""
+		if client is None:
+			self.logger.warning("triggers without client ID are ignored")
+			return
+		with self.lock:
+			ent = self.triggers.get(client)
+			if ent is None:
+				if not add:
+					return
+				ent = self.triggers[client] = {"product" : product,
+				                               "index"   : trigger.triggerindex(),
+				                               "items"   : {},
+				                               "keys"    : {},
+				                               "next"    : 0}
+			index = ent["index"]
+			for item in items:
+				level = float(item["level"])
+				ident = (item["id"], item["direction"])
+				if add:
+					# a trigger added beyond the latest price fires on the next ticker
+					key = ent["next"]
+					ent["next"] += 1
+					ent["items"][key] = item
+					ent["keys"][ident] = key
+				else:
+					key = ent["keys"].pop(ident, None)
+					if key is None:
+						continue
+					level = float(ent["items"].pop(key)["level"])
+				upper, lower = (level, None) if item["direction"] == "up" else (None, level)
+				if add:
+					index.add(key, upper, lower)
+				else:
+					index.remove(key, upper, lower)
+		self.logger.debug("%d triggers of %s are %s" % (len(items), client, "added" if add else "removed"))
+
+
+	def checktriggers(self, ticker):
+		""" evaluate registered triggers against the ticker and push fired
+		    triggers to the clients
+		 - ticker : ticker object
+		"""
+		if len(self.triggers) == 0:
+			return
+		last = float(ticker["last"])
+		for client, ent in self.triggers.items():
+			if ent["product"] is not None and ticker.get("product", ent["product"]).upper() != ent["product"].upper():
+				continue
+			ups, downs = ent["index"].crossed(last)
+			if len(ups) == 0 and len(downs) == 0:
+				continue
+
+			fired = [ent["items"][idx] for idx in ups] + [ent["items"][idx] for idx in downs]
+			self.logger.info("%d triggers of %s fired at %.1f" % (len(fired), client, last))
+			self.publisher.publishto(client, {"event"    : "trigger",
+			                                  "product"  : ent["product"],
+			                                  "last"     : last,
+			                                  "triggers" : fired,
+			                                  "stamps"   : dict(ticker["stamps"])})
+
+
+	def getstats(self):
+		""" get statistics of polling
+		 - hedge     : counters of hedged ticker requests (None if disabled)
+		 - latency   : latency percentiles of each stage [msec]
+		 - ratelimit : tokens and counters of rate limit budgets shared by
+		               processes (None if disabled)
+		"""
+		stats = {"hedge" : None, "latency" : self.latency.stats(), "ratelimit" : None}
+		if exchange.limiter is not None:
+			stats["ratelimit"] = exchange.limiter.stats()
+		if self.api.hedger is not None:
+			stats["hedge"] = self.api.hedger.stats()
+		return stats
 
 
 	def checkRequestQueue(self):
-		""" check request queue """
+		""" check request queue (non-blocking) """
 		while True:
 			if self.reqq.empty():
 				return
-  
+
 			d = self.reqq.get()
-			if d["cmd"] == "get ticker":
-				# process "get ticker" command
-				ticker = self.getticker()
-				sma30 = self.getxma("SMA30")
-				sma60 = self.getxma("SMA60")
-				wma30 = self.getxma("WMA30")
-				wma60 = self.getxma("WMA60")
-				ticker["sma30"] = sma30
-				ticker["sma60"] = sma60
-				ticker["wma30"] = wma30
-				ticker["wma60"] = wma60
-				self.rspq.put(ticker)
+			self.serveRequest(d)
+
+
+	def runRequestServer(self):
+		""" serve requests as soon as they arrive (request server thread) """
+		while not self.stop_flag.is_set() and not self.reqstop.is_set():
+			try:
+				d = self.reqq.get(timeout=self.REQ_POLL_TOV)
+			except queue.Empty:
+				continue
+
+			try:
+				self.serveRequest(d)
+			except Exception as e:
+				self.logger.error("could not serve request %s: %s" % (str(d), str(e)))
+
+
+	def startRequestServer(self):
+		""" start request server thread """
+		if self.reqq is None or self.reqthread is not None:
+			return
+		self.reqstop.clear()
+		self.reqthread = threading.Thread(target=self.runRequestServer, name="reqserver", daemon=True)
+		self.reqthread.start()
+
+
+	def stopRequestServer(self):
+		""" stop request server thread """
+		if self.reqthread is not None:
+			self.reqstop.set()
+			self.reqthread.join(self.REQ_POLL_TOV * 2)
+			self.reqthread = None
+
+
+	def checkProduct(self, product):
+		""" check whether the product is supported by the exchange
+		 - product : product code
+		"""
+		if not self.api.isproduct(product):
+			self.logger.critical("ERROR: %s is not supported by %s" % (product, self.exch))
+			return False
+		return True
+
+
+	def processticker(self, ticker):
+		""" store, record and publish fetched ticker
+		 - ticker : ticker object returned by ticker()
+		"""
+		with self.lock:
+			self.appendticker(ticker)
+			latency.stamp(ticker, "append")
+			self.checktriggers(ticker)
+			self.updatexma(ticker)
+			latency.stamp(ticker, "xma")
+		self.writeCSVticker(ticker)
+		self.writeBINticker(ticker)
+		latency.stamp(ticker, "write")
+		self.setstale(False)
+		self.publishticker(ticker)
+		self.laststamps = ticker["stamps"]
+		self.latency.record(self.laststamps)
+
+		# debug
+		if self.logger.isEnabledFor(logging.DEBUG):
+			xmas = ",".join(["%s=%.1f" % (k.upper(), v) for k, v in self.xma.latest().items()])
+			self.logger.debug("%s,%s" % (self.ticker2str(ticker), xmas))
 
 
 	def pollticker(self, product, interval=1, count=-1):
-		""" polling ticker """
+		""" polling ticker
+		 - product  : product code
+		 - interval : polling interval [sec], fraction is allowed
+		 - count    : polling count (-1 indicates infinite loop)
+		"""
 
 		# product code check
-		tmpprod = product.lower()
-		if self.cc is not None:	# coincheck
-			if tmpprod == "btc_jpy":
-				pass
-			else:
-				self.logger.critical("ERROR: %s is not supported by coincheck" % product)
-				return
-		elif self.bf is not None:	# bitflyer
-			if tmpprod == "btc_jpy":
-				pass
-			elif tmpprod == "eth_btc":
-				pass
-			elif tmpprod == "fx_btc_jpy":
-				pass
-			else:
-				self.logger.critical("ERROR: %s is not supported by bitflyer" % product)
-				return
+		if not self.checkProduct(product):
+			return
+		self.product = product
+		self.latency.name = "polling(%s,%s)" % (self.exch, product)
     
 		# fetch interval
 		if interval <= 0:
-			self.logger.critical("ERROR: interval is NOT natural number")
+			self.logger.critical("ERROR: interval is NOT positive number")
 			return
     
 		# initialize loop count
@@ -346,42 +786,43 @@ class polling:
 		signal.signal(signal.SIGTERM, signal.SIG_IGN)
 
 		# polling
-		while True:
-			try:
-				# terminate if stop flag is set
-				if self.stop_flag.is_set():
-					self.logger.debug("terminate signal received, bye")
-					break
-
-				if count == -1:		# infinite loop is specified
-					lpcnt = 1;
-				# terminate if stop flag is set
-				if self.stop_flag.is_set():
-					break
+		self.openCSVticker()
+		self.openBINticker()
+		self.startRequestServer()
+		sched = scheduler.scheduler(interval, self.stop_flag, self.logger)
+		try:
+			while True:
+				try:
+					# terminate if stop flag is set
+					if self.stop_flag.is_set():
+						self.logger.debug("terminate signal received, bye")
+						break
+
+					if count == -1:		# infinite loop is specified
+						lpcnt = 1;
+					# terminate if stop flag is set
+					if self.stop_flag.is_set():
+						break
+    
+					if lpcnt > 0:
+						ticker = self.ticker(product)
+						if ticker is not None:
+							self.processticker(ticker)
+						else:
+							self.logger.debug("could not get ticker")
     
-				if lpcnt > 0:
-					ticker = self.ticker(product)
-					if ticker is not None:
-						self.appendticker(ticker)
-						self.writeCSVticker(ticker)
-						self.sma30()
-						self.sma60()
-						self.wma30()
-						self.wma60()
-
-						# debug
-						self.logger.debug("%s,SMA30=%.1f,SMA60=%.1f,WMA30=%.1f,WMA60=%.1f" % (self.ticker2str(ticker), self.sma30s[-1], self.sma60s[-1], self.wma30s[-1], self.wma60s[-1]))
+						lpcnt -= 1
+						sched.wait()
 					else:
-						self.logger.warning("could not get ticker")
-
-					# check request queue
-					self.checkRequestQueue()
+						break
     
-					lpcnt -= 1
-					time.sleep(interval)
-				else:
+				except KeyboardInterrupt:
 					break
-    
-			except KeyboardInterrupt:
-				break
 			
+		finally:
+			self.stopRequestServer()
+			self.closeCSVticker()
+			self.closeBINticker()
+			if self.api.hedger is not None:
+				self.logger.info("hedged ticker requests: %s" % str(self.api.hedger.stats()))
+			self.latency.log()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import queue
+from multiprocessing import Queue, Value
+
+
+class subscription:
+	"""
+	bounded tick queue from polling module to a subscriber process.
+
+	the publisher never blocks. when the queue is full, the overflow policy
+	decides which message is lost:
+	 - "drop_oldest" : the oldest queued message is discarded
+	 - "conflate"    : only the latest message is kept (queue size is 1)
+
+	event messages (which have "event" key, e.g. stale feed, health and
+	price trigger) are never lost: they are passed through an unbounded
+	event queue, and each tick carries the number of events published
+	before it, so that the subscriber receives the events ahead of the
+	tick even though the two queues are flushed independently. events may
+	be published by several processes (counter is in shared memory).
+	"""
+
+	DROP_OLDEST = "drop_oldest"
+	CONFLATE = "conflate"
+	POLICIES = [DROP_OLDEST, CONFLATE]
+
+	# maximum time to wait for an event which is published before a tick
+	EVENT_TOV = 1.0
+
+	def __init__(self, name, maxsize=64, policy="drop_oldest"):
+		""" constructor
+		 - name    : subscriber name (e.g. "scalping")
+		 - maxsize : maximum number of queued messages
+		 - policy  : overflow policy, "drop_oldest" or "conflate"
+		"""
+		policy = policy.lower()
+		if policy not in self.POLICIES:
+			raise ValueError("invalid overflow policy '%s'" % policy)
+		if policy == self.CONFLATE:
+			maxsize = 1
+		if maxsize <= 0:
+			raise ValueError("queue size must be natural number")
+
+		self.name = name
+		self.policy = policy
+		self.maxsize = maxsize
+		self.q = Queue(maxsize)
+
+		# lossless event queue and number of published events
+		self.eq = Queue()
+		self.nevent = Value("Q", 0)
+
+		# statistics (publisher side)
+		self.npub = 0
+		self.ndrop = 0
+
+		# subscriber side: number of received events and tick waiting for
+		# the events published before it
+		self.nrecv = 0
+		self.pending = None
+
+
+	def publish(self, msg):
+		""" put message without blocking (publisher side)
+		 - msg : message
+
+		return False if a message is dropped.
+		"""
+		self.npub += 1
+		if "event" in msg:
+			with self.nevent.get_lock():
+				self.eq.put(msg)
+				self.nevent.value += 1
+			return True
+
+		# tick is queued with the number of events published before it
+		ent = (self.nevent.value, msg)
+		try:
+			self.q.put_nowait(ent)
+			return True
+		except queue.Full:
+			pass
+
+		# discard the oldest (or the previous for conflation) message
+		self.ndrop += 1
+		try:
+			self.q.get_nowait()
+		except queue.Empty:
+			pass
+		try:
+			self.q.put_nowait(ent)
+		except queue.Full:
+			# the subscriber has not consumed yet, lose the new message
+			pass
+		return False
+
+
+	def getevent(self, timeout=None):
+		""" get the next event (subscriber side)
+		 - timeout : timeout [sec], None indicates non-blocking
+
+		return None if no event is queued.
+		"""
+		try:
+			if timeout is None:
+				msg = self.eq.get_nowait()
+			else:
+				msg = self.eq.get(timeout=timeout)
+		except queue.Empty:
+			return None
+		self.nrecv += 1
+		return msg
+
+
+	def get(self, timeout=None):
+		""" get the next message (subscriber side)
+		 - timeout : timeout [sec], None indicates blocking
+
+		events published before a tick are returned ahead of the tick.
+		return None if timed out.
+		"""
+		msg = self.getevent()
+		if msg is not None:
+			return msg
+
+		if self.pending is None:
+			try:
+				self.pending = self.q.get(timeout=timeout)
+			except queue.Empty:
+				return None
+
+		# events published before the tick are still in flight
+		nevent, tick = self.pending
+		if nevent > self.nrecv:
+			msg = self.getevent(self.EVENT_TOV)
+			if msg is not None:
+				return msg
+			self.nrecv = nevent	# lost (publisher died while publishing)
+		self.pending = None
+		return tick
+
+
+	def getlatest(self, timeout=None):
+		""" wait for a message and return the latest one (subscriber side)
+		 - timeout : timeout [sec], None indicates blocking
+
+		older ticks which have been queued are skipped, but events are
+		returned in order.
+		return None if timed out.
+		"""
+		msg = self.get(timeout)
+		while msg is not None and "event" not in msg:
+			try:
+				self.pending = self.q.get_nowait()
+			except queue.Empty:
+				return msg
+			msg = self.get(0)
+		return msg
+
+
+class publisher:
+	""" publish message to all subscribers """
+
+	def __init__(self, subscriptions=None):
+		""" constructor
+		 - subscriptions : list of subscription objects
+		"""
+		self.subscriptions = []
+		if subscriptions is not None:
+			for sub in subscriptions:
+				self.subscribe(sub)
+
+
+	def subscribe(self, sub):
+		""" register subscriber
+		 - sub : subscription object
+		"""
+		self.subscriptions.append(sub)
+
+
+	def publish(self, msg):
+		""" publish message to all subscribers
+		 - msg : message
+
+		return number of subscribers which dropped a message.
+		"""
+		ndrop = 0
+		for sub in self.subscriptions:
+			if not sub.publish(msg):
+				ndrop += 1
+		return ndrop
+
+
+	def publishto(self, name, msg):
+		""" publish message to the subscriber of the name
+		 - name : subscriber name
+		 - msg  : message
+
+		return False if no subscriber has the name or a message is dropped.
+		"""
+		for sub in self.subscriptions:
+			if sub.name == name:
+				return sub.publish(msg)
+		return False
+
+
+	def __len__(self):
+		return len(self.subscriptions)
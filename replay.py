@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import heapq
+import argparse
+import configparser
+import numpy as np
+
+import exchange
+import indicator
+import ringbuffer
+import scalping
+import sell
+import tickstore
+
+
+class simexchange(exchange.exchange):
+	"""
+	simulated exchange for replay.
+
+	orders are matched against the replayed tickers on the virtual clock
+	(time of the current ticker):
+	 - market order is filled at best_ask (buy) or best_bid (sell)
+	 - limit order is filled at best_ask/best_bid if marketable, otherwise
+	   it rests until best_ask <= price (buy) or best_bid >= price (sell),
+	   and is filled at its price
+	 - sell order is rejected if it exceeds the bought lots (no short)
+
+	fills are reported as executions (spot, paged by ID as exchange API),
+	and bought lots which are not sold yet are reported as positions
+	(margin). lots are closed in FIFO order.
+	"""
+
+	NAME = "replay"
+
+	def __init__(self, product):
+		""" constructor
+		 - product : product code
+		"""
+		super().__init__()
+		self.product = product.upper()
+		self.PRODUCTS = [self.product]
+
+		# virtual clock and the current ticker
+		self.clock = 0.0
+		self.tick = None
+
+		# orders, resting limit orders (heap) and open lots
+		self.orders = []
+		self.buys = []		# (-price, order ID)
+		self.sells = []		# (price, order ID)
+		self.lots = []
+		self.possize = 0.0
+
+		# fills (execution ID = index + 1)
+		self.execs = []
+
+		# profit and loss
+		self.realized = 0.0
+
+
+	def settick(self, clock, ticker):
+		""" advance virtual clock and match resting limit orders
+		 - clock  : virtual time (epoch)
+		 - ticker : ticker at the time
+		"""
+		self.clock = clock
+		self.tick = ticker
+
+		best_ask = ticker["best_ask"]
+		while len(self.buys) > 0 and -self.buys[0][0] >= best_ask:
+			price, oid = heapq.heappop(self.buys)
+			self.match(self.orders[oid], -price)
+		best_bid = ticker["best_bid"]
+		while len(self.sells) > 0 and self.sells[0][0] <= best_bid:
+			price, oid = heapq.heappop(self.sells)
+			self.match(self.orders[oid], price)
+
+
+	def match(self, order, price):
+		""" fill order at the price unless expired
+		 - order : order object
+		 - price : execution price
+		"""
+		if order["status"] != "open":
+			return
+		if order["expire"] is not None and self.clock > order["expire"]:
+			order["status"] = "expired"
+			return
+
+		if order["side"] == "BUY":
+			self.lots.append({"id"             : order["id"],
+			                  "child_order_id" : order["id"],
+			                  "product_code"   : self.product,
+			                  "side"           : "BUY",
+			                  "price"          : price,
+			                  "size"           : order["size"],
+			                  "exec_date"      : self.clock})
+			self.possize += order["size"]
+		else:
+			remain = order["size"]
+			while remain > 1e-12 and len(self.lots) > 0:
+				lot = self.lots[0]
+				size = min(remain, lot["size"])
+				self.realized += (price - lot["price"]) * size
+				lot["size"] -= size
+				self.possize -= size
+				remain -= size
+				if lot["size"] <= 1e-12:
+					self.lots.pop(0)
+		order["status"] = "filled"
+		order["exec_price"] = price
+		order["exec_time"] = self.clock
+		self.execs.append({"id"             : len(self.execs) + 1,
+		                   "child_order_id" : order["id"],
+		                   "product_code"   : self.product,
+		                   "side"           : order["side"],
+		                   "price"          : price,
+		                   "size"           : order["size"],
+		                   "exec_date"      : self.clock})
+
+
+	def position(self):
+		""" get total size of open lots """
+		return self.possize
+
+
+	def fetchticker(self, product):
+		return self.tick
+
+
+	def executions(self, product, count=None, before=None, after=None):
+		# the latest first, id of execution is index + 1
+		end = len(self.execs)
+		if before is not None and before > 0:
+			end = min(end, before - 1)
+		start = 0
+		if after is not None and after > 0:
+			start = min(after, end)
+		if count is not None and count > 0:
+			start = max(start, end - count)
+		return self.execs[start:end][::-1]
+
+
+	def positions(self, product):
+		return self.lots
+
+
+	def sendorder(self, product, ordtype, side, size, price=None, expire=None):
+		ordtype = ordtype.upper()
+		side = side.upper()
+		order = {"id"         : len(self.orders),
+		         "time"       : self.clock,
+		         "type"       : ordtype,
+		         "side"       : side,
+		         "price"      : price,
+		         "size"       : size,
+		         "expire"     : None,
+		         "status"     : "open",
+		         "exec_price" : None,
+		         "exec_time"  : None}
+		if expire is not None and expire > 0:
+			order["expire"] = self.clock + expire * 60
+		self.orders.append(order)
+
+		if side == "SELL" and size > self.position() + 1e-12:
+			order["status"] = "rejected"
+			raise exchange.exchangeerror("insufficient position to sell %f" % size)
+
+		if ordtype == "MARKET":
+			if side == "BUY":
+				self.match(order, self.tick["best_ask"])
+			else:
+				self.match(order, self.tick["best_bid"])
+		elif side == "BUY":
+			if price >= self.tick["best_ask"]:
+				self.match(order, self.tick["best_ask"])
+			else:
+				heapq.heappush(self.buys, (-price, order["id"]))
+		else:
+			if price <= self.tick["best_bid"]:
+				self.match(order, self.tick["best_bid"])
+			else:
+				heapq.heappush(self.sells, (price, order["id"]))
+		return order["id"]
+
+
+	def close(self):
+		""" expire resting orders at the end of replay """
+		for order in self.orders:
+			if order["status"] == "open" and order["expire"] is not None and self.clock > order["expire"]:
+				order["status"] = "expired"
+
+
+class replayscalping(scalping.scalping):
+	""" scalping whose orders are sent to simulated exchange """
+
+	def entryLong(self, prod, price, size, expiredate):
+		try:
+			self.api.sendorder(prod, "LIMIT", "BUY", size, price, expiredate)
+			return True
+		except exchange.exchangeerror as e:
+			self.logger.debug(str(e))
+			return False
+
+
+class replaysell(sell.sell):
+	""" sell whose orders are sent to simulated exchange """
+
+	def placeOrder(self, prod, ordtype, side, size):
+		try:
+			self.api.sendorder(prod, ordtype, side, size)
+			return True
+		except exchange.exchangeerror as e:
+			self.logger.debug(str(e))
+			return False
+
+
+class replay:
+	"""
+	replay recorded tickers through the decision code of scalping and sell.
+
+	tickers are streamed as fast as possible on a virtual clock, in the
+	same format as pushed by polling module (with SMA/WMA), to
+	scalping.checkEntry() and sell.checkPosition(). orders are matched by
+	simulated exchange, and the orders and PnL are reported.
+	"""
+
+	ORDERHEADER = "time,id,type,side,price,size,status,exec_time,exec_price"
+
+	def __init__(self, exch, product, outdir="", loglv="WARNING", windows=None):
+		""" constructor
+		 - exch    : exchange name of the recorded tickers
+		 - product : product code
+		 - outdir  : log directory of strategies
+		 - loglv   : log level of strategies
+		 - windows : list of SMA/WMA window lengths (default: [30, 60])
+		"""
+		self.exch = exch.lower()
+		self.product = product.upper()
+		self.outdir = outdir
+		self.loglv = loglv
+		if windows is None or len(windows) == 0:
+			windows = [30, 60]
+		self.windows = windows
+
+		self.api = simexchange(self.product)
+		self.scalp = None
+		self.scalpparams = None
+		self.sell = None
+		self.sellparams = None
+
+		# statistics of the last run
+		self.nticks = 0
+		self.elapsed = 0.0
+
+
+	def setscalping(self, size, expiredate):
+		""" replay scalping
+		 - size       : amount of buy order
+		 - expiredate : expiration of buy order [minute]
+		"""
+		self.scalp = replayscalping(self.exch, "", "", self.outdir, self.loglv,
+		                            None, None, None, 0)
+		self.scalp.api = self.api
+		self.scalp.prod = self.product
+		self.scalpparams = (size, expiredate)
+
+
+	def setsell(self, size, profit_border, cut_border):
+		""" replay sell
+		 - size          : amount of sell order
+		 - profit_border : border line for profit
+		 - cut_border    : cut line for stop-loss
+		"""
+		self.sell = replaysell(self.exch, "", "", self.outdir, self.loglv,
+		                       None, None, None, 0)
+		self.sell.api = self.api
+		self.sell.prod = self.product
+		self.sellparams = (profit_border, cut_border, size)
+
+
+	def load(self, path):
+		""" load recorded tickers from CSV or binary tick store
+		 - path : ticker_<exchange>.csv or ticker_<exchange>.bin
+
+		return dict of columns.
+		"""
+		if path.endswith(".bin"):
+			store = tickstore.tickstore(path)
+			try:
+				recs = store.records()
+				tickers = {"time"      : recs["timestamp"].copy(),
+				           "datetime"  : [ringbuffer.epoch2str(val) for val in recs["timestamp"].tolist()],
+				           "timestamp" : [ringbuffer.epoch2str(val) for val in recs["timestamp"].tolist()],
+				           "last"      : recs["last"].copy(),
+				           "best_bid"  : recs["best_bid"].copy(),
+				           "best_ask"  : recs["best_ask"].copy()}
+			finally:
+				store.close()
+			return tickers
+
+		# format: datetime,product,last,best_bid,best_ask,timestamp
+		cols = [[], [], [], [], [], []]
+		with open(path, "r") as fp:
+			for line in fp:
+				ent = line.rstrip("\n").split(",")
+				if len(ent) != 6 or ent[0] == "datetime":
+					continue
+				for idx in range(6):
+					cols[idx].append(ent[idx])
+		return {"time"      : ringbuffer.strs2epoch(cols[0], localtime=True),
+		        "datetime"  : cols[0],
+		        "timestamp" : cols[5],
+		        "last"      : np.array(cols[2], dtype=np.float64),
+		        "best_bid"  : np.array(cols[3], dtype=np.float64),
+		        "best_ask"  : np.array(cols[4], dtype=np.float64)}
+
+
+	def run(self, tickers):
+		""" replay tickers
+		 - tickers : dict of columns returned by load()
+		"""
+		xma = indicator.movingaverage(self.windows, 1, 1)
+		times = tickers["time"].tolist()
+		lasts = tickers["last"].tolist()
+		bids = tickers["best_bid"].tolist()
+		asks = tickers["best_ask"].tolist()
+		datetimes = tickers["datetime"]
+		timestamps = tickers["timestamp"]
+
+		sttime = time.perf_counter()
+		for idx in range(len(times)):
+			ticker = {"product"   : self.product,
+			          "datetime"  : datetimes[idx],
+			          "timestamp" : timestamps[idx],
+			          "last"      : lasts[idx],
+			          "best_bid"  : bids[idx],
+			          "best_ask"  : asks[idx]}
+			xma.update(lasts[idx])
+			ticker.update(xma.latest())
+
+			self.api.settick(times[idx], ticker)
+			if self.scalp is not None:
+				self.scalp.checkEntry(self.product, ticker, *self.scalpparams)
+			if self.sell is not None:
+				self.sell.checkPosition(self.product, *self.sellparams, ticker)
+		self.api.close()
+
+		self.nticks = len(times)
+		self.elapsed = time.perf_counter() - sttime
+
+
+	def report(self):
+		""" get report of the last run """
+		orders = self.api.orders
+		count = {}
+		for order in orders:
+			key = "%s_%s" % (order["side"].lower(), order["status"])
+			count[key] = count.get(key, 0) + 1
+
+		position = self.api.position()
+		unrealized = 0.0
+		if self.api.tick is not None:
+			for lot in self.api.lots:
+				unrealized += (self.api.tick["best_bid"] - lot["price"]) * lot["size"]
+
+		return {"ticks"      : self.nticks,
+		        "elapsed"    : self.elapsed,
+		        "orders"     : len(orders),
+		        "count"      : count,
+		        "position"   : position,
+		        "realized"   : self.api.realized,
+		        "unrealized" : unrealized,
+		        "pnl"        : self.api.realized + unrealized}
+
+
+	def writeorders(self, path):
+		""" write orders to CSV
+		 - path : output file
+		"""
+		with open(path, "w") as fp:
+			fp.write(self.ORDERHEADER + "\n")
+			for order in self.api.orders:
+				ent = dict(order)
+				ent["time"] = ringbuffer.epoch2str(order["time"])
+				if order["exec_time"] is not None:
+					ent["exec_time"] = ringbuffer.epoch2str(order["exec_time"])
+				fp.write(",".join(["" if ent[col] is None else str(ent[col])
+				                   for col in self.ORDERHEADER.split(",")]) + "\n")
+
+
+################################################################################
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='replay recorded tickers through scalping and sell')
+	parser.add_argument('tickerfile', metavar='file',
+	                    type=str,
+	                    help='ticker_<exchange>.csv or ticker_<exchange>.bin')
+	parser.add_argument('--inifile', metavar='file', dest='inifile',
+	                    type=str, required=False, default='./vcts.ini',
+	                    help='ini file to read strategy parameters')
+	parser.add_argument('--logdir', metavar='dir', dest='logdir',
+	                    type=str, required=False, default='',
+	                    help='log directory of strategies')
+	parser.add_argument('--loglevel', metavar='level', dest='loglevel',
+	                    type=str, required=False, default='WARNING',
+	                    help='log level of strategies')
+	parser.add_argument('--orders', metavar='file', dest='orderfile',
+	                    type=str, required=False, default='',
+	                    help='CSV file to write orders')
+	parser.add_argument('--no-scalping', dest='noscalp',
+	                    required=False, action="store_true", default=False,
+	                    help='do not replay scalping')
+	parser.add_argument('--no-sell', dest='nosell',
+	                    required=False, action="store_true", default=False,
+	                    help='do not replay sell')
+	args = parser.parse_args()
+
+	if not os.path.exists(args.tickerfile):
+		print("ERROR: %s not found" % args.tickerfile)
+		sys.exit(1)
+
+	inifile = configparser.ConfigParser()
+	if os.path.exists(args.inifile):
+		inifile.read(args.inifile, 'UTF-8')
+	else:
+		print("WARNING: %s not found, use default parameters" % args.inifile)
+
+	exch = inifile.get('global', 'exchange', fallback='bitflyer')
+	prod = inifile.get('global', 'product', fallback='BTC_JPY')
+	windows = [int(n) for n in inifile.get('polling', 'windows', fallback='30, 60').split(',') if len(n.strip()) > 0]
+
+	rp = replay(exch, prod, args.logdir, args.loglevel.upper(), windows)
+	if not args.noscalp:
+		rp.setscalping(float(inifile.get('scalping', 'size', fallback='0.001')),
+		               int(inifile.get('scalping', 'expiration_date', fallback='10000')))
+	if not args.nosell:
+		rp.setsell(float(inifile.get('sell', 'size', fallback='0.001')),
+		           float(inifile.get('sell', 'profit_border', fallback='1.01')),
+		           float(inifile.get('sell', 'cut_border', fallback='0.995')))
+
+	tickers = rp.load(args.tickerfile)
+	rp.run(tickers)
+	rep = rp.report()
+
+	print("INFO: %d tickers replayed in %.2f sec" % (rep["ticks"], rep["elapsed"]))
+	print("INFO: orders=%d, %s" % (rep["orders"], ", ".join(["%s=%d" % (k, v) for k, v in sorted(rep["count"].items())])))
+	print("INFO: position=%f, realized=%.1f, unrealized=%.1f, pnl=%.1f" %
+	      (rep["position"], rep["realized"], rep["unrealized"], rep["pnl"]))
+	if len(args.orderfile) > 0:
+		rp.writeorders(args.orderfile)
+
+	sys.exit(0)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+import numpy as np
+
+
+def str2epoch(val, fmt=None):
+	""" convert time string to epoch time [sec]
+	 - val : time string, ISO-8601 (bitflyer) or epoch number (coincheck)
+	 - fmt : strptime format, None indicates ISO-8601
+
+	naive time is regarded as UTC.
+	"""
+	if isinstance(val, (int, float, np.integer, np.floating)):
+		return float(val)
+
+	val = str(val).strip()
+	try:
+		return float(val)
+	except ValueError:
+		pass
+
+	if fmt is None:
+		dt = datetime.datetime.fromisoformat(val)
+	else:
+		dt = datetime.datetime.strptime(val, fmt)
+	if dt.tzinfo is None:
+		dt = dt.replace(tzinfo=datetime.timezone.utc)
+	return dt.timestamp()
+
+
+def epoch2str(val, fmt=None):
+	""" convert epoch time [sec] to time string (UTC)
+	 - val : epoch time
+	 - fmt : strftime format, None indicates ISO-8601 with milliseconds
+	"""
+	dt = datetime.datetime.fromtimestamp(val, datetime.timezone.utc)
+	if fmt is None:
+		return dt.strftime("%Y-%m-%dT%H:%M:%S.") + "%03d" % (dt.microsecond // 1000)
+	return dt.strftime(fmt)
+
+
+def strs2epoch(vals, localtime=False):
+	""" convert array of time strings to array of epoch time [sec]
+	 - vals      : list of time strings, ISO-8601 or epoch number
+	 - localtime : True if time strings are local time (e.g. "datetime"
+	               column of ticker CSV), False if UTC
+
+	this is the vectorized version of str2epoch().
+	the UTC offset of the latest entry is applied to all local times.
+	"""
+	if len(vals) == 0:
+		return np.zeros(0, dtype=np.float64)
+
+	try:
+		return np.array(vals, dtype=np.float64)
+	except ValueError:
+		pass
+
+	vals = [val.strip().rstrip("Z") for val in vals]
+	epochs = np.array(vals, dtype="datetime64[us]").astype(np.int64) / 1e6
+	if localtime:
+		offset = time.localtime(epochs[-1]).tm_gmtoff
+		epochs -= time.localtime(epochs[-1] - offset).tm_gmtoff
+	return epochs
+
+
+class ringbuffer:
+	"""
+	fixed-capacity ring buffer backed by numpy array.
+
+	appending to a full buffer overwrites the oldest entry, so append and
+	eviction are O(1) and memory is allocated only once.
+	indexing follows the list semantics: 0 is the oldest entry and -1 is the
+	latest entry.
+	"""
+
+	def __init__(self, capacity, columns=None, dtype=np.float64):
+		""" constructor
+		 - capacity : maximum number of entries
+		 - columns  : list of column names, None indicates scalar entries
+		 - dtype    : data type of each column
+		"""
+		if capacity <= 0:
+			raise ValueError("capacity must be natural number")
+
+		self.capacity = capacity
+		self.columns = columns
+		if columns is None:
+			self.buf = np.zeros(capacity, dtype=dtype)
+		else:
+			self.colidx = {}
+			for idx, name in enumerate(columns):
+				self.colidx[name] = idx
+			self.buf = np.zeros((len(columns), capacity), dtype=dtype)
+
+		self.head = 0	# next write position
+		self.count = 0	# number of valid entries
+
+
+	def __len__(self):
+		return self.count
+
+
+	def clear(self):
+		""" remove all entries """
+		self.head = 0
+		self.count = 0
+
+
+	def pos(self, idx):
+		""" convert index to physical position in the buffer
+		 - idx : index of entry, negative value counts from the latest entry
+		"""
+		if idx < 0:
+			idx += self.count
+		if idx < 0 or idx >= self.count:
+			raise IndexError("ring buffer index out of range")
+		return (self.head - self.count + idx) % self.capacity
+
+
+	def append(self, val):
+		""" append value to the buffer and purge the oldest entry if full
+		 - val : scalar value, or dict keyed by column name
+		"""
+		if self.columns is None:
+			self.buf[self.head] = val
+		else:
+			for name, col in self.colidx.items():
+				self.buf[col, self.head] = val[name]
+
+		self.head += 1
+		if self.head >= self.capacity:
+			self.head = 0
+		if self.count < self.capacity:
+			self.count += 1
+
+
+	def extend(self, values):
+		""" append multiple entries at once
+		 - values : array of values, or dict of arrays keyed by column name
+
+		only the latest 'capacity' entries are kept if values exceed the
+		capacity of the buffer.
+		"""
+		if self.columns is None:
+			arr = np.asarray(values, dtype=self.buf.dtype)[np.newaxis]
+			buf = self.buf[np.newaxis]
+		else:
+			arr = np.vstack([np.asarray(values[name], dtype=self.buf.dtype) for name in self.columns])
+			buf = self.buf
+
+		num = arr.shape[1]
+		if num > self.capacity:
+			arr = arr[:, num - self.capacity:]
+			num = self.capacity
+
+		# write up to the end of the buffer, then wrap around
+		first = min(num, self.capacity - self.head)
+		buf[:, self.head:self.head + first] = arr[:, :first]
+		buf[:, :num - first] = arr[:, first:]
+
+		self.head = (self.head + num) % self.capacity
+		self.count = min(self.count + num, self.capacity)
+
+
+	def __getitem__(self, idx):
+		""" get entry
+		 - idx : index of entry, -1 indicates the latest entry
+		"""
+		pos = self.pos(idx)
+		if self.columns is None:
+			return self.buf[pos].item()
+
+		ent = {}
+		for name, col in self.colidx.items():
+			ent[name] = self.buf[col, pos].item()
+		return ent
+
+
+	def column(self, name=None, count=0):
+		""" get entries of a column in chronological order
+		 - name  : column name, None for scalar buffer
+		 - count : number of latest entries, 0 indicates all entries
+
+		the returned array is a copy of the buffer.
+		"""
+		if self.columns is None:
+			arr = self.buf
+		else:
+			arr = self.buf[self.colidx[name]]
+
+		if count <= 0 or count > self.count:
+			count = self.count
+		stpos = (self.head - count) % self.capacity
+		if stpos + count <= self.capacity:
+			return arr[stpos:stpos + count].copy()
+		return np.concatenate((arr[stpos:], arr[:self.head]))
+
+
+class tickerbuffer(ringbuffer):
+	"""
+	columnar ring buffer for ticker history.
+
+	each ticker is stored as the columns below instead of a dict:
+	 - last      : last price
+	 - best_bid  : the highest bid price
+	 - best_ask  : the lowest ask price
+	 - timestamp : exchange timestamp (epoch, UTC)
+	 - datetime  : local time when the ticker was fetched (epoch)
+	"""
+
+	COLUMNS = ["last", "best_bid", "best_ask", "timestamp", "datetime"]
+	DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+	def __init__(self, capacity, product=""):
+		""" constructor
+		 - capacity : maximum number of tickers
+		 - product  : product code of tickers
+		"""
+		super().__init__(capacity, self.COLUMNS)
+		self.product = product
+
+
+	def append(self, ticker):
+		""" append ticker object
+		 - ticker : ticker object returned by polling.ticker()
+		"""
+		ent = {"last"      : float(ticker["last"]),
+		       "best_bid"  : float(ticker["best_bid"]),
+		       "best_ask"  : float(ticker["best_ask"]),
+		       "timestamp" : str2epoch(ticker["timestamp"]),
+		       "datetime"  : self.datetime2epoch(ticker["datetime"])}
+		if "product" in ticker:
+			self.product = ticker["product"]
+		super().append(ent)
+
+
+	def __getitem__(self, idx):
+		""" get ticker object
+		 - idx : index of ticker history, -1 indicates the latest entry
+		"""
+		ent = super().__getitem__(idx)
+		return {"product"   : self.product,
+		        "datetime"  : datetime.datetime.fromtimestamp(ent["datetime"]).strftime(self.DATETIME_FORMAT),
+		        "timestamp" : epoch2str(ent["timestamp"]),
+		        "best_bid"  : ent["best_bid"],
+		        "best_ask"  : ent["best_ask"],
+		        "last"      : ent["last"]}
+
+
+	def datetime2epoch(self, val):
+		""" convert local datetime string to epoch time """
+		if isinstance(val, (int, float)):
+			return float(val)
+		return datetime.datetime.strptime(val, self.DATETIME_FORMAT).timestamp()
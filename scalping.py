@@ -1,19 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import time
+import math
+import queue
 from multiprocessing import Queue
 import logging
 import signal
 
-from coincheck import market
-from coincheck import order
-import pybitflyer
+import exchange
+import scheduler
+import latency
 
 class scalping:
 	""" scalping class """
 
-	def __init__(self, exch, apikey, apisec, outdir, loglv, poll_reqq, poll_rspq, stop_flag, q_get_tov):
+	# decimals of limit order price (price tick) by quote currency of the product
+	PRICE_DECIMALS = {"JPY" : 0, "BTC" : 5}
+	DEFAULT_DECIMALS = 8
+
+	def __init__(self, exch, apikey, apisec, outdir, loglv, poll_reqq, poll_rspq, stop_flag, q_get_tov, snapshot=None, tickq=None, health=None, orders=None, dryrun=True):
 		""" constructor
 		
 		 - exch      : exchange ("coincheck" or "bitflyer")
@@ -25,6 +30,13 @@ class scalping:
 		 - poll_rspq : response-from-polling queue
 		 - stop_flag : stop flag
 		 - q_get_tov : TOV getting from queue
+		 - snapshot  : shared memory snapshot of the latest ticker
+		 - tickq     : subscription to tickers pushed by polling object
+		 - health    : cached exchange health (health.healthmonitor),
+		               None indicates requesting health to exchange
+		 - orders    : client of order gateway (gateway.orderclient),
+		               None indicates placing orders by own API client
+		 - dryrun    : True to log orders without placing them
 		"""
 
 		self.exch = exch
@@ -54,23 +66,42 @@ class scalping:
 			raise
 
 		# set exchange
-		self.ccpublic = None
-		self.ccprivate = None
-		self.bfpublic = None
-		self.bfprivate = None
-		if self.exch == "bitflyer":
-			self.bfpublic = pybitflyer.API()
-			self.bfprivate = pybitflyer.API(api_key=self.apikey, api_secret=self.apisecret)
-		elif self.exch == "coincheck":
-			self.ccpublic = market.Market()
-			self.ccprivate = order.Order(access_key=self.apikey, secret_key=self.apisecret)
-		else:
+		self.api = exchange.create(self.exch, self.apikey, self.apisecret)
+		if self.api is None:
 			self.logger.error("invalid exchange name")
 			return
 
+		# orders are placed through order gateway if available
+		self.orders = orders
+		if self.orders is None:
+			self.orders = self.api
+		self.dryrun = dryrun
+
 		# set request/response queue for polling object
+		# (response queue is dedicated to this client)
 		self.poll_reqq = poll_reqq
 		self.poll_rspq = poll_rspq
+		self.prod = ""
+		self.clientid = "scalping"
+		self.reqid = 0
+
+		# set shared memory snapshot published by polling object
+		self.snapshot = snapshot
+
+		# set subscription to tickers pushed by polling object
+		self.tickq = tickq
+
+		# ticker feed is stale (exchange is not reachable)
+		self.stale = False
+
+		# cached exchange health refreshed in background
+		self.health = health
+
+		# per-stage latency from ticker fetch to decision
+		self.latency = latency.tracker("scalping", self.logger)
+
+		# mid price of the previous ticker
+		self.before_midprice = 0
 
 		# set stop flag
 		self.stop_flag = stop_flag
@@ -79,18 +110,72 @@ class scalping:
 	def getTicker(self):
 		""" get ticker from polling object """
 
+		# read shared memory snapshot if available
+		if self.snapshot is not None:
+			ticker = self.snapshot.readticker()
+			if ticker is not None:
+				latency.stamp(ticker, "receipt")
+				if self.checkStale(ticker):
+					return
+				return ticker
+
 		if self.poll_reqq is None or self.poll_rspq is None:
 			return
 
-		req = {"cmd" : "get ticker"}
+		self.reqid += 1
+		req = {"cmd" : "get ticker", "id" : self.reqid, "client" : self.clientid}
+		if len(self.prod) > 0:
+			req["product"] = self.prod
 		self.poll_reqq.put(req)
-		ticker = self.poll_rspq.get(timeout=self.q_get_tov)
+
+		# discard stale responses to timed-out requests
+		try:
+			while True:
+				ticker = self.poll_rspq.get(timeout=self.q_get_tov)
+				if ticker.get("id") == self.reqid:
+					break
+		except queue.Empty:
+			self.logger.warning("no response from polling")
+			return
+		latency.stamp(ticker, "receipt")
+
+		if "error" in ticker:
+			self.logger.warning("could not get ticker: %s" % ticker["error"])
+			return
+		if self.checkStale(ticker):
+			return
 
 		#debug
 		# self.logger.debug("ticker=%s" % str(ticker))
 
 		return ticker
 
+
+	def checkEvent(self, msg):
+		""" process event pushed by polling object
+		 - msg : event message ("stale" or "health")
+		"""
+		if msg["event"] == "stale":
+			self.checkStale(msg)
+		elif msg["event"] == "health":
+			self.logger.info("exchange health changed: %s -> %s" % (msg.get("previous"), msg.get("health")))
+
+
+	def checkStale(self, msg):
+		""" update staleness of ticker feed
+		 - msg : ticker or "stale" event from polling object
+
+		return True if the ticker feed is stale.
+		"""
+		stale = bool(msg.get("stale", False))
+		if stale != self.stale:
+			if stale:
+				self.logger.warning("ticker feed is stale, stop trading: %s" % msg.get("reason", ""))
+			else:
+				self.logger.info("ticker feed recovered, resume trading")
+			self.stale = stale
+		return stale
+
 	
 	def getSMA30(self, ticker=None):
 		""" get SMA using 30 entries from ticker """
@@ -152,21 +237,25 @@ class scalping:
 
 	def isHealth(self):
 		""" determine whether exchange status is normal or not """
+
+		# cached health is read without request
+		if self.health is not None:
+			status = self.health.status()
+			if status != "NORMAL":
+				self.logger.debug("server status = %s" % status)
+				return False
+			return True
+
 		try:
-			if self.ccpublic is not None:
-				# since API is not supported, assume always normal
-				return True
-			elif self.bfpublic is not None:
-				status = self.bfpublic.gethealth();
-				if status['status'] != "NORMAL":
-					self.logger.debug("server status = %s" % status['status'])
-					return False
-				else:
-					return True
+			# exchange not supporting this API is assumed always normal
+			status = self.api.health(self.prod)
+			if status != "NORMAL":
+				self.logger.debug("server status = %s" % status)
+				return False
 			else:
 				return True
 					
-		except JSONDecodeError:
+		except exchange.exchangeerror:
 			# communication error occurred
 			self.logger.warning("could not get server status")
 			return False
@@ -181,33 +270,40 @@ class scalping:
 		 - expiration : expiration date of order
 		"""
 
-		if self.bfprivate is not None:
-			try:
-				""" kari for debug
-				self.bfprivate.sendchildorder(product_code = prod,
-				                              child_order_type = "LIMIT",
-				                              side = "BUY",
-				                              price = price,
-				                              size = size,
-				                              minute_to_expire = expiredate,
-				                              time_in_force = "GTC")
-				"""
-				return True
-			except pybitflyer.exception.AuthException as e:
-				self.logger.error(str(e))
-				return False
-			except:
-				raise
-		elif self.ccprivate is not None:
-			# NOP (TBD)
+		# exchange rejects prices off the tick, and prices on the tick are
+		# coalesced by order gateway
+		price = self.roundPrice(prod, price)
+		self.logger.info("order %s LIMIT BUY size=%g price=%s%s" % (prod, size, str(price), " (dry run)" if self.dryrun else ""))
+		if self.dryrun:
+			return True
+
+		try:
+			self.orders.sendorder(prod, "LIMIT", "BUY", size, price, expiredate)
 			return True
+		except exchange.exchangeerror as e:
+			self.logger.error(str(e))
+			return False
+
+
+	def roundPrice(self, prod, price):
+		""" round buying price down to the price tick of the product
+		 - prod  : product code
+		 - price : price
+		"""
+		quote = prod.upper().rsplit("_", 1)[-1]
+		decimals = self.PRICE_DECIMALS.get(quote, self.DEFAULT_DECIMALS)
+		factor = 10 ** decimals
+		price = math.floor(price * factor + 1e-6) / factor
+		if decimals == 0:
+			return int(price)
+		return round(price, decimals)
 
 
 	def runscalp(self, prod="", interval=1, size=0, expiredate=0):
 		""" run scalping 
 		
 		 - prod       : product code ("BTC_JPY", "ETH_BTC" or "FX_BTC_JPY")
-		 - interval   : interval (unit=second)
+		 - interval   : interval (unit=second, fraction is allowed)
 		 - size       : amount of buy/sell
 		 - expiredate : expiration date of buy/sell order
 		"""
@@ -216,13 +312,25 @@ class scalping:
 		signal.signal(signal.SIGINT, signal.SIG_IGN)
 		signal.signal(signal.SIGTERM, signal.SIG_IGN)
 
-		midprice = 0
-		before_midprice = 0
+		# product of ticker requested to polling object
+		self.prod = prod
+
+		self.before_midprice = 0
 		# pos = 0 # Long : 1, Short : -1, No position : 0
+
+		# sampling on fixed deadlines when tickers are not pushed
+		sched = scheduler.scheduler(interval, self.stop_flag, self.logger)
 		
 		while True:
 			try:
-				time.sleep(interval)
+				if self.tickq is not None:
+					# react to every ticker pushed by polling object
+					ticker = self.tickq.get(timeout=interval)
+					if ticker is not None:
+						latency.stamp(ticker, "receipt")
+				else:
+					sched.wait()
+					ticker = None
 				# self.logger.debug(str(pos))
 
 				# terminate if stop flag is set
@@ -230,25 +338,57 @@ class scalping:
 					self.logger.debug("terminate signal received, bye")
 					break
 
-				# get medium price
-				midprice = self.getMidPrice()
-				
-				# get server status (bitFlyer ONLY because coincheck does not support this)
-				if self.isHealth() == False:
-					continue
-
-				# 前回の観測点より価格が高く、ノーポジの時
-				if midprice - before_midprice > 0:
-					self.logger.info("Entry Long, midprice=%.1f, side=Long" % midprice)
-					if self.entryLong(prod, midprice, size, expiredate) is False:
-						self.logger.error("could not get position")
+				if self.tickq is not None:
+					# no ticker is pushed within interval
+					if ticker is None:
+						continue
+					# feed status and health are pushed as event
+					if "event" in ticker:
+						self.checkEvent(ticker)
+						continue
+					self.checkStale(ticker)
+				else:
+					ticker = self.getTicker()
 
-				# 前回の観測点よりも価格が低い場合はスルー
-				if before_midprice - midprice > 0:
-					self.logger.debug("Time to Short. Do nothing, midprice=%.1f, side=Short" % midprice)
+				# do not trade while ticker feed is stale
+				if ticker is None or self.stale:
+					continue
 
-				before_midprice = midprice
+				self.checkEntry(prod, ticker, size, expiredate)
+				latency.stamp(ticker, "decision")
+				self.latency.record(ticker["stamps"])
 
 			except KeyboardInterrupt:
 				break
 
+		self.latency.log()
+
+
+	def checkEntry(self, prod, ticker, size, expiredate):
+		""" judge entry by the ticker and place order
+		
+		 - prod       : product code ("BTC_JPY", "ETH_BTC" or "FX_BTC_JPY")
+		 - ticker     : ticker to judge
+		 - size       : amount of buy/sell
+		 - expiredate : expiration date of buy/sell order
+		"""
+
+		# get medium price
+		midprice = self.getMidPrice(ticker)
+		
+		# get server status (bitFlyer ONLY because coincheck does not support this)
+		if self.isHealth() == False:
+			return
+
+		# 前回の観測点より価格が高く、ノーポジの時
+		if midprice - self.before_midprice > 0:
+			self.logger.info("Entry Long, midprice=%.1f, side=Long" % midprice)
+			if self.entryLong(prod, midprice, size, expiredate) is False:
+				self.logger.error("could not get position")
+
+		# 前回の観測点よりも価格が低い場合はスルー
+		if self.before_midprice - midprice > 0:
+			self.logger.debug("Time to Short. Do nothing, midprice=%.1f, side=Short" % midprice)
+
+		self.before_midprice = midprice
+
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import logging
+
+
+class scheduler:
+	"""
+	drift-free periodic scheduler.
+
+	ticks fire on absolute deadlines of the monotonic clock
+	(start + interval * n), so that the period does not drift by the time
+	spent in the work between ticks. when the work takes longer than the
+	interval, the missed deadlines are skipped instead of firing them in a
+	burst. lateness of each tick (actual firing time - deadline) is returned
+	and accumulated in statistics.
+
+	usage:
+		sched = scheduler.scheduler(0.2)
+		while True:
+			do_work()
+			sched.wait()
+	"""
+
+	def __init__(self, interval, stop_flag=None, logger=None):
+		""" constructor
+		 - interval  : interval of ticks [sec], fraction is allowed
+		 - stop_flag : stop flag to wake up waiting immediately (optional)
+		 - logger    : logger object
+		"""
+		if interval <= 0:
+			raise ValueError("interval must be positive")
+
+		self.interval = float(interval)
+		self.stop_flag = stop_flag
+		if logger is None:
+			logger = logging.getLogger("scheduler")
+		self.logger = logger
+
+		self.deadline = time.monotonic() + self.interval
+
+		# statistics
+		self.nfire = 0
+		self.nskip = 0
+		self.lastlate = 0.0
+		self.maxlate = 0.0
+		self.sumlate = 0.0
+
+
+	def reset(self):
+		""" restart ticks from now """
+		self.deadline = time.monotonic() + self.interval
+
+
+	def delay(self):
+		""" time until the next deadline [sec] (0 if passed) """
+		return max(0.0, self.deadline - time.monotonic())
+
+
+	def fire(self):
+		""" record firing of the current deadline and advance to the next one
+
+		return lateness of the tick [sec].
+		"""
+		now = time.monotonic()
+		late = max(0.0, now - self.deadline)
+		self.nfire += 1
+		self.lastlate = late
+		self.sumlate += late
+		if late > self.maxlate:
+			self.maxlate = late
+
+		# skip missed deadlines
+		self.deadline += self.interval
+		if self.deadline <= now:
+			nskip = int((now - self.deadline) // self.interval) + 1
+			self.deadline += nskip * self.interval
+			self.nskip += nskip
+			self.logger.warning("%d tick(s) skipped, late by %.1f ms" % (nskip, late * 1000))
+		elif self.logger.isEnabledFor(logging.DEBUG):
+			self.logger.debug("tick late by %.1f ms" % (late * 1000))
+
+		return late
+
+
+	def wait(self):
+		""" sleep until the next deadline
+
+		return lateness of the tick [sec].
+		"""
+		delay = self.delay()
+		if delay > 0:
+			if self.stop_flag is not None:
+				self.stop_flag.wait(delay)
+			else:
+				time.sleep(delay)
+		return self.fire()
+
+
+	async def asyncwait(self):
+		""" sleep until the next deadline (asyncio version)
+
+		return lateness of the tick [sec].
+		"""
+		delay = self.delay()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		return self.fire()
+
+
+	def stats(self):
+		""" get statistics of ticks """
+		if self.nfire > 0:
+			meanlate = self.sumlate / self.nfire
+		else:
+			meanlate = 0.0
+		return {"interval" : self.interval,
+		        "fired"    : self.nfire,
+		        "skipped"  : self.nskip,
+		        "lastlate" : self.lastlate,
+		        "meanlate" : meanlate,
+		        "maxlate"  : self.maxlate}
@@ -2,19 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import time
+import queue
 from multiprocessing import Queue
 import signal
 import logging
 import re
+import numpy as np
 
-from coincheck import order
-import pybitflyer
+import exchange
+import scheduler
+import latency
+import ledger
+import trigger
 
 
 class sell:
 	""" sell class """
 
-	def __init__(self, exch, apikey, apisec, logdir, loglv, poll_reqq, poll_rspq, stop_flag, q_get_tov):
+	def __init__(self, exch, apikey, apisec, logdir, loglv, poll_reqq, poll_rspq, stop_flag, q_get_tov, snapshot=None, tickq=None, health=None, orders=None, dryrun=True):
 		""" constructor
 
 		 - exch      : exchange ("coincheck" or "bitflyer")
@@ -25,6 +30,14 @@ class sell:
 		 - poll_reqq : request queue to polling module
 		 - poll_rspq : response queue from polling module
 		 - stop_flag : stop flag to terminate this process
+		 - q_get_tov : TOV getting from queue
+		 - snapshot  : shared memory snapshot of the latest ticker
+		 - tickq     : subscription to tickers pushed by polling module
+		 - health    : cached exchange health (health.healthmonitor),
+		               None indicates requesting health to exchange
+		 - orders    : client of order gateway (gateway.orderclient),
+		               None indicates placing orders by own API client
+		 - dryrun    : True to log orders without placing them
 		"""
 		self.exch = exch
 		self.apikey = apikey
@@ -53,23 +66,56 @@ class sell:
 			raise
 
 		# set exchange
-		self.ccpublic = None
-		self.ccprivate = None
-		self.bfpublic = None
-		self.bfprivate = None
-		if self.exch == "bitflyer":
-			self.bfpublic = pybitflyer.API()
-			self.bfprivate = pybitflyer.API(api_key=self.apikey, api_secret=self.apisecret)
-		elif self.exch == "coincheck":
-			self.ccpublic = market.Market()
-			self.ccprivate = order.Order(access_key=self.apikey, secret_key=self.apisecret)
-		else:
+		self.api = exchange.create(self.exch, self.apikey, self.apisecret)
+		if self.api is None:
 			self.logger.error("invalid exchange name")
 			return
 
+		# orders are placed through order gateway if available
+		self.orders = orders
+		if self.orders is None:
+			self.orders = self.api
+		self.dryrun = dryrun
+
 		# set request/response queue for polling object
+		# (response queue is dedicated to this client)
 		self.poll_reqq = poll_reqq
 		self.poll_rspq = poll_rspq
+		self.prod = ""
+		self.clientid = "sell"
+		self.reqid = 0
+
+		# set shared memory snapshot published by polling object
+		self.snapshot = snapshot
+
+		# set subscription to tickers pushed by polling module
+		self.tickq = tickq
+
+		# ticker feed is stale (exchange is not reachable)
+		self.stale = False
+
+		# cached exchange health refreshed in background
+		self.health = health
+
+		# per-stage latency from ticker fetch to decision
+		self.latency = latency.tracker("sell", self.logger)
+
+		# cache of my positions and their entry prices (refreshed every 'posttl' seconds)
+		self.poss = None
+		self.posprices = None
+		self.posstime = 0
+		self.posttl = 0
+
+		# local ledger of my executions (spot trading)
+		self.ledger = None
+
+		# trigger index of take-profit/stop-loss prices of positions keyed
+		# by lot ID (spot) or index of positions (FX)
+		# (source and borders the index is built from, entry price of each key)
+		self.triggers = trigger.triggerindex()
+		self.trigsource = None
+		self.trigborders = None
+		self.trigentries = {}
 
 		# set stop flag
 		self.stop_flag = stop_flag
@@ -77,12 +123,41 @@ class sell:
 
 	def getTicker(self):
 		""" get ticker from polling module """
+
+		# read shared memory snapshot if available
+		if self.snapshot is not None:
+			ticker = self.snapshot.readticker()
+			if ticker is not None:
+				latency.stamp(ticker, "receipt")
+				if self.checkStale(ticker):
+					return
+				return ticker
+
 		if self.poll_reqq is None or self.poll_rspq is None:
 			return
 
-		req = {"cmd" : "get ticker"}
+		self.reqid += 1
+		req = {"cmd" : "get ticker", "id" : self.reqid, "client" : self.clientid}
+		if len(self.prod) > 0:
+			req["product"] = self.prod
 		self.poll_reqq.put(req)
-		ticker = self.poll_rspq.get(timeout=self.q_get_tov)
+
+		# discard stale responses to timed-out requests
+		try:
+			while True:
+				ticker = self.poll_rspq.get(timeout=self.q_get_tov)
+				if ticker.get("id") == self.reqid:
+					break
+		except queue.Empty:
+			self.logger.warning("no response from polling")
+			return
+		latency.stamp(ticker, "receipt")
+
+		if "error" in ticker:
+			self.logger.warning("could not get ticker: %s" % ticker["error"])
+			return
+		if self.checkStale(ticker):
+			return
 
 		#debug
 		# self.logger.debug("ticker=%s" % str(ticker))
@@ -90,37 +165,62 @@ class sell:
 		return ticker
 
 
+	def checkEvent(self, msg):
+		""" process event pushed by polling module
+		 - msg : event message ("stale" or "health")
+		"""
+		if msg["event"] == "stale":
+			self.checkStale(msg)
+		elif msg["event"] == "health":
+			self.logger.info("exchange health changed: %s -> %s" % (msg.get("previous"), msg.get("health")))
+
+
+	def checkStale(self, msg):
+		""" update staleness of ticker feed
+		 - msg : ticker or "stale" event from polling module
+
+		return True if the ticker feed is stale.
+		"""
+		stale = bool(msg.get("stale", False))
+		if stale != self.stale:
+			if stale:
+				self.logger.warning("ticker feed is stale, stop trading: %s" % msg.get("reason", ""))
+			else:
+				self.logger.info("ticker feed recovered, resume trading")
+			self.stale = stale
+		return stale
+
+
 	def getExecutions(self, prod):
-		""" get my executions 
+		""" get my open lots from local ledger of executions
 		 - id
 		 - child_order_id
-		 - side, "BUY" or "SELL"
+		 - side, "BUY"
 		 - price
-		 - size
+		 - size      : remaining size of the lot
 		 - commission
 		 - exec_date : execution date
 		 - child_order_acceptance_id
+
+		the ledger is synchronized incrementally (only executions newer
+		than the last seen ID are fetched) before returning open lots.
 		"""
 
-		if self.ccprivate is not None:
+		prod = prod.upper()
+		if self.ledger is None or self.ledger.product != prod:
+			self.ledger = ledger.ledger(prod, self.logger, journal=True)
+		try:
+			self.ledger.sync(self.api)
+		except exchange.autherror:
+			raise
+		except exchange.exchangeerror as e:
+			self.logger.error("%s '%s'" % (str(e), prod))
 			return
-		elif self.bfprivate is not None:
-			prod = prod.upper()
-			ret = self.bfprivate.getexecutions(product_code=prod, count=500, before=0, after=0)
-			if len(ret) == 0:
-				self.logger.debug("getExecutions: no execution")
-				return
-			elif len(ret) == 3:
-				if ret['status'] != 200:
-					self.logger.error("%s '%s'" % (ret['error_message'], prod))
-					return
-				else:
-					return ret
-			else:
-				# self.logger.debug("getExecutions: prod=%s, ret=%s" % (prod, str(ret)))
-				return ret
-		else:
+		if len(self.ledger) == 0:
+			self.logger.debug("getExecutions: no open lot")
 			return
+		else:
+			return self.ledger.positions()
 
 
 	def getPosition(self, prod):
@@ -140,24 +240,19 @@ class sell:
 		 - pnl
 		"""
 
-		if self.ccprivate is not None:
+		prod = prod.upper()
+		try:
+			ret = self.api.positions(prod)
+		except exchange.autherror:
+			raise
+		except exchange.exchangeerror as e:
+			self.logger.error("%s '%s'" % (str(e), prod))
 			return
-		elif self.bfprivate is not None:
-			prod = prod.upper()
-			ret = self.bfprivate.getpositions(product_code=prod)
-			self.logger.debug("getPosition: prod=%s, ret=%s" % (prod, str(ret)))
-			if len(ret) == 0:
-				return
-			elif len(ret) == 3:
-				if ret['status'] != 200:
-					self.logger.error("%s '%s'" % (ret['error_message'], prod))
-					return
-				else:
-					return ret
-			else:
-				return ret
-		else:
+		self.logger.debug("getPosition: prod=%s, ret=%s" % (prod, str(ret)))
+		if ret is None or len(ret) == 0:
 			return
+		else:
+			return ret
 
 
 	def placeOrder(self, prod, ordtype, side, size):
@@ -168,79 +263,212 @@ class sell:
 		 - size    : amount of order
 		"""
 
-		if self.bfprivate is not None:
-			"""
-			odr = self.bfprivate.sendchildorder(product_code=prod,
-			                                    child_order_type=ordtype,
-			                                    side=side,
-			                                    size=size)
-			if odr is not None:
-				return True
-			else:
-				return False
-			"""
-			return True
+		# exchange does not accept orders (cached health)
+		if self.health is not None and not self.health.canorder():
+			self.logger.warning("order is not placed, server status = %s" % self.health.status())
+			return False
 
-		elif self.ccprivate is not None:
-			# TBD
+		if self.dryrun:
+			self.logger.info("dry run, order is not placed: %s %s %s size=%g" % (prod, ordtype, side, size))
 			return True
 
+		try:
+			odr = self.orders.sendorder(prod, ordtype, side, size)
+		except exchange.exchangeerror as e:
+			self.logger.error(str(e))
+			return False
+		if odr is not None:
+			return True
 		else:
 			return False
 
 
-	def checkPosition(self, prod, profit_border, cut_border, size):
+	def loadPositions(self, prod):
+		""" get my positions (FX) or executions, cached for 'posttl' seconds
+		 - prod : product code, "BTC_JPY", "FX_BTC_JPY", "ETH_BTC"
+		"""
+		now = time.monotonic()
+		if self.poss is not None and now - self.posstime < self.posttl:
+			return self.poss
+
+		matchob = re.search("fx_", prod.lower())
+		if matchob:
+			poss = self.getPosition(prod)
+			if poss is not None:
+				self.logger.debug("%d positions found." % len(poss))
+		else:
+			poss = self.getExecutions(prod)
+			if poss is not None:
+				self.logger.debug("%d open lots found." % len(poss))
+
+		self.poss = poss
+		self.posstime = now
+		if poss is not None:
+			if matchob:
+				# the same array is kept while positions are not changed,
+				# so that trigger index is not rebuilt on every refresh
+				prices = np.array([float(pos['price']) for pos in poss], dtype=np.float64)
+				if self.posprices is None or not np.array_equal(prices, self.posprices):
+					self.posprices = prices
+			else:
+				# entry prices are maintained by the ledger
+				self.posprices = self.ledger.prices()
+		return poss
+
+
+	def checkPosition(self, prod, profit_border, cut_border, size, tick=None):
 		""" check position
 		 - prod          : product code, "BTC_JPY", "FX_BTC_JPY", "ETH_BTC"
 		 - profit_border : border line for profit [%]
 		 - cut_border    : cut line for 'stop-loss'
 		 - size          : amount of order
+		 - tick          : ticker to judge, None indicates getting ticker
+		                   from polling module
+
+		all positions are judged by one ticker at once: take-profit and
+		stop-loss prices of the positions are kept in sorted trigger index
+		(see updateTriggers()), and only positions whose borders are
+		crossed since the previous ticker are sold.
 		"""
 
-		try:
-			# get my position
-			matchob = re.search("fx_", prod.lower())
-			if matchob:
-				poss = self.getPosition(prod)
-				if poss is None:
-					return
-				else:
-					self.logger.debug("%d positions found." % len(poss))
-			else:
-				poss = self.getExecutions(prod)
-				if poss is None:
-					return
-				else:
-					self.logger.debug("%d executions found." % len(poss))
-    
-			# judge whether my positions should be selled or not
-			for pos in poss:
-				ticker = self.getTicker()
-    
-				upper_price = float(pos['price']) * profit_border
-				lower_price = float(pos['price']) * cut_border
-				self.logger.debug("last_price=%.1f, border_price=%.1f, cut_price=%.1f" % 
-				                  (ticker['last'], upper_price, lower_price))
-    
-				if ticker['last'] > float(pos['price']):
-					if ticker['last'] > upper_price:
-						# secure profit
-						self.logger.info("write sell code, short entry")
-						self.placeOrder(prod, "MARKET", "SELL", size)
-					else:
-						self.logger.info("though position is positive, hold position, position_price=%.1f, last_price=%.1f" %
-						                 (pos['price'], ticker['last']))
-				else:
-					if ticker['last'] < lower_price:
-						# stop-less
-						self.logger.info("write sell code, short entry")
-						self.placeOrder(prod, "MARKET", "SELL", size)
-					else:
-						self.logger.info("since your position is negative, hold position, position_price=%.1f, last_price=%.1f" % (pos['price'], ticker['last']))
-		except:
-			raise
+		# get my position
+		poss = self.loadPositions(prod)
+		if poss is None:
+			return
+
+		# one ticker for all positions
+		ticker = tick
+		if ticker is None:
+			ticker = self.getTicker()
+			if ticker is None:
+				self.logger.warning("could not get ticker, skip checking positions")
+				return
+		last = float(ticker['last'])
+
+		# take-profit:  last > price and last > price * profit_border
+		# stop-loss  :  last <= price and last < price * cut_border
+		self.updateTriggers(prod, poss, profit_border, cut_border)
+		profit, cut = self.triggers.crossed(last)
+		self.logger.debug("last_price=%.1f, positions=%d, profit=%d, cut=%d" %
+		                  (last, len(poss), len(profit), len(cut)))
+
+		# judge whether my positions should be selled or not
+		failed = False
+		for key in profit:
+			# secure profit
+			price = self.trigentries[key]
+			self.logger.info("write sell code, short entry, position_price=%.1f, last_price=%.1f, border_price=%.1f" %
+			                 (price, last, price * profit_border))
+			failed |= (self.placeOrder(prod, "MARKET", "SELL", size) is False)
+		for key in cut:
+			# stop-less
+			price = self.trigentries[key]
+			self.logger.info("write sell code, short entry, position_price=%.1f, last_price=%.1f, cut_price=%.1f" %
+			                 (price, last, price * cut_border))
+			failed |= (self.placeOrder(prod, "MARKET", "SELL", size) is False)
+
+		# positions crossed the border are judged again by the next ticker
+		if failed:
+			self.triggers.reset()
+
+		# latency of the ticker
+		latency.stamp(ticker, "decision")
+		self.latency.record(ticker["stamps"])
 
 	
+	def updateTriggers(self, prod, poss, profit_border, cut_border):
+		""" keep trigger index in line with positions
+		 - prod          : product code
+		 - poss          : positions
+		 - profit_border : border line for profit
+		 - cut_border    : cut line for 'stop-loss'
+
+		take-profit:  last > price and last > price * profit_border
+		stop-loss  :  last <= price and last < price * cut_border
+
+		spot lots are followed incrementally by the lots opened and closed
+		in the ledger, so that the index is not sorted again on every fill.
+		FX positions (fetched as a whole) rebuild the index only when their
+		prices are changed. the index is rebuilt when borders are changed.
+		"""
+		borders = (profit_border, cut_border)
+		up = max(profit_border, 1.0)
+		down = min(cut_border, 1.0)
+		spot = self.ledger is not None and re.search("fx_", prod.lower()) is None
+		source = self.ledger if spot else self.posprices
+
+		if self.trigsource is source and self.trigborders == borders:
+			if not spot:
+				return
+			added = []
+			removed = []
+			for kind, lot in self.ledger.takechanges():
+				key = int(lot["id"])
+				price = float(lot["price"])
+				if kind == "open":
+					self.triggers.add(key, price * up, price * down)
+					self.trigentries[key] = price
+					added.append((key, price))
+				elif self.trigentries.pop(key, None) is not None:
+					self.triggers.remove(key, price * up, price * down)
+					removed.append((key, price))
+			if len(added) > 0 or len(removed) > 0:
+				self.registerTriggers(prod, added, removed, up, down)
+			return
+
+		# build index of all positions
+		if spot:
+			self.ledger.takechanges()
+			keys = [int(lot["id"]) for lot in poss]
+		else:
+			keys = list(range(len(poss)))
+		prices = self.posprices
+		self.triggers.build(prices * up, prices * down, keys, keys)
+		self.trigsource = source
+		self.trigborders = borders
+		self.trigentries = dict(zip(keys, prices.tolist()))
+		self.registerTriggers(prod, list(self.trigentries.items()), None, up, down)
+
+
+	def registerTriggers(self, prod, added, removed, up, down):
+		""" register take-profit/stop-loss prices of positions to polling
+		    module, which pushes "trigger" event as soon as a ticker crosses
+		    them (only when tickers are pushed)
+		 - prod    : product code
+		 - added   : list of (key, entry price) of added positions
+		 - removed : list of (key, entry price) of removed positions,
+		             None indicates replacing all triggers by 'added'
+		 - up      : ratio of take-profit price to entry price
+		 - down    : ratio of stop-loss price to entry price
+		"""
+		if self.tickq is None or self.poll_reqq is None:
+			return
+
+		def items(ents):
+			items = []
+			for key, price in ents:
+				items.append({"id" : key, "direction" : "up", "level" : price * up})
+				items.append({"id" : key, "direction" : "down", "level" : price * down})
+			return items
+
+		if removed is None:
+			self.poll_reqq.put({"cmd"      : "set triggers",
+			                    "client"   : self.clientid,
+			                    "product"  : prod,
+			                    "triggers" : items(added)})
+			return
+		if len(removed) > 0:
+			self.poll_reqq.put({"cmd"      : "remove triggers",
+			                    "client"   : self.clientid,
+			                    "product"  : prod,
+			                    "triggers" : items(removed)})
+		if len(added) > 0:
+			self.poll_reqq.put({"cmd"      : "add triggers",
+			                    "client"   : self.clientid,
+			                    "product"  : prod,
+			                    "triggers" : items(added)})
+
+
 	def runsell(self, prod, interval, size, profit_border, cut_border):
 		""" polling my position and issue sell order """
 
@@ -248,21 +476,62 @@ class sell:
 		signal.signal(signal.SIGINT, signal.SIG_IGN)
 		signal.signal(signal.SIGTERM, signal.SIG_IGN)
 
+		# product of ticker requested to polling module
+		self.prod = prod
+
+		# positions are refreshed every interval when tickers are pushed
+		if self.tickq is not None:
+			self.posttl = interval
+
+		# sampling on fixed deadlines when tickers are not pushed
+		sched = scheduler.scheduler(interval, self.stop_flag, self.logger)
+
 		while True:
 			# terminate if stop flag is set
 			if self.stop_flag.is_set():
 				self.logger.debug("terminate signal received, bye")
 				break
 
+			# react to every ticker pushed by polling module
+			ticker = None
+			if self.tickq is not None:
+				ticker = self.tickq.get(timeout=interval)
+				if ticker is None:
+					continue
+				latency.stamp(ticker, "receipt")
+				# price trigger is judged at the price of the ticker crossing it,
+				# feed status and health are pushed as event
+				if ticker.get("event") == "trigger":
+					self.logger.info("%d triggers fired at %.1f" % (len(ticker["triggers"]), ticker["last"]))
+					ticker = {"last" : ticker["last"], "stamps" : ticker["stamps"]}
+				elif "event" in ticker:
+					self.checkEvent(ticker)
+					continue
+				else:
+					self.checkStale(ticker)
+
+			# do not sell while ticker feed is stale
+			if self.stale:
+				if self.tickq is None:
+					self.getTicker()	# check recovery
+					sched.wait()
+				continue
+
 			try:
-				self.checkPosition(prod, profit_border, cut_border, size)
-			except pybitflyer.exception.AuthException as e:
+				self.checkPosition(prod, profit_border, cut_border, size, ticker)
+			except exchange.autherror as e:
 				self.logger.error(str(e))
-			except JSONDecodeError:
+			except exchange.exchangeerror as e:
 				# communication error occurred
-				self.logger.warning("JSON Decode Error has occurred")
+				self.logger.warning("could not invoke exchange API: %s" % str(e))
 			except:
 				raise
 
-			time.sleep(interval)
+			if self.tickq is None:
+				sched.wait()
+
+		# unregister price triggers
+		if self.tickq is not None and self.poll_reqq is not None and self.trigsource is not None:
+			self.poll_reqq.put({"cmd" : "clear triggers", "client" : self.clientid, "product" : prod})
+		self.latency.log()
 
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+import numpy as np
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+import ringbuffer
+
+
+class tickersnapshot:
+	"""
+	latest ticker snapshot shared among processes.
+
+	polling module publishes the latest ticker and indicator values into a
+	shared memory block, and consumers (scalping, sell, etc.) read it without
+	any IPC round trip. the block is protected by seqlock:
+	 - writer increments the sequence number (odd: being written), writes
+	   the values, and increments the sequence number again (even: stable)
+	 - reader retries until it reads the same even sequence number before
+	   and after copying the values
+
+	layout of shared memory:
+	 - header (32 bytes)
+	   - seq     : sequence number (uint64)
+	   - nfields : number of fields (uint32)
+	   - flags   : status flags (uint32), FLAG_STALE is set while the
+	               ticker feed is stale
+	   - product : product code (16 bytes)
+	 - field names (16 bytes each)
+	 - values (float64 each)
+	"""
+
+	HDRTYPE = np.dtype([("seq", "<u8"), ("nfields", "<u4"), ("flags", "<u4"), ("product", "S16")])
+	NAMESIZE = 16
+	FLAG_STALE = 0x00000001
+
+	# ticker fields, "timestamp" and "datetime" are stored as epoch time
+	TICKER_FIELDS = ringbuffer.tickerbuffer.COLUMNS
+
+	def __init__(self, fields=None, name=None):
+		""" constructor
+		 - fields : list of field names to create new shared memory
+		 - name   : name of existing shared memory to attach
+
+		either fields or name must be specified.
+		"""
+		if fields is not None:
+			size = self.HDRTYPE.itemsize + len(fields) * (self.NAMESIZE + 8)
+			self.shm = shared_memory.SharedMemory(create=True, size=size)
+			self.owner = True
+			self.map(len(fields))
+			self.hdr["nfields"] = len(fields)
+			for idx, field in enumerate(fields):
+				self.names[idx] = field.encode()
+		elif name is not None:
+			self.shm = shared_memory.SharedMemory(name=name)
+			# the segment is owned (unlinked) by the creator
+			resource_tracker.unregister(self.shm._name, "shared_memory")
+			self.owner = False
+			nfields = int(np.ndarray((1,), dtype=self.HDRTYPE, buffer=self.shm.buf)["nfields"][0])
+			self.map(nfields)
+		else:
+			raise ValueError("fields or name must be specified")
+
+		self.name = self.shm.name
+		self.fields = [fld.decode() for fld in self.names]
+		self.fieldidx = {}
+		for idx, field in enumerate(self.fields):
+			self.fieldidx[field] = idx
+
+
+	def map(self, nfields):
+		""" map header, field names and values to shared memory
+		 - nfields : number of fields
+		"""
+		buf = self.shm.buf
+		self.hdr = np.ndarray((1,), dtype=self.HDRTYPE, buffer=buf)
+		self.names = np.ndarray((nfields,), dtype="S%d" % self.NAMESIZE, buffer=buf,
+		                        offset=self.HDRTYPE.itemsize)
+		self.values = np.ndarray((nfields,), dtype="<f8", buffer=buf,
+		                         offset=self.HDRTYPE.itemsize + nfields * self.NAMESIZE)
+
+
+	@staticmethod
+	def tickerfields(windows):
+		""" get field names for ticker and SMA/WMA of the windows
+		 - windows : list of SMA/WMA window lengths
+		"""
+		fields = list(tickersnapshot.TICKER_FIELDS)
+		for n in sorted(set(windows)):
+			fields.append("sma%d" % n)
+			fields.append("wma%d" % n)
+		return fields
+
+
+	def publish(self, values, product=""):
+		""" publish values (writer only)
+		 - values  : dict keyed by field name, unknown keys are ignored
+		 - product : product code
+		"""
+		newvals = self.values.copy()
+		for field, idx in self.fieldidx.items():
+			if field in values:
+				newvals[idx] = values[field]
+
+		seq = int(self.hdr["seq"][0])
+		self.hdr["seq"] = seq + 1	# odd: being written
+		self.values[:] = newvals
+		self.hdr["product"] = product.encode()
+		self.hdr["flags"] = int(self.hdr["flags"][0]) & ~self.FLAG_STALE
+		self.hdr["seq"] = seq + 2	# even: stable
+
+
+	def setstale(self, stale):
+		""" set or clear stale flag of the published ticker (writer only)
+		 - stale : True if the ticker feed is stale
+		"""
+		flags = int(self.hdr["flags"][0])
+		if stale:
+			flags |= self.FLAG_STALE
+		else:
+			flags &= ~self.FLAG_STALE
+
+		seq = int(self.hdr["seq"][0])
+		self.hdr["seq"] = seq + 1	# odd: being written
+		self.hdr["flags"] = flags
+		self.hdr["seq"] = seq + 2	# even: stable
+
+
+	def publishticker(self, ticker, xmas):
+		""" publish ticker and SMA/WMA (writer only)
+		 - ticker : ticker object returned by polling.ticker()
+		 - xmas   : dict of SMA/WMA, e.g. {"sma30": ..., "wma30": ...}
+		"""
+		values = dict(xmas)
+		values["last"] = ticker["last"]
+		values["best_bid"] = ticker["best_bid"]
+		values["best_ask"] = ticker["best_ask"]
+		values["timestamp"] = ringbuffer.str2epoch(ticker["timestamp"])
+		values["datetime"] = time.time()
+		self.publish(values, ticker.get("product", ""))
+
+
+	def read(self, retry=1000):
+		""" read consistent copy of values
+		 - retry : maximum number of retries while writer is writing
+
+		return (sequence number, values, product, flags), or None if nothing
+		has been published yet or snapshot could not be taken.
+		"""
+		for count in range(retry):
+			seq1 = int(self.hdr["seq"][0])
+			if seq1 == 0:
+				return None
+			if seq1 & 1:	# being written
+				continue
+			values = self.values.copy()
+			product = self.hdr["product"][0].decode()
+			flags = int(self.hdr["flags"][0])
+			seq2 = int(self.hdr["seq"][0])
+			if seq1 == seq2:
+				return (seq1 // 2, values, product, flags)
+		return None
+
+
+	def readticker(self):
+		""" read the latest ticker with SMA/WMA
+
+		return ticker object in the same format as 'get ticker' response of
+		polling module, or None if no ticker has been published.
+		"""
+		snap = self.read()
+		if snap is None:
+			return None
+
+		seq, values, product, flags = snap
+		ticker = {"product" : product, "stale" : bool(flags & self.FLAG_STALE)}
+		for field, idx in self.fieldidx.items():
+			ticker[field] = values[idx].item()
+		ticker["datetime"] = datetime.datetime.fromtimestamp(ticker["datetime"]).strftime(ringbuffer.tickerbuffer.DATETIME_FORMAT)
+		ticker["timestamp"] = ringbuffer.epoch2str(ticker["timestamp"])
+		return ticker
+
+
+	def close(self):
+		""" detach shared memory """
+		self.hdr = None
+		self.names = None
+		self.values = None
+		self.shm.close()
+
+
+	def unlink(self):
+		""" remove shared memory (creator only) """
+		if self.owner:
+			self.shm.unlink()
@@ -32,6 +32,12 @@ class bitflyer:
 		# endpoint
 		self.endpoint = "https://api.bitflyer.jp"
 
+		# keep-alive session (reuse connection)
+		self.session = requests.Session()
+
+		# timeout of request (connect, read) [sec]
+		self.timeout = (3.05, 10)
+
 		# market
 		self.markets = []
 
@@ -83,7 +89,11 @@ class bitflyer:
 		# invoke
 		url = self.endpoint + api
 		# print("%s: URL=%s" % (sys._getframe().f_code.co_name, url))
-		req = requests.get(url)
+		try:
+			req = self.session.get(url, timeout=self.timeout)
+		except requests.RequestException as e:
+			print("ERROR: error occurred in invoking, %s\n" % str(e))
+			return
 		if req.status_code != 200:
 			print("ERROR: error occurred in invoking, errcd=%d\n" % req.status_code)
 			return
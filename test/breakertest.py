@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# circuit breaker must not be wedged in half-open state when the probe
+# call is refused by rate limiter (no network access is required)
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import exchange
+
+
+if __name__ == "__main__":
+	# nothing listens on this port, every call fails as transient error
+	exchange.setendpoint("http://127.0.0.1:1")
+	exchange.RETRIES = 0
+	api = exchange.create("bitflyer")
+	api.breaker.cooldown = api.breaker.maxcooldown = 0.1
+
+	# open the breaker
+	for i in range(api.breaker.threshold):
+		try:
+			api.fetchticker("BTC_JPY")
+		except exchange.exchangeerror:
+			pass
+	assert api.breaker.state == exchange.circuitbreaker.OPEN
+
+	# probe is refused by exhausted rate limit
+	limiter = exchange.ratelimiter(["bitflyer"], public=(0.01, 1), maxwait=0)
+	limiter.acquire("bitflyer", False, "ticker")
+	exchange.setratelimiter(limiter)
+	time.sleep(0.2)
+	try:
+		api.fetchticker("BTC_JPY")
+		assert False, "call must be refused"
+	except exchange.ratelimited:
+		pass
+	assert api.breaker.state == exchange.circuitbreaker.OPEN, api.breaker.state
+
+	# the next call probes the exchange instead of being refused by the breaker
+	exchange.setratelimiter(None)
+	try:
+		api.fetchticker("BTC_JPY")
+	except exchange.circuitopen:
+		assert False, "breaker is wedged in half-open state"
+	except exchange.exchangeerror:
+		pass
+	print("OK")
+
+	sys.exit(0)
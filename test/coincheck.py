@@ -19,6 +19,12 @@ class coincheck:
 		""" constructor """
 		self.endpoint = "https://coincheck.com/"
 
+		""" keep-alive session (reuse connection) """
+		self.session = requests.Session()
+
+		""" timeout of request (connect, read) [sec] """
+		self.timeout = (3.05, 10)
+
 		""" set of ticker """
 		self.tickers = []
     
@@ -37,7 +43,11 @@ class coincheck:
 		# invoke
 		url = self.endpoint + api
 		# print("%s: URL=%s" % (sys._getframe().f_code.co_name, url))
-		req = requests.get(url)
+		try:
+			req = self.session.get(url, timeout=self.timeout)
+		except requests.RequestException as e:
+			print("ERROR: error occurred in invoking, %s\n" % str(e))
+			return
 		if req.status_code != 200:
 			print("ERROR: error occurred in invoking, errcd=%d\n" % req.status_code)
 			return
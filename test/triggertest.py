@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# randomized model check of trigger index (incremental insert/delete) and
+# ledger (FIFO lots, entry price buffer and journal)
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import trigger
+import ledger
+
+
+def checktrigger(rng, steps):
+	""" compare trigger index with brute force over random add/remove/cross """
+	index = trigger.triggerindex()
+	live = {}		# key : (upper, lower)
+	added = set()	# keys added since the previous price
+	prev = None
+	for step in range(steps):
+		if rng.random() < 0.3 or len(live) == 0:
+			key = step
+			upper = float(rng.integers(90, 111))
+			lower = float(rng.integers(90, 111))
+			index.add(key, upper, lower)
+			live[key] = (upper, lower)
+			added.add(key)
+		if rng.random() < 0.2:
+			key = list(live)[rng.integers(len(live))]
+			upper, lower = live.pop(key)
+			assert index.remove(key, upper, lower) == 2
+			added.discard(key)
+		if rng.random() < 0.01:
+			index.reset()
+			prev = None
+
+		price = float(rng.integers(90, 111))
+		ups, lows = index.crossed(price)
+
+		# fire if beyond the price and crossed since the previous price (or
+		# the first price, or added beyond the previous price)
+		expup = {key for key, (upper, lower) in live.items()
+		         if upper < price and (prev is None or key in added or upper >= prev)}
+		explow = {key for key, (upper, lower) in live.items()
+		          if lower > price and (prev is None or key in added or lower <= prev)}
+		assert set(ups.tolist()) == expup and len(ups) == len(expup), (step, sorted(ups.tolist()), sorted(expup))
+		assert set(lows.tolist()) == explow and len(lows) == len(explow), (step, sorted(lows.tolist()), sorted(explow))
+		assert len(index.upper) == len(live) and np.all(np.diff(index.upper.prices()) >= 0)
+		assert len(index.lower) == len(live) and np.all(np.diff(index.lower.prices()) >= 0)
+		prev = price
+		added = set()
+
+
+def checkledger(rng, steps):
+	""" compare ledger with naive FIFO lots over random fills """
+	led = ledger.ledger("BTC_JPY", journal=True)
+	lots = []		# [id, price, size] of naive model
+	journal = set()	# open lot IDs replayed from journal
+	eid = 0
+	for step in range(steps):
+		execs = []
+		for count in range(rng.integers(0, 4)):
+			eid += 1
+			size = float(rng.integers(1, 4))
+			if rng.random() < 0.55:
+				ent = {"id" : eid, "side" : "BUY", "price" : float(rng.integers(90, 111)), "size" : size}
+				lots.append([eid, ent["price"], size])
+			else:
+				ent = {"id" : eid, "side" : "SELL", "price" : 100.0, "size" : size}
+				while size > 0 and len(lots) > 0:
+					closed = min(size, lots[0][2])
+					lots[0][2] -= closed
+					size -= closed
+					if lots[0][2] <= 0:
+						lots.pop(0)
+			execs.append(ent)
+		rng.shuffle(execs)
+		led.apply(execs)
+
+		for kind, lot in led.takechanges():
+			if kind == "open":
+				journal.add(lot["id"])
+			else:
+				journal.remove(lot["id"])
+
+		assert [lot["id"] for lot in led.positions()] == [lot[0] for lot in lots], step
+		assert [lot["size"] for lot in led.positions()] == [lot[2] for lot in lots], step
+		assert led.prices().tolist() == [lot[1] for lot in lots], step
+		assert journal == set([lot[0] for lot in lots]), step
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='randomized model check of trigger index and ledger')
+	parser.add_argument('--steps', metavar='n', dest='steps',
+	                    type=int, required=False, default=20000,
+	                    help='number of random steps')
+	parser.add_argument('--seed', metavar='n', dest='seed',
+	                    type=int, required=False, default=1,
+	                    help='random seed')
+	args = parser.parse_args()
+
+	checktrigger(np.random.default_rng(args.seed), args.steps)
+	checkledger(np.random.default_rng(args.seed), args.steps)
+	print("OK")
+
+	sys.exit(0)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import argparse
+import numpy as np
+
+import ringbuffer
+
+
+class tickstore:
+	"""
+	append-only binary tick store backed by memory-mapped file.
+
+	file format (little endian):
+	 - header (64 bytes)
+	   - magic     : "VCTSTICK"
+	   - version   : format version (uint32)
+	   - recsize   : size of a record [byte] (uint32)
+	   - count     : number of committed records (uint64)
+	 - records (32 bytes each)
+	   - timestamp : exchange timestamp (epoch, UTC) (float64)
+	   - last      : last price (float64)
+	   - best_bid  : the highest bid price (float64)
+	   - best_ask  : the lowest ask price (float64)
+
+	the writer stores a record first and then increments 'count', so
+	readers in other processes never see a partially written record.
+	readers map the same file read-only and get the records as numpy array
+	without copying.
+	"""
+
+	MAGIC = b"VCTSTICK"
+	VERSION = 1
+	HDRSIZE = 64
+	HDRTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("recsize", "<u4"), ("count", "<u8")])
+	RECTYPE = np.dtype([("timestamp", "<f8"), ("last", "<f8"), ("best_bid", "<f8"), ("best_ask", "<f8")])
+
+	# number of records allocated at once when the file grows
+	GROW = 60 * 60 * 24
+
+	def __init__(self, path, readonly=True):
+		""" constructor
+		 - path     : path to tick store file
+		 - readonly : True for reader, False for writer
+
+		the file is created by the writer if it does not exist.
+		"""
+		self.path = path
+		self.readonly = readonly
+		self.fd = -1
+		self.mm = None
+		self.hdr = None
+		self.recs = None
+		self.capacity = 0
+
+		if readonly:
+			self.fd = os.open(path, os.O_RDONLY)
+		else:
+			self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+			if os.fstat(self.fd).st_size == 0:
+				self.init()
+		self.map()
+
+
+	def init(self):
+		""" write header to empty file """
+		hdr = np.zeros(1, dtype=self.HDRTYPE)
+		hdr["magic"] = self.MAGIC
+		hdr["version"] = self.VERSION
+		hdr["recsize"] = self.RECTYPE.itemsize
+		hdr["count"] = 0
+		os.ftruncate(self.fd, self.HDRSIZE)
+		os.pwrite(self.fd, hdr.tobytes(), 0)
+
+
+	def map(self):
+		""" map the whole file to memory """
+		size = os.fstat(self.fd).st_size
+		if size < self.HDRSIZE:
+			raise ValueError("%s is not a tick store file" % self.path)
+
+		if self.readonly:
+			mm = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+		else:
+			mm = mmap.mmap(self.fd, size, access=mmap.ACCESS_WRITE)
+
+		hdr = np.ndarray((1,), dtype=self.HDRTYPE, buffer=mm, offset=0)
+		if hdr["magic"][0] != self.MAGIC or hdr["recsize"][0] != self.RECTYPE.itemsize:
+			raise ValueError("%s is not a tick store file" % self.path)
+		if hdr["version"][0] != self.VERSION:
+			raise ValueError("unsupported tick store version %d" % hdr["version"][0])
+
+		self.capacity = (size - self.HDRSIZE) // self.RECTYPE.itemsize
+		self.mm = mm
+		self.hdr = hdr
+		self.recs = np.ndarray((self.capacity,), dtype=self.RECTYPE, buffer=mm, offset=self.HDRSIZE)
+
+
+	def unmap(self):
+		""" unmap the file
+
+		the memory map of writer is closed explicitly. that of reader is
+		released when all arrays returned by records() are released.
+		"""
+		self.hdr = None
+		self.recs = None
+		if self.mm is not None and not self.readonly:
+			self.mm.flush()
+			try:
+				self.mm.close()
+			except BufferError:
+				# still referenced by records(), released by GC
+				pass
+		self.mm = None
+
+
+	def close(self):
+		""" unmap and close the file """
+		self.unmap()
+		if self.fd >= 0:
+			os.close(self.fd)
+			self.fd = -1
+
+
+	def __len__(self):
+		""" number of committed records """
+		if self.hdr is None:
+			return 0
+		return int(self.hdr["count"][0])
+
+
+	def grow(self, num):
+		""" extend the file to store additional records
+		 - num : number of records to be stored
+		"""
+		count = len(self)
+		if count + num <= self.capacity:
+			return
+		newcap = self.capacity + max(num, self.GROW)
+		self.unmap()
+		os.ftruncate(self.fd, self.HDRSIZE + newcap * self.RECTYPE.itemsize)
+		self.map()
+
+
+	def append(self, ticker):
+		""" append ticker
+		 - ticker : ticker object returned by polling.ticker()
+		"""
+		self.grow(1)
+		count = len(self)
+		rec = self.recs[count]
+		rec["timestamp"] = ringbuffer.str2epoch(ticker["timestamp"])
+		rec["last"] = ticker["last"]
+		rec["best_bid"] = ticker["best_bid"]
+		rec["best_ask"] = ticker["best_ask"]
+		self.hdr["count"] = count + 1
+
+
+	def extend(self, recs):
+		""" append records at once
+		 - recs : numpy array of RECTYPE
+		"""
+		num = len(recs)
+		if num == 0:
+			return
+		self.grow(num)
+		count = len(self)
+		self.recs[count:count + num] = recs
+		self.hdr["count"] = count + num
+
+
+	def refresh(self):
+		""" remap the file if the writer has extended it (reader only) """
+		if self.readonly and len(self) >= self.capacity:
+			if os.fstat(self.fd).st_size > self.HDRSIZE + self.capacity * self.RECTYPE.itemsize:
+				self.unmap()
+				self.map()
+
+
+	def records(self, count=0):
+		""" get committed records without copying
+		 - count : number of latest records, 0 indicates all records
+
+		return numpy array of RECTYPE (read-only for reader).
+		"""
+		self.refresh()
+		num = len(self)
+		if count <= 0 or count > num:
+			count = num
+		return self.recs[num - count:num]
+
+
+	def flush(self):
+		""" flush written records to the file (writer only) """
+		if self.mm is not None and not self.readonly:
+			self.mm.flush()
+
+
+def csv2store(csvfile, storefile, chunk=1024 * 1024):
+	""" convert ticker CSV written by polling module to tick store
+	 - csvfile   : path to ticker CSV (datetime,product,last,best_bid,best_ask,timestamp)
+	 - storefile : path to tick store, records are appended if it exists
+	 - chunk     : number of rows converted at once
+
+	return number of converted rows.
+	"""
+	store = tickstore(storefile, readonly=False)
+	nrow = 0
+	try:
+		with open(csvfile, "r") as fp:
+			while True:
+				lines = fp.readlines(chunk * 64)
+				if len(lines) == 0:
+					break
+
+				cols = [[], [], [], []]
+				for line in lines:
+					ent = line.rstrip("\n").split(",")
+					if len(ent) != 6 or ent[0] == "datetime":
+						continue
+					cols[0].append(ent[5])
+					cols[1].append(ent[2])
+					cols[2].append(ent[3])
+					cols[3].append(ent[4])
+				if len(cols[0]) == 0:
+					continue
+
+				recs = np.zeros(len(cols[0]), dtype=tickstore.RECTYPE)
+				recs["timestamp"] = ringbuffer.strs2epoch(cols[0])
+				recs["last"] = np.array(cols[1], dtype=np.float64)
+				recs["best_bid"] = np.array(cols[2], dtype=np.float64)
+				recs["best_ask"] = np.array(cols[3], dtype=np.float64)
+				store.extend(recs)
+				nrow += len(recs)
+	finally:
+		store.close()
+
+	return nrow
+
+
+################################################################################
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='convert ticker CSV to binary tick store')
+	parser.add_argument('csvfile', metavar='csv',
+	                    type=str,
+	                    help='path to ticker CSV (ticker_<exchange>.csv)')
+	parser.add_argument('storefile', metavar='bin',
+	                    type=str,
+	                    help='path to tick store (ticker_<exchange>.bin)')
+	args = parser.parse_args()
+
+	if not os.path.exists(args.csvfile):
+		print("ERROR: %s not found" % args.csvfile)
+		sys.exit(1)
+
+	nrow = csv2store(args.csvfile, args.storefile)
+	print("INFO: %d rows converted" % nrow)
+
+	sys.exit(0)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class levels:
+	"""
+	sorted trigger prices and their keys, kept in preallocated buffers so
+	that a trigger is inserted or deleted by shifting the tail in place.
+	"""
+
+	MINSIZE = 16
+
+	def __init__(self):
+		""" constructor """
+		self.buf = np.zeros(self.MINSIZE, dtype=np.float64)
+		self.keybuf = np.zeros(self.MINSIZE, dtype=np.int64)
+		self.n = 0
+
+
+	def __len__(self):
+		return self.n
+
+
+	def prices(self):
+		""" get sorted trigger prices (view) """
+		return self.buf[:self.n]
+
+
+	def keys(self):
+		""" get keys in the order of trigger prices (view) """
+		return self.keybuf[:self.n]
+
+
+	def set(self, prices, keys=None):
+		""" replace all triggers
+		 - prices : array of trigger prices
+		 - keys   : keys of the triggers (default: index)
+		"""
+		prices = np.asarray(prices if prices is not None else [], dtype=np.float64)
+		if keys is None:
+			keys = np.arange(len(prices), dtype=np.int64)
+		order = np.argsort(prices, kind="stable")
+		size = max(self.MINSIZE, len(prices) * 2)
+		self.buf = np.zeros(size, dtype=np.float64)
+		self.keybuf = np.zeros(size, dtype=np.int64)
+		self.n = len(prices)
+		self.buf[:self.n] = prices[order]
+		self.keybuf[:self.n] = np.asarray(keys, dtype=np.int64)[order]
+
+
+	def insert(self, price, key):
+		""" insert a trigger after the triggers of the same price """
+		n = self.n
+		if n == len(self.buf):
+			self.buf = np.concatenate([self.buf, np.zeros(n, dtype=np.float64)])
+			self.keybuf = np.concatenate([self.keybuf, np.zeros(n, dtype=np.int64)])
+		idx = int(np.searchsorted(self.buf[:n], price, "right"))
+		self.buf[idx + 1:n + 1] = self.buf[idx:n]
+		self.keybuf[idx + 1:n + 1] = self.keybuf[idx:n]
+		self.buf[idx] = price
+		self.keybuf[idx] = key
+		self.n = n + 1
+
+
+	def delete(self, price, key):
+		""" delete a trigger
+
+		return 1 if deleted, 0 if not found.
+		"""
+		n = self.n
+		st = int(np.searchsorted(self.buf[:n], price, "left"))
+		end = int(np.searchsorted(self.buf[:n], price, "right"))
+		hits = np.nonzero(self.keybuf[st:end] == key)[0]
+		if len(hits) == 0:
+			return 0
+		idx = st + int(hits[0])
+		self.buf[idx:n - 1] = self.buf[idx + 1:n]
+		self.keybuf[idx:n - 1] = self.keybuf[idx + 1:n]
+		self.n = n - 1
+		return 1
+
+
+class triggerindex:
+	"""
+	price-level trigger index.
+
+	trigger prices are kept in two sorted arrays:
+	 - upper : fires when the price rises above the trigger price
+	           (price > trigger, e.g. take-profit)
+	 - lower : fires when the price falls below the trigger price
+	           (price < trigger, e.g. stop-loss)
+
+	on each new price, the triggers crossed since the previous price are
+	found by bisecting the arrays at the previous and the new prices, so
+	that the cost per price depends on the number of fired triggers, not on
+	the number of triggers. the first price after build() or reset() fires
+	all triggers beyond the price.
+
+	triggers are added and removed one by one (add(), remove()) by
+	inserting into and deleting from the sorted arrays, so that the index
+	is not sorted again when a position is opened or closed. a trigger
+	added beyond the previous price fires on the next price if it is still
+	beyond the price.
+	"""
+
+	def __init__(self):
+		""" constructor """
+		self.upper = levels()
+		self.lower = levels()
+		self.prev = None
+
+		# (price, key) of added triggers which are beyond the previous price
+		self.pendup = []
+		self.pendlow = []
+
+
+	def __len__(self):
+		return len(self.upper) + len(self.lower)
+
+
+	def build(self, upper=None, lower=None, upperkeys=None, lowerkeys=None):
+		""" build index
+		 - upper     : array of upper trigger prices
+		 - lower     : array of lower trigger prices
+		 - upperkeys : keys returned for upper triggers (default: index)
+		 - lowerkeys : keys returned for lower triggers (default: index)
+		"""
+		self.upper.set(upper, upperkeys)
+		self.lower.set(lower, lowerkeys)
+		self.prev = None
+		self.pendup = []
+		self.pendlow = []
+
+
+	def add(self, key, upper=None, lower=None):
+		""" add triggers of a key
+		 - key   : key returned when the triggers fire
+		 - upper : upper trigger price (None indicates no upper trigger)
+		 - lower : lower trigger price (None indicates no lower trigger)
+		"""
+		if upper is not None:
+			self.upper.insert(upper, key)
+			if self.prev is not None and upper < self.prev:
+				self.pendup.append((upper, key))
+		if lower is not None:
+			self.lower.insert(lower, key)
+			if self.prev is not None and lower > self.prev:
+				self.pendlow.append((lower, key))
+
+
+	def remove(self, key, upper=None, lower=None):
+		""" remove triggers of a key
+		 - key   : key of the triggers
+		 - upper : upper trigger price given to add() or build()
+		 - lower : lower trigger price given to add() or build()
+
+		return number of removed triggers.
+		"""
+		nremove = 0
+		if upper is not None:
+			nremove += self.upper.delete(upper, key)
+			if len(self.pendup) > 0:
+				self.pendup = [ent for ent in self.pendup if ent[1] != key]
+		if lower is not None:
+			nremove += self.lower.delete(lower, key)
+			if len(self.pendlow) > 0:
+				self.pendlow = [ent for ent in self.pendlow if ent[1] != key]
+		return nremove
+
+
+	def reset(self):
+		""" forget the previous price, so that the next price fires all
+		    triggers beyond it (e.g. to retry failed actions)
+		"""
+		self.prev = None
+
+
+	def crossed(self, price):
+		""" find triggers crossed by the price
+		 - price : new price
+
+		return (keys of fired upper triggers, keys of fired lower triggers).
+		"""
+		prev = self.prev
+		self.prev = price
+		upper = self.upper.prices()
+		lower = self.lower.prices()
+		if prev is None:
+			# upper < price, lower > price
+			self.pendup = []
+			self.pendlow = []
+			iup = (0, np.searchsorted(upper, price, "left"))
+			ilow = (np.searchsorted(lower, price, "right"), len(lower))
+		elif price > prev:
+			# prev <= upper < price
+			iup = np.searchsorted(upper, [prev, price], "left")
+			ilow = (0, 0)
+		elif price < prev:
+			# price < lower <= prev
+			iup = (0, 0)
+			ilow = np.searchsorted(lower, [price, prev], "right")
+		else:
+			iup = ilow = (0, 0)
+		upkeys = self.upper.keys()[iup[0]:iup[1]]
+		lowkeys = self.lower.keys()[ilow[0]:ilow[1]]
+
+		# added triggers which were already beyond the previous price
+		# (not included in the ranges above)
+		if len(self.pendup) > 0:
+			keys = [key for level, key in self.pendup if level < price]
+			upkeys = np.concatenate([upkeys, np.array(keys, dtype=np.int64)])
+			self.pendup = []
+		if len(self.pendlow) > 0:
+			keys = [key for level, key in self.pendlow if level > price]
+			lowkeys = np.concatenate([lowkeys, np.array(keys, dtype=np.int64)])
+			self.pendlow = []
+		return upkeys, lowkeys
@@ -12,8 +12,16 @@ from multiprocessing import Process, Queue, Event
 import signal
 
 import polling
+import asyncpoll
+import crosspoll
 import scalping
 import sell
+import snapshot
+import exchange
+import latency
+import health
+import gateway
+import pubsub
 
 # log directory
 logdir = ""
@@ -34,12 +42,39 @@ class vcts:
 		self.prod = ""
 		self.apikey = ""
 		self.apisecret = ""
+		self.endpoint = ""
+		self.latencyitv = 60.0
+		self.healthttl = 5.0
+		self.dryrun = True
+
+		# rate limiter (rate [calls/sec], burst)
+		self.ratepublic = (1.6, 10)
+		self.rateprivate = (1.6, 10)
+		self.ratemaxwait = 2.0
+
+		# health monitor
+		self.health = None
+		self.p_health = None
+
+		# order gateway
+		self.gateway = None
+		self.p_gateway = None
+		self.gwenable = True
+		self.gwwindow = 0.005
+		self.gwmaxbatch = 50
 
 		# polling module
 		self.poll = None
 		self.p_poll = None
 		self.pollitv = 0
 		self.pollcount = 0
+		self.pollwindows = [30, 60]
+		self.pollflushrows = 0
+		self.pollflushitv = 0
+		self.polloutput = []
+		self.pollprods = []
+		self.pollcrossexch = ""
+		self.pollhedge = 0
 
 		# scalping module	
 		self.scalp = None
@@ -47,6 +82,8 @@ class vcts:
 		self.scalpitv = 0
 		self.scalpsize = 0
 		self.scalpexp = 0
+		self.scalpqsize = 64
+		self.scalpoverflow = "drop_oldest"
 
 		# sell module
 		self.sell = None
@@ -55,11 +92,16 @@ class vcts:
 		self.sellsize = 0
 		self.sellprofbdr = 0
 		self.sellcutbdr = 0
+		self.sellqsize = 64
+		self.selloverflow = "conflate"
 
 		# inter-processing communication
 		self.poll_reqq = None
 		self.poll_rspq = None
 		self.q_get_tov = 0
+		self.snapshot = None
+		self.scalp_tickq = None
+		self.sell_tickq = None
 
 		# log info
 		self.logdir = logdir
@@ -87,21 +129,48 @@ class vcts:
 			self.setAPIKey(inifile.get('global', 'apikey'))
 			self.setAPISecret(inifile.get('global', 'apisecret'))
 			self.q_get_tov = int(inifile.get('global', 'q_get_tov'))
+			self.endpoint = inifile.get('global', 'endpoint', fallback='').strip()
+			self.latencyitv = float(inifile.get('global', 'latency_log_interval', fallback='60'))
+			self.healthttl = float(inifile.get('global', 'health_ttl', fallback='5'))
+			self.dryrun = inifile.getboolean('global', 'dry_run', fallback=True)
+
+			# rate limit parameters
+			self.ratepublic  = (float(inifile.get('ratelimit', 'public_rate', fallback='1.6')),
+			                    float(inifile.get('ratelimit', 'public_burst', fallback='10')))
+			self.rateprivate = (float(inifile.get('ratelimit', 'private_rate', fallback='1.6')),
+			                    float(inifile.get('ratelimit', 'private_burst', fallback='10')))
+			self.ratemaxwait = float(inifile.get('ratelimit', 'max_wait', fallback='2'))
 
 			# polling parameters
-			self.pollitv   = int(inifile.get('polling', 'interval'))
+			self.pollitv   = float(inifile.get('polling', 'interval'))
 			self.pollcount = int(inifile.get('polling', 'count'))
+			self.pollwindows = [int(n) for n in inifile.get('polling', 'windows', fallback='30, 60').split(',') if len(n.strip()) > 0]
+			self.pollflushrows = int(inifile.get('polling', 'flush_rows', fallback='60'))
+			self.pollflushitv  = float(inifile.get('polling', 'flush_interval', fallback='5'))
+			self.polloutput = [fmt.strip().lower() for fmt in inifile.get('polling', 'output', fallback='csv').split(',') if len(fmt.strip()) > 0]
+			self.pollprods = [prod.strip().lower() for prod in inifile.get('polling', 'products', fallback='').split(',') if len(prod.strip()) > 0]
+			self.pollcrossexch = inifile.get('polling', 'cross_exchange', fallback='').strip().lower()
+			self.pollhedge = float(inifile.get('polling', 'hedge_percentile', fallback='0'))
+
+			# order gateway parameters
+			self.gwenable   = inifile.getboolean('gateway', 'enable', fallback=True)
+			self.gwwindow   = float(inifile.get('gateway', 'batch_window', fallback='0.005'))
+			self.gwmaxbatch = int(inifile.get('gateway', 'max_batch', fallback='50'))
 
 			# scalping parameters
-			self.scalpitv  = int(inifile.get('scalping', 'interval'))
+			self.scalpitv  = float(inifile.get('scalping', 'interval'))
 			self.scalpsize = float(inifile.get('scalping', 'size'))
 			self.scalpexp  = int(inifile.get('scalping', 'expiration_date'))
+			self.scalpqsize    = int(inifile.get('scalping', 'tick_queue_size', fallback='64'))
+			self.scalpoverflow = inifile.get('scalping', 'tick_overflow', fallback='drop_oldest').lower()
 
 			# sell parameters
-			self.sellitv     = int(inifile.get('sell', 'interval'))
+			self.sellitv     = float(inifile.get('sell', 'interval'))
 			self.sellsize    = float(inifile.get('sell', 'size'))
 			self.sellprofbdr = float(inifile.get('sell', 'profit_border'))
 			self.sellcutbdr  = float(inifile.get('sell', 'cut_border'))
+			self.sellqsize    = int(inifile.get('sell', 'tick_queue_size', fallback='64'))
+			self.selloverflow = inifile.get('sell', 'tick_overflow', fallback='conflate').lower()
 
 		except configparser.NoSectionError as e:
 			logging.critical("section '%s' not found in %s" % (e.args, args.inifile))
@@ -111,11 +180,18 @@ class vcts:
 			sys.exit(1)
 
 		# debug
-		print("[global] exchange=%s, product=%s, apikey=%s, apisecret=%s, q_get_tov=%d" % \
-		      (self.exch, self.prod, self.apikey, self.apisecret, self.q_get_tov))
-		print("[polling]  interval=%d, count=%d" % (self.pollitv, self.pollcount))
-		print("[scalping] interval=%d, size=%f, expiration=%d" % (self.scalpitv, self.scalpsize, self.scalpexp))
-		print("[sell] size=%f, profit_border=%.3f, cut_border=%.3f" % (self.sellsize, self.sellprofbdr, self.sellcutbdr))
+		print("[global] exchange=%s, product=%s, apikey=%s, apisecret=%s, q_get_tov=%d, endpoint=%s, latency_log_interval=%g, health_ttl=%g, dry_run=%s" % \
+		      (self.exch, self.prod, self.apikey, self.apisecret, self.q_get_tov, self.endpoint, self.latencyitv, self.healthttl, self.dryrun))
+		print("[ratelimit] public=%g/s burst %g, private=%g/s burst %g, max_wait=%g" % \
+		      (self.ratepublic[0], self.ratepublic[1], self.rateprivate[0], self.rateprivate[1], self.ratemaxwait))
+		print("[polling]  interval=%g, count=%d, windows=%s, flush_rows=%d, flush_interval=%.1f, output=%s" % \
+		      (self.pollitv, self.pollcount, str(self.pollwindows), self.pollflushrows, self.pollflushitv, str(self.polloutput)))
+		print("[polling]  products=%s, cross_exchange=%s, hedge_percentile=%g" % (str(self.pollprods), self.pollcrossexch, self.pollhedge))
+		print("[gateway]  enable=%s, batch_window=%g, max_batch=%d" % (self.gwenable, self.gwwindow, self.gwmaxbatch))
+		print("[scalping] interval=%g, size=%f, expiration=%d, tick_queue_size=%d, tick_overflow=%s" % \
+		      (self.scalpitv, self.scalpsize, self.scalpexp, self.scalpqsize, self.scalpoverflow))
+		print("[sell] interval=%g, size=%f, profit_border=%.3f, cut_border=%.3f, tick_queue_size=%d, tick_overflow=%s" % \
+		      (self.sellitv, self.sellsize, self.sellprofbdr, self.sellcutbdr, self.sellqsize, self.selloverflow))
 
 
 	def setExchange(self, exch):
@@ -152,29 +228,132 @@ class vcts:
 	def run(self):
 		""" run VCTS """
 		try:
+			# API endpoint is overridden before adapters are created, so that
+			# all modules (and forked processes) access the same server
+			if len(self.endpoint) > 0:
+				exchange.setendpoint(self.endpoint)
+				logging.warning("API endpoint is overridden by %s" % self.endpoint)
+
+			# API calls of all processes draw on the same rate limit budgets
+			exchs = [self.exch] + ([self.pollcrossexch] if len(self.pollcrossexch) > 0 else [])
+			exchange.setratelimiter(exchange.ratelimiter(exchs, self.ratepublic, self.rateprivate, self.ratemaxwait))
+
+			# each exchange polls the product (cross-exchange) or all products
+			# once per interval, which must fit in the public budget
+			prods = [self.prod] + [prod for prod in self.pollprods if prod != self.prod]
+			nticker = 1 if len(self.pollcrossexch) > 0 else len(prods)
+			if self.ratepublic[0] > 0 and self.pollitv > 0 and nticker / self.pollitv > self.ratepublic[0]:
+				logging.warning("polling needs %g tickers/s, more than public_rate=%g/s, tickers will be throttled" %
+				                (nticker / self.pollitv, self.ratepublic[0]))
+
+			# per-stage latency is logged periodically by each module
+			latency.LOG_INTERVAL = self.latencyitv
+
+			# request queue is shared, reply queue is dedicated to each client
 			self.poll_reqq = Queue()
-			self.poll_rspq = Queue()
+			self.poll_rspq = {"scalping" : Queue(),
+			                  "sell"     : Queue()}
+
+			# shared memory snapshot of the latest ticker
+			self.snapshot = snapshot.tickersnapshot(snapshot.tickersnapshot.tickerfields(self.pollwindows))
+			logging.info("ticker snapshot=%s" % self.snapshot.name)
+
+			# tickers are pushed from polling module to each strategy
+			self.scalp_tickq = pubsub.subscription("scalping", self.scalpqsize, self.scalpoverflow)
+			self.sell_tickq = pubsub.subscription("sell", self.sellqsize, self.selloverflow)
 
 			# execute polling module
-			self.poll = polling.polling(self.exch,
-			                            self.logdir, self.loglevel,
-			                            self.poll_reqq,
-			                            self.poll_rspq,
-			                            stop_flag,
-			                            self.q_get_tov)
-			self.p_poll = Process(target=self.poll.pollticker, 
-		                        args=(self.prod, self.pollitv, self.pollcount))
+			# the product is polled on two exchanges by cross-exchange polling module,
+			# multiple products are polled concurrently by asyncio polling module
+			if len(self.pollcrossexch) > 0:
+				if len(prods) > 1:
+					logging.warning("'products' is ignored since 'cross_exchange' is specified")
+				self.poll = crosspoll.crosspolling([self.exch, self.pollcrossexch], self.prod,
+				                                   self.logdir, self.loglevel,
+				                                   self.poll_reqq,
+				                                   self.poll_rspq,
+				                                   stop_flag,
+				                                   self.q_get_tov,
+				                                   self.pollwindows,
+				                                   self.pollflushrows,
+				                                   self.pollflushitv,
+				                                   self.polloutput,
+				                                   self.snapshot,
+				                                   [self.scalp_tickq, self.sell_tickq],
+				                                   self.pollhedge)
+				self.p_poll = Process(target=self.poll.pollticker,
+				                      args=(self.pollitv, self.pollcount))
+			elif len(prods) > 1:
+				self.poll = asyncpoll.asyncpolling(self.exch, prods,
+				                                   self.logdir, self.loglevel,
+				                                   self.poll_reqq,
+				                                   self.poll_rspq,
+				                                   stop_flag,
+				                                   self.q_get_tov,
+				                                   self.pollwindows,
+				                                   self.pollflushrows,
+				                                   self.pollflushitv,
+				                                   self.polloutput,
+				                                   self.snapshot,
+				                                   [self.scalp_tickq, self.sell_tickq],
+				                                   self.pollhedge)
+				self.p_poll = Process(target=self.poll.pollticker,
+				                      args=(self.pollitv, self.pollcount))
+			else:
+				self.poll = polling.polling(self.exch,
+				                            self.logdir, self.loglevel,
+				                            self.poll_reqq,
+				                            self.poll_rspq,
+				                            stop_flag,
+				                            self.q_get_tov,
+				                            self.pollwindows,
+				                            self.pollflushrows,
+				                            self.pollflushitv,
+				                            self.polloutput,
+				                            self.snapshot,
+				                            [self.scalp_tickq, self.sell_tickq],
+				                            None,
+				                            self.pollhedge)
+				self.p_poll = Process(target=self.poll.pollticker, 
+				                      args=(self.prod, self.pollitv, self.pollcount))
 			self.p_poll.start()
 
+			# execute health monitor
+			# health is cached in shared memory and its change is pushed to strategies
+			if self.healthttl > 0:
+				self.health = health.healthmonitor(self.exch, self.prod, self.healthttl, stop_flag,
+				                                   self.loglevel, self.logdir)
+				self.p_health = Process(target=self.health.run,
+				                        args=([self.scalp_tickq, self.sell_tickq],))
+				self.p_health.start()
+
+			# execute order gateway
+			# private API client is owned by the gateway, strategies submit orders to it
+			scalp_orders = None
+			sell_orders = None
+			if self.gwenable:
+				self.gateway = gateway.ordergateway(self.exch, self.apikey, self.apisecret, stop_flag,
+				                                    self.loglevel, self.logdir,
+				                                    self.gwwindow, self.gwmaxbatch)
+				scalp_orders = self.gateway.client("scalping", self.q_get_tov)
+				sell_orders = self.gateway.client("sell", self.q_get_tov)
+				self.p_gateway = Process(target=self.gateway.run)
+				self.p_gateway.start()
+
 			# execute scalping module
 			self.scalp = scalping.scalping(self.exch, 
 			                               self.apikey,
 			                               self.apisecret,
 			                               self.logdir, self.loglevel,
 			                               self.poll_reqq,
-			                               self.poll_rspq,
+			                               self.poll_rspq["scalping"],
 			                               stop_flag,
-			                               self.q_get_tov)
+			                               self.q_get_tov,
+			                               self.snapshot,
+			                               self.scalp_tickq,
+			                               self.health,
+			                               scalp_orders,
+			                               self.dryrun)
 			self.p_scalp = Process(target=self.scalp.runscalp,
 			                       args=(self.prod, self.scalpitv, self.scalpsize, self.scalpexp))
 			self.p_scalp.start()
@@ -185,12 +364,19 @@ class vcts:
 			                      self.apisecret,
 			                      self.logdir, self.loglevel,
 			                      self.poll_reqq,
-			                      self.poll_rspq,
+			                      self.poll_rspq["sell"],
 			                      stop_flag,
-			                      self.q_get_tov)
+			                      self.q_get_tov,
+			                      self.snapshot,
+			                      self.sell_tickq,
+			                      self.health,
+			                      sell_orders,
+			                      self.dryrun)
 			self.p_sell = Process(target=self.sell.runsell,
 			                      args=(self.prod, self.sellitv, self.sellsize, self.sellprofbdr, self.sellcutbdr))
 			self.p_sell.start()
+			if self.dryrun:
+				logging.warning("dry run: orders of scalping and sell are logged but not placed")
 
 			# set signal handler
 			signal.signal(signal.SIGINT, signalHandler)
@@ -200,12 +386,25 @@ class vcts:
 			self.p_poll.join()
 			self.p_scalp.join()
 			self.p_sell.join()
+			if self.p_health is not None:
+				self.p_health.join()
+			if self.p_gateway is not None:
+				self.p_gateway.join()
 
 			self.p_poll.terminate()
 			self.p_scalp.terminate()
 			self.p_sell.terminate()
+			if self.p_health is not None:
+				self.p_health.terminate()
+			if self.p_gateway is not None:
+				self.p_gateway.terminate()
 		except:
 			raise
+		finally:
+			if self.snapshot is not None:
+				self.snapshot.close()
+				self.snapshot.unlink()
+				self.snapshot = None
 
 
 def signalHandler(signal, handler):